@@ -1,12 +1,21 @@
 from telethon import TelegramClient, events
 from datetime import datetime
 import pandas as pd
-import re
 import os
 from dotenv import load_dotenv
 import asyncio
 from termcolor import cprint
 import numpy as np
+from transaction_store import TransactionStore, GroupCommitWriter
+from daily_views import DailyViews
+from transaction_index import TransactionIndex
+from ingest_index import DedupeIndex, ColumnBuffer, to_ns
+from message_parser import parse_message, parse_messages, format_transaction
+from instrumentation import count, stage, timed
+from paths import MODEL_FILE, channel_csv
+from alert_rules import AlertRuleEngine
+from online_scorer import OnlineMovementScorer
+from message_archive import MessageArchive
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -17,240 +26,364 @@ DEFAULT_START_DATE = datetime(2017, 1, 1)
 CHANNELS = {
     'whalebot': {
         'url': 'https://t.me/whalebotalerts',
-        'pattern': r'(\d+(?:\.\d+)?)\s*BTC',
         'created_date': datetime(2023, 1, 1),
         'color': 'red'
     },
     'whale_alert': {
         'url': 'https://t.me/whale_alert_io',
-        'pattern': r'(\d+(?:\.\d+)?)\s*#BTC',
         'created_date': datetime(2022, 1, 1),
         'color': 'blue'
     }
 }
 
-# Создаем DataFrame для каждого бота
-dfs = {
-    'whalebot': pd.DataFrame(columns=['date', 'btc']),
-    'whale_alert': pd.DataFrame(columns=['date', 'btc'])
-}
+# Размер пакета истории и глубина очередей между чтением, разбором и записью
+HISTORY_BATCH_SIZE = 100
+HISTORY_QUEUE_SIZE = 8
 
-# Конфигурация отслеживаемых транзакций
-WATCHED_TRANSACTIONS = {
-    'whalebot': ['547 BTC', '840 BTC', '960 BTC'],
-    'whale_alert': ['547 #BTC', '840 #BTC', '960 #BTC']
-}
+# Групповая запись live-транзакций: по количеству строк или по времени
+LIVE_COMMIT_ROWS = 20
+LIVE_COMMIT_SECONDS = 10.0
 
-async def process_message(message, date, channel_name):
-    pattern = CHANNELS[channel_name]['pattern']
-    matches = re.search(pattern, message)
-    
-    # Извлекаем информацию о транзакции
-    from_to_pattern = r'from\s+(\w+)\s+to\s+(\w+)'
-    from_to_match = re.search(from_to_pattern, message, re.IGNORECASE)
+# Окно, в котором одинаковая сумма считается дубликатом
+DEDUPE_WINDOW = pd.Timedelta(minutes=1)
+
+# Индекс дубликатов для каждого бота
+dedupe_indexes = {name: DedupeIndex(DEDUPE_WINDOW) for name in CHANNELS}
+
+# Хранилища транзакций каналов, дневные представления и индексы по времени над ними
+stores = {}
+daily_views = DailyViews()
+time_indexes = {name: TransactionIndex(name) for name in CHANNELS}
+
+# Архив исходных сообщений: из него message_archive пересобирает таблицы без Telegram
+archives = {name: MessageArchive(name) for name in CHANNELS}
+
+# Правила отслеживаемых транзакций (суммы, допуски, каналы, окна)
+alert_rules = AlertRuleEngine()
+
+# Каналы, по корзинам которых обучена модель 04 (bots в create_combined_dataset)
+MODEL_CHANNELS = ('whalebot',)
+
+def get_channel_store(channel_name):
+    """
+    Возвращает хранилище канала. При первом обращении к пустому хранилищу старый CSV канала
+    откладывается (суммы в нем обрезаны прежним парсером), и история загружается заново
+    """
+    if channel_name not in stores:
+        store = TransactionStore(channel_name)
+        legacy_filename = store.retire_legacy_csv(channel_csv(channel_name))
+        if legacy_filename:
+            print(f"Старый {channel_csv(channel_name)} отложен в {legacy_filename}: суммы от 1000 BTC "
+                  f"в нем обрезаны прежним парсером, история {channel_name} будет загружена заново")
+        # Однократно строим дневные представления по уже накопленной истории
+        if daily_views.watermark(channel_name) is None and not store.is_empty():
+            daily_views.update(channel_name, store.read())
+        if len(time_indexes[channel_name]) == 0 and not store.is_empty():
+            time_indexes[channel_name].append(store.read())
+        stores[channel_name] = store
+    return stores[channel_name]
+
+@timed()
+def save_channel_data(channel_name, new_df, last_message_id=None):
+    """
+    Дописывает новые транзакции канала в хранилище (только записи новее водяного знака)
+    и вместе с ними фиксирует контрольную точку - id последнего обработанного сообщения
+    """
+    store = get_channel_store(channel_name)
+    added = store.append(new_df[['date', 'btc']], last_message_id=last_message_id)
+    count('rows_written', added)
+    if added:
+        update_derived(channel_name, new_df)
+        print(f"Добавлено {added} новых записей")
+    return store.path
+
+@timed()
+def update_derived(channel_name, new_df):
+    """Дописывает новые строки в дневные представления и индекс по времени"""
+    daily_views.update(channel_name, new_df)
+    time_indexes[channel_name].append(new_df)
+
+@timed()
+def parse_batch(messages, channel_name):
+    """Разбирает пакет сообщений, отсеивает дубликаты и возвращает новые строки пакета"""
+    btc_found = 0
+    # Буфер только этого пакета - после записи в хранилище строки в памяти не нужны
+    buffer = ColumnBuffer(len(messages))
+    dedupe_index = dedupe_indexes[channel_name]
     
-    if matches:
-        btc_amount = float(matches.group(1))
-        
-        # Формируем сообщение о транзакции
-        if from_to_match:
-            sender = from_to_match.group(1)
-            receiver = from_to_match.group(2)
-            formatted_message = f"{btc_amount} BTC {sender} → {receiver} ({channel_name})"
-        else:
-            formatted_message = f"{btc_amount} BTC ({channel_name})"
-        
-        # Выводим сообщение в соответствующем цвете
-        cprint(formatted_message, CHANNELS[channel_name]['color'])
-        
-        new_row = pd.DataFrame({
-            'date': [date],
-            'btc': [btc_amount]
-        })
-        dfs[channel_name] = pd.concat([dfs[channel_name], new_row], ignore_index=True)
-        return True
-    return False
-
-def save_channel_data(channel_name, new_df):
-    """Сохранение новых данных канала в CSV файл с учетом времени транзакций"""
-    csv_dir = './.csv'
-    os.makedirs(csv_dir, exist_ok=True)
-    filename = os.path.join('./.csv', f'{channel_name}_transactions.csv')
+    # Исходные тексты фиксируются в архиве раньше контрольной точки хранилища
+    archives[channel_name].append(messages)
     
-    # Создаем копию DataFrame чтобы избежать изменения оригинала
-    new_df = new_df.copy()
-    new_df['date'] = pd.to_datetime(new_df['date'])
+    # Разбираем весь пакет одним вызовом парсера
+    parsed = parse_messages([message.text for message in messages], channel_name)
+    count('messages_parsed', len(messages))
+    count('btc_matched', int(parsed['matched'].sum()))
     
-    if os.path.exists(filename):
-        try:
-            existing_df = pd.read_csv(filename)
-            # Преобразуем даты из существующего формата с format='mixed'
-            existing_df['date'] = pd.to_datetime(existing_df['date'], format='mixed')
-            
-            if 'last_timestamp' in existing_df.columns:
-                existing_df['last_timestamp'] = pd.to_datetime(existing_df['last_timestamp'], format='mixed')
-                last_timestamp = existing_df['last_timestamp'].iloc[-1]
-                last_timestamp = np.datetime64(last_timestamp)
-            else:
-                last_date = existing_df['date'].max()
-                last_timestamp = pd.Timestamp.combine(last_date.date(), pd.Timestamp.max.time())
-                last_timestamp = np.datetime64(last_timestamp)
-            
-            # Преобразуем даты в datetime64[ns]
-            new_df['date'] = new_df['date'].astype('datetime64[ns]')
-            
-            # Фильтруем только новые записи
-            new_records = new_df[new_df['date'] > last_timestamp]
-            
-            if not new_records.empty:
-                # Подготавливаем новые записи, сохраняя полное время
-                new_records_dates = new_records.copy()
-                new_records_dates['date'] = new_records_dates['date'].dt.strftime('%Y-%m-%d %H:%M:%S')
-                
-                # Создаем итоговый DataFrame
-                if 'last_timestamp' in existing_df.columns:
-                    base_df = existing_df[['date', 'btc']].iloc[:-1]
-                else:
-                    base_df = existing_df[['date', 'btc']].iloc[:-1]
-                
-                # Сохраняем полное время для последней записи
-                last_record_date = pd.to_datetime(existing_df['date'].iloc[-1]).strftime('%Y-%m-%d %H:%M:%S')
-                
-                combined_df = pd.concat([
-                    base_df,  # Старые записи без последней
-                    pd.DataFrame({'date': [last_record_date], 'btc': [existing_df['btc'].iloc[-1]]}),  # Последняя старая запись
-                    new_records_dates[['date', 'btc']]  # Новые записи
-                ])
-                
-                # Добавляем колонку с последним timestamp, сохраняя полное время
-                combined_df['last_timestamp'] = pd.NaT
-                combined_df.loc[combined_df.index[-1], 'last_timestamp'] = new_records['date'].max().strftime('%Y-%m-%d %H:%M:%S')
-                
-                # Сохраняем результат
-                combined_df.to_csv(filename, index=False)
-                print(f"Добавлено {len(new_records)} новых записей")
+    for i in np.flatnonzero(parsed['matched']):
+        btc_amount = parsed['amount'][i]
+        # Время сообщения в tz-naive UTC
+        message_ns = to_ns(messages[i].date)
         
-        except Exception as e:
-            print(f"Ошибка при обработке файла {filename}: {str(e)}")
-            raise
+        # Проверяем дубликаты (та же сумма в пределах минуты) по индексу за O(1)
+        if not dedupe_index.check_and_add(message_ns, btc_amount):
+            count('duplicates_skipped')
+            continue
+
+        # Сохраняем транзакцию в колоночный буфер
+        buffer.append(message_ns, btc_amount)
+        btc_found += 1
+
+        output = format_transaction({column: values[i] for column, values in parsed.items()}, channel_name)
+        cprint(output, CHANNELS[channel_name]['color'])
+
+    return buffer.to_frame()
+
+@timed()
+def persist_batch(new_rows, channel_name, last_message_id=None):
+    """Сохраняет новые строки пакета в хранилище канала и сдвигает контрольную точку"""
+    if not new_rows.empty:
+        # В хранилище уходят только новые строки пакета
+        save_channel_data(channel_name, new_rows, last_message_id)
+        print(f"💾 Пакет обработан. Найдено BTC: {len(new_rows)}")
     else:
-        # Если файл не существует, сохраняем с полным временем
-        new_df_dates = new_df.copy()
-        new_df_dates['date'] = new_df_dates['date'].dt.strftime('%Y-%m-%d %H:%M:%S')
-        new_df_dates['last_timestamp'] = pd.NaT
-        new_df_dates.loc[new_df_dates.index[-1], 'last_timestamp'] = new_df['date'].max().strftime('%Y-%m-%d %H:%M:%S')
-        new_df_dates[['date', 'btc', 'last_timestamp']].to_csv(filename, index=False)
-    
-    return filename
+        # Пакет без транзакций тоже обработан - повторно его не запрашиваем
+        get_channel_store(channel_name).commit_checkpoint(last_message_id)
+
+def last_message_id(messages):
+    return max(message.id for message in messages)
 
 async def process_batch(messages, channel_name):
-    btc_found = 0
-    processed_transactions = set()
+    persist_batch(parse_batch(messages, channel_name), channel_name, last_message_id(messages))
+
+async def fetch_channel(tg_client, channel_name, offset_date, parse_queue, stats, min_id=0):
+    """
+    Продюсер: читает историю канала и кладет пакеты сообщений в ограниченную очередь.
+    min_id - продолжить строго после этого сообщения (контрольная точка хранилища);
+    без нее чтение начинается с offset_date.
+    """
+    messages_batch = []
     
-    for message in messages:
-        if message.text and ('BTC' in message.text or '#BTC' in message.text):
-            btc_match = re.search(CHANNELS[channel_name]['pattern'], message.text)
-            if btc_match:
-                btc_amount = float(btc_match.group(1))
-                # Преобразуем время сообщения в tz-naive формат
-                message_timestamp = pd.Timestamp(message.date).tz_localize(None)
-                
-                # Создаем уникальный ключ для транзакции с точностью до минуты
-                transaction_key = f"{message_timestamp.strftime('%Y-%m-%d %H:%M')}_{btc_amount}"
-                
-                if transaction_key in processed_transactions:
-                    continue
-                    
-                processed_transactions.add(transaction_key)
-                
-                # Проверяем наличие дубликатов в существующем DataFrame
-                if not dfs[channel_name].empty:
-                    df_dates = pd.to_datetime(dfs[channel_name]['date'])
-                    time_diff = (df_dates - message_timestamp).abs()
-                    mask = (dfs[channel_name]['btc'] == btc_amount) & (time_diff <= pd.Timedelta(minutes=1))
-                    if mask.any():
-                        continue
-
-                # Сохраняем транзакцию в DataFrame
-                new_row = pd.DataFrame({
-                    'date': [message_timestamp],
-                    'btc': [btc_amount]
-                })
-                dfs[channel_name] = pd.concat([dfs[channel_name], new_row], ignore_index=True)
-                btc_found += 1
-
-                # Остальной код вывода информации
-                from_to_match = re.search(r'from\s+(\w+)\s+to\s+(\w+)', message.text, re.IGNORECASE)
-                if from_to_match:
-                    sender = from_to_match.group(1)
-                    receiver = from_to_match.group(2)
-                    output = f"{btc_amount} BTC {sender} → {receiver} ({channel_name})"
-                else:
-                    output = f"{btc_amount} BTC ({channel_name})"
-                
-                cprint(output, CHANNELS[channel_name]['color'])
+    async for message in tg_client.iter_messages(str(CHANNELS[channel_name]['url']),
+                                                 offset_date=None if min_id else offset_date,
+                                                 min_id=min_id,
+                                                 reverse=True):
+        stats[channel_name] += 1
+        messages_batch.append(message)
+        
+        if len(messages_batch) >= HISTORY_BATCH_SIZE:
+            print(f"Обработка пакета {stats[channel_name] - len(messages_batch) + 1}-{stats[channel_name]} ({channel_name})")
+            count('messages_fetched', len(messages_batch))
+            # При заполненной очереди ждем потребителей - это и есть backpressure
+            await parse_queue.put((channel_name, messages_batch))
+            stats['max_parse_queue'] = max(stats['max_parse_queue'], parse_queue.qsize())
+            messages_batch = []
+    
+    if messages_batch:
+        count('messages_fetched', len(messages_batch))
+        await parse_queue.put((channel_name, messages_batch))
+    # Пустой пакет означает конец истории канала
+    await parse_queue.put((channel_name, None))
 
-    if btc_found > 0:
-        save_channel_data(channel_name, dfs[channel_name])
-        print(f"💾 Пакет обработан. Найдено BTC: {btc_found}")
+async def parse_consumer(parse_queue, persist_queue, channels_count):
+    """Потребитель: разбирает пакеты в отдельном потоке, чтобы не блокировать сетевой ввод-вывод"""
+    finished = 0
+    while finished < channels_count:
+        channel_name, messages_batch = await parse_queue.get()
+        if messages_batch is None:
+            finished += 1
+            await persist_queue.put((channel_name, None, None))
+            continue
+        new_rows = await asyncio.to_thread(parse_batch, messages_batch, channel_name)
+        await persist_queue.put((channel_name, new_rows, last_message_id(messages_batch)))
 
-async def get_history():
+async def persist_consumer(persist_queue, channels_count, stats):
+    """Потребитель: пишет новые строки в хранилище в отдельном потоке"""
+    finished = 0
+    while finished < channels_count:
+        channel_name, new_rows, batch_last_id = await persist_queue.get()
+        if new_rows is None:
+            finished += 1
+            print(f"Канал {channel_name} обработан. Всего сообщений: {stats[channel_name]}")
+            # Один раз за прогон сворачиваем part-файлы дней и обновляем плоский CSV для скриптов 02-04
+            store = get_channel_store(channel_name)
+            await asyncio.to_thread(store.compact)
+            await asyncio.to_thread(store.export_csv, channel_csv(channel_name))
+            # CSV выгружен из того же хранилища, что и индекс, - перестраивать индекс по нему не нужно
+            time_indexes[channel_name].mark_synced(channel_csv(channel_name))
+            continue
+        await asyncio.to_thread(persist_batch, new_rows, channel_name, batch_last_id)
+
+@stage('ingest_history')
+async def get_history(tg_client=None):
+    """
+    Догружает историю всех каналов параллельно:
+    по задаче чтения на канал -> очередь -> разбор -> очередь -> запись в хранилище
+    """
+    tg_client = tg_client or client
     print("Получаем историю сообщений...")
     
-    for channel_name, channel_info in CHANNELS.items():
-        # Используем ./.csv для работы в текущем каталоге
-        filename = os.path.join('./.csv', f'{channel_name}_transactions.csv')
+    offsets = {}
+    for channel_name in CHANNELS:
+        store = get_channel_store(channel_name)
+        min_id = store.last_message_id or 0
         
-        if os.path.exists(filename):
-            existing_df = pd.read_csv(filename)
-            existing_df['date'] = pd.to_datetime(existing_df['date'], format='mixed')
-            last_date = existing_df['date'].max()
-            current_time = pd.Timestamp.now()
+        if not store.is_empty():
+            # Водяной знак берем из метаданных хранилища, без чтения всей истории
+            last_date = store.watermark
             
             print(f"\nПроверка канала {channel_name}:")
-            print(f"Найден файл {filename}")
-            print(f"Существующие записи: {len(existing_df)}")
-            print(f"Первая дата в файле: {existing_df['date'].min()}")
-            print(f"Последняя дата в файле: {last_date}")
+            print(f"Найдено хранилище {store.path}")
+            print(f"Существующие записи: {store.rows}")
+            print(f"Последняя дата в хранилище: {last_date}")
             
-            if (current_time - last_date).days < 1:
-                print(f"Канал {channel_name} уже обработан до текущей даты. Пропускаем...")
-                continue
-            
-            # Инициализируем DataFrame существующими данными
-            dfs[channel_name] = existing_df.copy()
-            print(f"Загружено {len(dfs[channel_name])} существующих записей")
+            # Для проверки дубликатов достаточно хвоста истории в пределах окна
+            dedupe_indexes[channel_name].load(store.read(start=last_date - DEDUPE_WINDOW))
+            print(f"Загружено в индекс дубликатов {len(dedupe_indexes[channel_name])} последних записей")
         else:
             last_date = CHANNELS[channel_name]['created_date']
             print(f"\nНачинаем сбор данных канала {channel_name} с {last_date}")
         
-        print(f"Обработка канала {channel_name}...")
-        messages_count = 0
-        messages_batch = []
-        
-        async for message in client.iter_messages(str(channel_info['url']), 
-                                                offset_date=last_date,
-                                                reverse=True):
-            messages_count += 1
-            messages_batch.append(message)
-            
-            if len(messages_batch) >= 100:
-                print(f"Обработка пакета {messages_count-99}-{messages_count}")
-                await process_batch(messages_batch, channel_name)
-                messages_batch = []
-        
-        if messages_batch:
-            await process_batch(messages_batch, channel_name)
-        
-        print(f"Канал {channel_name} обработан. Всего сообщений: {messages_count}")
+        if min_id:
+            # Продолжаем точно после последнего обработанного сообщения, без перекрытия
+            print(f"Обработка канала {channel_name} с сообщения {min_id + 1}...")
+        else:
+            # Хранилище без контрольной точки: один раз догружаем от водяного знака
+            print(f"Обработка канала {channel_name} с {last_date}...")
+        offsets[channel_name] = (last_date, min_id)
+    
+    stats = {channel_name: 0 for channel_name in offsets}
+    stats['max_parse_queue'] = 0
+    if offsets:
+        parse_queue = asyncio.Queue(maxsize=HISTORY_QUEUE_SIZE)
+        persist_queue = asyncio.Queue(maxsize=HISTORY_QUEUE_SIZE)
+        await asyncio.gather(
+            *(fetch_channel(tg_client, channel_name, offset_date, parse_queue, stats, min_id)
+              for channel_name, (offset_date, min_id) in offsets.items()),
+            parse_consumer(parse_queue, persist_queue, len(offsets)),
+            persist_consumer(persist_queue, len(offsets), stats)
+        )
     
+    # Дельты представлений, накопленные за прогон, сворачиваются один раз
+    daily_views.compact()
     print("\nВсе каналы обработаны!")
+    return stats
+
+async def resolve_channel_ids(tg_client):
+    """Один раз при старте сопоставляет id каналов Telegram с их конфигурацией"""
+    channel_names = {}
+    for channel_name, channel_info in CHANNELS.items():
+        entity = await tg_client.get_entity(channel_info['url'])
+        channel_names[entity.id] = channel_name
+    return channel_names
+
+def load_scorer():
+    """Загружает модель 04 один раз и заполняет корзину текущего дня из индекса по времени"""
+    if not os.path.exists(MODEL_FILE):
+        print(f"Модель {MODEL_FILE} не найдена, онлайн-оценка отключена")
+        return None
+    try:
+        scorer = OnlineMovementScorer.load(MODEL_FILE)
+    except ValueError as e:
+        print(f"Модель {MODEL_FILE} не подходит для оценки ({e}), онлайн-оценка отключена")
+        return None
+    today = pd.Timestamp.now(tz='UTC').normalize()
+    for channel_name in MODEL_CHANNELS:
+        today_df = time_indexes[channel_name].query(start=today)
+        scorer.bootstrap(today_df['btc'], today_df['date'])
+    print(f"Загружена модель {MODEL_FILE}: {scorer.n_features} используемых признаков, "
+          f"транзакций за сегодня: {sum(scorer.counts.values())}")
+    return scorer
+
+def flush_archives():
+    """Дописывает накопленные live-сообщения в архивы (перед фиксацией контрольных точек)"""
+    for archive in archives.values():
+        archive.flush()
+
+def ingest_live_transaction(channel_name, message, parsed, writer, gap_index=None):
+    """
+    Отсеивает дубликат и ставит live-транзакцию в групповую запись. Возвращает True для новой.
+    gap_index - индекс дубликатов пропуска (gap_dedupe_index) для сообщений из fill_gap.
+    """
+    message_ns = to_ns(message.date)
+    if gap_index is None:
+        is_new = dedupe_indexes[channel_name].check_and_add(message_ns, parsed['amount'])
+    else:
+        is_new = gap_index.check_and_add(message_ns, parsed['amount'])
+        if is_new:
+            # Следующие live-сообщения тоже сверяются с транзакцией из пропуска
+            dedupe_indexes[channel_name].add(message_ns, parsed['amount'])
+    if not is_new:
+        writer.mark(channel_name, message.id)
+        return False
+    # Строки ждут записи в групповом буфере writer - колоночный буфер истории здесь не нужен
+    writer.add(channel_name, pd.Timestamp(message_ns), parsed['amount'], message.id)
+    return True
+
+def gap_dedupe_index(channel_name, messages, writer):
+    """
+    Индекс дубликатов для сообщений пропуска. Они старше live-сообщения, открывшего пропуск,
+    и общий индекс канала счел бы их уже обработанными, поэтому они сверяются отдельным
+    индексом без вытеснения по строкам хранилища и групповой записи за время пропуска ± окно.
+    """
+    gap_index = DedupeIndex(DEDUPE_WINDOW, evict=False)
+    if not messages:
+        return gap_index
+    dates = [to_ns(message.date) for message in messages]
+    start = pd.Timestamp(min(dates)) - DEDUPE_WINDOW
+    end = pd.Timestamp(max(dates)) + DEDUPE_WINDOW
+    gap_index.load(get_channel_store(channel_name).read(start=start, end=end))
+    pending = writer.rows(channel_name)
+    gap_index.load(pending[(pending['date'] >= start) & (pending['date'] <= end)])
+    return gap_index
+
+async def fill_gap(tg_client, channel_name, after_id, before_id, writer):
+    """
+    Догружает сообщения канала с id в (after_id, before_id), пропущенные live-потоком
+    (например, во время переподключения). Пока пропуск не заполнен, контрольная точка
+    канала не фиксируется дальше after_id, а более новые строки не пишутся в хранилище.
+    Пропуск снимается после успешной догрузки, даже если сообщений в нем нет (удаленные
+    или служебные id); при ошибке контрольная точка остается перед ним до следующего запуска.
+    """
+    filled = 0
+    try:
+        messages = [message async for message in tg_client.iter_messages(str(CHANNELS[channel_name]['url']),
+                                                                          min_id=after_id, max_id=before_id,
+                                                                          reverse=True)]
+        gap_index = gap_dedupe_index(channel_name, messages, writer)
+        for message in messages:
+            archives[channel_name].add(message)
+            parsed = parse_message(message.text, channel_name)
+            if not parsed:
+                writer.mark(channel_name, message.id)
+            elif ingest_live_transaction(channel_name, message, parsed, writer, gap_index):
+                filled += 1
+                cprint(format_transaction(parsed, channel_name), CHANNELS[channel_name]['color'])
+        writer.release(channel_name, after_id)
+        count('gap_transactions_filled', filled)
+        print(f"Пропуск {channel_name} ({after_id}, {before_id}) заполнен, новых транзакций: {filled}")
+    except Exception as e:
+        # Контрольная точка остается перед пропуском - он догрузится при следующем запуске
+        print(f"Не удалось заполнить пропуск {channel_name} ({after_id}, {before_id}): {str(e)}")
 
 async def main():
+    live_writer = GroupCommitWriter(get_channel_store, max_rows=LIVE_COMMIT_ROWS, max_delay=LIVE_COMMIT_SECONDS,
+                                    on_commit=update_derived, on_flush=flush_archives)
+    live_writer_task = None
     try:
         print("Начинаем мониторинг BTC транзакций...")
         await get_history()
         print("\nПереходим к мониторингу новых сообщений...")
+        
+        channel_names = await resolve_channel_ids(client)
+        for channel_name in CHANNELS:
+            # Индекс дубликатов нужен и для каналов, пропущенных при догрузке истории
+            store = get_channel_store(channel_name)
+            if len(dedupe_indexes[channel_name]) == 0 and not store.is_empty():
+                dedupe_indexes[channel_name].load(store.read(start=store.watermark - DEDUPE_WINDOW))
+        scorer = load_scorer()
+        # Последний увиденный id по каналам: скачок id означает пропущенные сообщения
+        live_last_ids = {channel_name: get_channel_store(channel_name).last_message_id for channel_name in CHANNELS}
+        live_writer_task = asyncio.create_task(live_writer.run())
         print("\nОжидаем новые транзакции...")
         
         @client.on(events.NewMessage(chats=[info['url'] for info in CHANNELS.values()]))
@@ -258,41 +391,50 @@ async def main():
             try:
                 message = event.message
                 
-                channel_url = str(event.message.peer_id.channel_id)
-                channel_name = None
-                for name, info in CHANNELS.items():
-                    if channel_url in info['url'] or info['url'] in channel_url:
-                        channel_name = name
-                        break
-
-                if message.text and ('BTC' in message.text or '#BTC' in message.text):
-                    btc_match = re.search(r'(\d+(?:\.\d+)?)\s*(?:#)?BTC', message.text)
-                    if btc_match:
-                        btc_amount = float(btc_match.group(1))
-                        from_to_match = re.search(r'from\s+(\w+)\s+to\s+(\w+)', message.text, re.IGNORECASE)
-                        
-                        if from_to_match:
-                            sender = from_to_match.group(1)
-                            receiver = from_to_match.group(2)
-                            output = f"{btc_amount} BTC {sender} → {receiver} ({channel_name})"
-                            
-                            # Проверяем, является ли транзакция отслеживаемой
-                            watched_amount = f"{int(btc_amount)} BTC"
-                            watched_amount_hash = f"{int(btc_amount)} #BTC"
-                            
-                            if (watched_amount in WATCHED_TRANSACTIONS[channel_name] if channel_name in WATCHED_TRANSACTIONS else [] or 
-                                watched_amount_hash in WATCHED_TRANSACTIONS[channel_name] if channel_name in WATCHED_TRANSACTIONS else []):
-                                # Особый вывод для отслеживаемых транзакций
-                                stars = '*' * 3
-                                attrs = ['bold', 'blink']
-                                highlighted_output = f"{stars}{output}"
-                                for _ in range(4):
-                                    cprint(highlighted_output, 'white', 'on_red', attrs=attrs)
-                                print('')  # Пустая строка после важной транзакции
-                            else:
-                                # Обычный вывод с мягким фоном
-                                cprint(output, 'white', 'on_cyan')
-                        
+                channel_name = channel_names.get(message.peer_id.channel_id)
+                if channel_name is None:
+                    return
+                
+                previous_id = live_last_ids.get(channel_name)
+                if previous_id is not None and message.id > previous_id + 1:
+                    live_writer.hold(channel_name, previous_id)
+                    asyncio.create_task(fill_gap(client, channel_name, previous_id, message.id, live_writer))
+                if previous_id is None or message.id > previous_id:
+                    live_last_ids[channel_name] = message.id
+                archives[channel_name].add(message)
+
+                parsed = parse_message(message.text, channel_name)
+                if not parsed:
+                    live_writer.mark(channel_name, message.id)
+                else:
+                    btc_amount = parsed['amount']
+                    is_new = ingest_live_transaction(channel_name, message, parsed, live_writer)
+                    
+                    # Пересчет оценки модели по обновленной корзине дня
+                    scores = None
+                    if scorer is not None and is_new and channel_name in MODEL_CHANNELS:
+                        scores, elapsed_us = scorer.timed_add(btc_amount, message.date)
+                    
+                    # Правила проверяются для каждой разобранной транзакции: какие поля нужны, решает правило
+                    fired_rules = alert_rules.evaluate(btc_amount, channel_name, message.date)
+                    output = format_transaction(parsed, channel_name)
+                    
+                    if fired_rules:
+                        # Особый вывод для отслеживаемых транзакций
+                        stars = '*' * 3
+                        attrs = ['bold', 'blink']
+                        highlighted_output = f"{stars}{output} [{', '.join(rule.name for rule in fired_rules)}]"
+                        for _ in range(4):
+                            cprint(highlighted_output, 'white', 'on_red', attrs=attrs)
+                        print('')  # Пустая строка после важной транзакции
+                    elif parsed['sender'] and parsed['receiver']:
+                        # Обычный вывод с мягким фоном - только для транзакций с известным маршрутом
+                        cprint(output, 'white', 'on_cyan')
+                    
+                    if scores is not None and (fired_rules or (parsed['sender'] and parsed['receiver'])):
+                        print(f"Модель: рост {scores['up_model']:.2f}, падение {scores['down_model']:.2f} "
+                              f"({elapsed_us:.0f} мкс)")
+                    
             except Exception as e:
                 print(f"Ошибка при обработке сообщения: {str(e)}")
 
@@ -301,6 +443,13 @@ async def main():
     except Exception as e:
         print(f"Произошла ошибка: {str(e)}")
     finally:
+        # Дописываем накопленные live-транзакции, чтобы после перезапуска не догружать их
+        if live_writer_task is not None:
+            live_writer_task.cancel()
+        live_writer.flush()
+        daily_views.compact()
+        for store in stores.values():
+            store.compact()
         if client.is_connected():
             await client.disconnect()
 
@@ -1,21 +1,176 @@
 import pandas as pd
+import numpy as np
 import os
 from datetime import timedelta
+from daily_views import DailyViews
+from instrumentation import count, stage, timed
+from paths import MERGED_FILE, MERGED_VIEWS_DIR, channel_csv
+from transaction_loader import load_transactions
 
-def merge_transactions():
-    """Объединяет данные из всех файлов каналов в один общий файл"""
+@timed()
+def match_similar_transactions(df, time_window=timedelta(minutes=3), amount_tolerance=0.0):
+    """
+    Находит пары похожих транзакций от разных ботов сортировкой и проходом по времени.
+    Записи группируются по сумме BTC и просматриваются по времени: запись, еще не попавшая
+    в окно предыдущей, объединяется с первой необъединенной записью другого бота в пределах ±time_window.
+    При amount_tolerance > 0 суммы пары отличаются не больше чем на amount_tolerance
+    (см. _match_with_tolerance).
+    Сложность O(n log n) вместо полного сканирования таблицы для каждой строки.
+    Возвращает индексы оставляемых записей, индексы удаляемых и объединенные имена ботов.
+    """
+    if df.empty:
+        return [], [], []
+    if amount_tolerance > 0:
+        return _match_with_tolerance(df, time_window, amount_tolerance)
+    
+    dates = df['date'].to_numpy(dtype='datetime64[ns]').view('int64')
+    amount_key = df['btc'].to_numpy(dtype='float64')
+    bot_codes, bot_names = pd.factorize(df['bot_name'])
+    window = pd.Timedelta(time_window).value
+    
+    # Сортируем по (сумма, время); lexsort стабилен, порядок равных записей сохраняется
+    order = np.lexsort((dates, amount_key))
+    keys = amount_key[order]
+    times = dates[order]
+    bots = bot_codes[order]
+    
+    # Разбиваем на серии: одинаковая сумма и разрыв с предыдущей записью не больше окна.
+    # Пара возможна только внутри серии, в которой встречается больше одного бота
+    new_run = np.ones(len(order), dtype=bool)
+    new_run[1:] = (keys[1:] != keys[:-1]) | (times[1:] - times[:-1] > window)
+    run_starts = np.flatnonzero(new_run)
+    run_ends = np.append(run_starts[1:], len(order))
+    run_bots = pd.Series(bots).groupby(np.cumsum(new_run)).nunique().to_numpy()
+    
+    index = df.index.to_numpy()
+    keep_idx, drop_idx, pair_bots = [], [], []
+    touched = np.zeros(len(order), dtype=bool)
+    merged = np.zeros(len(order), dtype=bool)
+    for start, end in zip(run_starts[run_bots > 1], run_ends[run_bots > 1]):
+        lo = hi = start
+        for pos in range(start, end):
+            # Поддерживаем окно [lo, hi) записей в пределах ±time_window от текущей
+            while times[pos] - times[lo] > window:
+                lo += 1
+            while hi < end and times[hi] - times[pos] <= window:
+                hi += 1
+            if touched[pos]:
+                continue
+            
+            partner = None
+            for j in range(lo, hi):
+                if j != pos and bots[j] != bots[pos]:
+                    touched[j] = True
+                    if partner is None and not merged[j]:
+                        partner = j
+            if partner is None:
+                continue
+            merged[pos] = merged[partner] = True
+            keep_idx.append(index[order[pos]])
+            drop_idx.append(index[order[partner]])
+            pair_bots.append(','.join(sorted({bot_names[bots[pos]], bot_names[bots[partner]]})))
+    
+    return keep_idx, drop_idx, pair_bots
+
+def _match_with_tolerance(df, time_window, amount_tolerance):
+    """
+    Поиск пар с допуском по сумме: |Δbtc| <= amount_tolerance и |Δt| <= time_window.
+    Записи раскладываются по корзинам шириной 2 × amount_tolerance и сортируются по (корзина, время);
+    пара записи может лежать только в ее корзине или в соседних (с запасом на ошибки округления
+    при делении), поэтому кандидаты - записи трех корзин в пределах окна по времени
+    (бинарный поиск), отфильтрованные по |Δbtc|.
+    Записи обходятся по (сумма, время), правило объединения то же, что при точном совпадении:
+    запись, еще не попавшая в окно предыдущей, объединяется с самой ранней необъединенной
+    записью другого бота.
+    """
+    dates = df['date'].to_numpy(dtype='datetime64[ns]').view('int64')
+    btc = df['btc'].to_numpy(dtype='float64')
+    bot_codes, bot_names = pd.factorize(df['bot_name'])
+    window = pd.Timedelta(time_window).value
+    # Запас на ошибку двоичного представления: 500.1 - 500.0 чуть больше 0.1
+    tolerance = amount_tolerance * (1 + 1e-9)
+    bucket = np.floor(btc / (2 * amount_tolerance)).astype(np.int64)
+    
+    order = np.lexsort((dates, bucket))
+    keys = bucket[order]
+    times = dates[order]
+    amounts = btc[order]
+    bots = bot_codes[order]
+    
+    # Границы корзин в отсортированном порядке
+    bucket_ids, bucket_starts = np.unique(keys, return_index=True)
+    bucket_ends = np.append(bucket_starts[1:], len(order))
+    slices = {key: (start, end) for key, start, end in
+              zip(bucket_ids.tolist(), bucket_starts.tolist(), bucket_ends.tolist())}
+    
+    index = df.index.to_numpy()
+    keep_idx, drop_idx, pair_bots = [], [], []
+    touched = np.zeros(len(order), dtype=bool)
+    merged = np.zeros(len(order), dtype=bool)
+    for pos in np.lexsort((times, amounts)).tolist():
+        if touched[pos]:
+            continue
+        candidates = []
+        for key in (keys[pos] - 1, keys[pos], keys[pos] + 1):
+            if key not in slices:
+                continue
+            start, end = slices[key]
+            lo = start + np.searchsorted(times[start:end], times[pos] - window, side='left')
+            hi = start + np.searchsorted(times[start:end], times[pos] + window, side='right')
+            candidates.append(np.arange(lo, hi))
+        candidates = np.concatenate(candidates)
+        candidates = candidates[(candidates != pos) & (bots[candidates] != bots[pos]) &
+                                (np.abs(amounts[candidates] - amounts[pos]) <= tolerance)]
+        if len(candidates) == 0:
+            continue
+        touched[candidates] = True
+        free = candidates[~merged[candidates]]
+        if len(free) == 0:
+            continue
+        partner = free[np.argmin(times[free])]
+        merged[pos] = merged[partner] = True
+        keep_idx.append(index[order[pos]])
+        drop_idx.append(index[order[partner]])
+        pair_bots.append(','.join(sorted({bot_names[bots[pos]], bot_names[bots[partner]]})))
+    
+    return keep_idx, drop_idx, pair_bots
+
+@timed()
+def update_merged_views(final_df, cutoff, views_dir=MERGED_VIEWS_DIR):
+    """
+    Дописывает объединенные транзакции не позже cutoff в дневные представления без дубликатов
+    между ботами (бот строки - bot_name, например 'whale_alert,whalebot').
+    Объединение записи решается только записями в пределах окна вокруг нее, поэтому строки
+    не позже (последняя запись отстающего бота - окно) при следующих запусках уже не изменятся
+    и дописываются один раз; более новые ждут следующего запуска.
+    Представления считаются для параметров объединения по умолчанию.
+    """
+    views = DailyViews(views_dir)
+    settled = final_df[final_df['date'] <= cutoff]
+    added = sum(views.update(bot_name, rows[['date', 'btc']]) for bot_name, rows in settled.groupby('bot_name'))
+    views.compact()
+    return added
+
+@stage('merge')
+def merge_transactions(time_window=timedelta(minutes=3), amount_tolerance=0.0,
+                       whalebot_file=channel_csv('whalebot'), whale_alert_file=channel_csv('whale_alert'),
+                       output_file=MERGED_FILE, views_dir=MERGED_VIEWS_DIR):
+    """
+    Объединяет данные из всех файлов каналов в один общий файл и дописывает новые
+    объединенные транзакции в дневные представления views_dir (их читают 03 и 04)
+    """
     # Читаем данные из файлов
-    whalebot_df = pd.read_csv('whalebot_transactions.csv') if os.path.exists('whalebot_transactions.csv') else None
-    whale_alert_df = pd.read_csv('whale_alert_transactions.csv') if os.path.exists('whale_alert_transactions.csv') else None
+    whalebot_df = load_transactions(whalebot_file) if os.path.exists(whalebot_file) else None
+    whale_alert_df = load_transactions(whale_alert_file) if os.path.exists(whale_alert_file) else None
     
     if whalebot_df is not None and whale_alert_df is not None:
         print("\nИсходные данные:")
-        print(f"Записей в whalebot_transactions.csv: {len(whalebot_df)}")
-        print(f"Записей в whale_alert_transactions.csv: {len(whale_alert_df)}")
+        print(f"Записей в {whalebot_file}: {len(whalebot_df)}")
+        print(f"Записей в {whale_alert_file}: {len(whale_alert_df)}")
         
-        # Преобразуем даты в datetime с сохранением времени
-        whalebot_df['date'] = pd.to_datetime(whalebot_df['date'], utc=True)
-        whale_alert_df['date'] = pd.to_datetime(whale_alert_df['date'], utc=True)
+        # Даты уже разобраны загрузчиком в UTC, отмечаем зону
+        whalebot_df['date'] = whalebot_df['date'].dt.tz_localize('UTC')
+        whale_alert_df['date'] = whale_alert_df['date'].dt.tz_localize('UTC')
         
         # Добавляем имена ботов
         whalebot_df['bot_name'] = 'whalebot'
@@ -24,72 +179,34 @@ def merge_transactions():
         # Объединяем датафреймы
         merged_df = pd.concat([whalebot_df, whale_alert_df], ignore_index=True)
         print(f"\nПосле объединения всего записей: {len(merged_df)}")
+        count('rows_in', len(merged_df))
         
         # Проверяем на дубликаты до начала обработки
         exact_duplicates = merged_df[merged_df.duplicated(['date', 'btc'], keep=False)]
         print(f"Точных дубликатов до обработки: {len(exact_duplicates)}")
         
-        # Ищем похожие транзакции (одинаковая сумма BTC и время в пределах 3 минут)
-        final_df = merged_df.copy()
-        similar_transactions = []
-        processed_pairs = set()  # Для отслеживания уже обработанных пар
-        
-        # Сортируем по дате для оптимизации поиска
-        merged_df = merged_df.sort_values('date')
-        
+        # Ищем похожие транзакции (одинаковая сумма BTC и время в пределах окна)
         print("\nНачинаем поиск похожих транзакций...")
-        # Ищем похожие транзакции
-        for i, row in merged_df.iterrows():
-            if isinstance(i, int) and i % 1000 == 0:
-                print(f"Обработано {i} записей...")
-            
-            # Пропускаем уже обработанные записи
-            if i in processed_pairs:
-                continue
-                
-            # Ищем транзакции в пределах 3 минут
-            time_window = (row['date'] - timedelta(minutes=3), row['date'] + timedelta(minutes=3))
-            similar = merged_df[
-                (merged_df['date'].between(*time_window)) & 
-                (merged_df['btc'] == row['btc']) &
-                (merged_df.index != i)
-            ]
-            
-            if not similar.empty:
-                for _, similar_row in similar.iterrows():
-                    # Проверяем, что транзакции от разных ботов
-                    if row['bot_name'] != similar_row['bot_name']:
-                        pair_key = (i, similar_row.name)
-                        if pair_key not in processed_pairs:
-                            similar_transactions.append((
-                                [i, similar_row.name],
-                                [row['bot_name'], similar_row['bot_name']]
-                            ))
-                            processed_pairs.add(pair_key)
-                            processed_pairs.add(i)
-                            processed_pairs.add(similar_row.name)
-        
-        print(f"\nНайдено {len(similar_transactions)} пар похожих транзакций")
+        keep_idx, drop_idx, pair_bots = match_similar_transactions(
+            merged_df, time_window=time_window, amount_tolerance=amount_tolerance
+        )
+        print(f"\nНайдено {len(keep_idx)} пар похожих транзакций")
         
-        # Обрабатываем похожие транзакции
-        processed_indices = set()
-        merged_count = 0
-        
-        for indices, bot_names in similar_transactions:
-            if not any(idx in processed_indices for idx in indices):
-                merged_count += 1
-                # Помечаем индексы как обработанные
-                processed_indices.update(indices)
-                # Объединяем имена ботов
-                final_df.loc[indices[0], 'bot_name'] = ','.join(sorted(set(bot_names)))
-                # Удаляем дубликаты
-                final_df = final_df.drop(indices[1:])
-                
-                if merged_count % 1000 == 0:
-                    print(f"Обработано {merged_count} пар транзакций")
+        # Объединяем имена ботов у оставшейся записи и удаляем дубликаты одной операцией
+        final_df = merged_df.copy()
+        final_df.loc[keep_idx, 'bot_name'] = pair_bots
+        final_df = final_df.drop(drop_idx)
+        merged_count = len(keep_idx)
+        count('pairs_merged', merged_count)
+        count('rows_out', len(final_df))
         
         print(f"\nОбъединено {merged_count} пар транзакций")
         
+        # Дописываем в представления только строки, объединение которых уже не изменится
+        cutoff = min(whalebot_df['date'].max(), whale_alert_df['date'].max()) - pd.Timedelta(time_window)
+        added = update_merged_views(final_df, cutoff, views_dir)
+        print(f"В объединенные представления {views_dir} добавлено {added} записей (до {cutoff})")
+        
         # Проверяем количество записей после обработки
         print("\nПроверка количества записей:")
         print(f"Было: {len(merged_df)}")
@@ -103,8 +220,8 @@ def merge_transactions():
         final_df = final_df.sort_values('date')
         
         # Сохраняем результат
-        final_df.to_csv('all_btc_transactions.csv', index=False)
-        print(f"\nОбъединенные данные сохранены в all_btc_transactions.csv: {len(final_df)} записей")
+        final_df.to_csv(output_file, index=False)
+        print(f"\nОбъединенные данные сохранены в {output_file}: {len(final_df)} записей")
         
         # Статистика по источникам
         print("\nСтатистика по источникам:")
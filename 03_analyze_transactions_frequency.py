@@ -1,15 +1,31 @@
-import pandas as pd
 import matplotlib.pyplot as plt
+from daily_views import DailyViews
+from instrumentation import stage
+from paths import FREQUENCY_FILE, MERGED_VIEWS_DIR
 
-def analyze_btc_transactions_frequency(df=None):
-    """Анализирует частоту транзакций различных сумм BTC"""
-    # Читаем файл, если датафрейм не передан
+@stage('frequency')
+def analyze_btc_transactions_frequency(df=None, output_file=FREQUENCY_FILE, show_plot=True, views_dir=MERGED_VIEWS_DIR):
+    """
+    Анализирует частоту транзакций различных сумм BTC.
+    Без датафрейма частоты берутся из объединенных дневных представлений 02
+    (дубликаты между ботами уже убраны) - сырая история не перечитывается.
+    """
     if df is None:
-        df = pd.read_csv('all_btc_transactions.csv')
-    
-    # Группируем по сумме BTC и подсчитываем частоту
-    btc_frequency = df.value_counts('btc').reset_index()
-    btc_frequency.columns = ['btc', 'frequency']
+        views = DailyViews(views_dir)
+        if views.totals.empty:
+            raise ValueError(f"Объединенные представления {views_dir} пусты - сначала запустите 02")
+        btc_frequency = views.amount_frequency()
+        
+        # Общая статистика по дням и ботам из тех же представлений
+        daily_totals = views.daily_totals()
+        print(f"Дней с транзакциями: {len(daily_totals)}, в среднем транзакций за день: "
+              f"{daily_totals['count'].mean():.1f}, BTC за день: {daily_totals['btc_sum'].mean():,.0f}")
+        print("Транзакций по ботам:")
+        print(views.bot_breakdown().sum().sort_values(ascending=False))
+    else:
+        # Группируем по сумме BTC и подсчитываем частоту
+        btc_frequency = df.value_counts('btc').reset_index()
+        btc_frequency.columns = ['btc', 'frequency']
     
     # Сортируем по частоте по убыванию
     btc_frequency = btc_frequency.sort_values('frequency', ascending=False)
@@ -38,11 +54,14 @@ def analyze_btc_transactions_frequency(df=None):
              bbox=dict(facecolor='white', alpha=0.8))
     
     plt.tight_layout()
-    plt.show()
+    if show_plot:
+        plt.show()
+    else:
+        plt.close()
     
     # Сохраняем результаты в CSV
-    btc_frequency.to_csv('btc_frequency_analysis.csv', index=False)
-    print("\nРезультаты анализа сохранены в btc_frequency_analysis.csv")
+    btc_frequency.to_csv(output_file, index=False)
+    print(f"\nРезультаты анализа сохранены в {output_file}")
     
     return btc_frequency
 
@@ -3,55 +3,75 @@ import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report
-from itertools import combinations
 import joblib
 import os
+from model_artifact import compact_forests, save_model_artifact, split_importances
+from movement_features import build_sparse_features
+from day_baskets import DayBaskets
+from daily_views import DailyViews
+from instrumentation import count, stage, timed
+from paths import MERGED_VIEWS_DIR, MODEL_FILE, MOVEMENTS_FILE
+from transaction_loader import load_transactions
 
-def create_combined_dataset(movements_file: str, transactions_file: str) -> pd.DataFrame:
+@stage('combined_dataset')
+def create_combined_dataset(movements_file: str, transactions_file: str = None, bots=('whalebot',)):
     """
     Создает единый датасет, где:
     - За основу берется таблица движений цены
-    - Добавляется колонка со списком всех транзакций за каждый день
+    - Транзакции каждого дня лежат в DayBaskets (плоский массив сумм + смещения дней),
+      строка i таблицы соответствует корзине i; в таблице остается только их количество
+    Без transactions_file корзины собираются из дневных представлений, сырая история не читается:
+    для одного бота - из представлений его канала (те же данные, что в CSV канала),
+    для нескольких - из объединенных представлений 02, где дубликаты между ботами уже убраны.
+    Возвращает (таблица, корзины).
     """
     # Загрузка данных
     movements_df = pd.read_csv(movements_file)
-    transactions_df = pd.read_csv(transactions_file)
-    
-    # Удаляем колонку last_timestamp, если она есть
-    if 'last_timestamp' in transactions_df.columns:
-        transactions_df = transactions_df.drop('last_timestamp', axis=1)
     
     # Приведение дат к единому формату без UTC и времени
     movements_df['date'] = pd.to_datetime(movements_df['Date']).dt.tz_localize(None).dt.date
-    transactions_df['date'] = pd.to_datetime(transactions_df['date']).dt.tz_localize(None).dt.date
     
     # Удаляем старую колонку Date
     movements_df = movements_df.drop('Date', axis=1)
     
-    # Группировка транзакций по дням в виде списка
-    daily_transactions = transactions_df.groupby('date', as_index=False).agg(
-        transactions=('btc', lambda x: x.tolist())
-    )
-    
-    # Объединение с основной таблицей движений
-    result_df = pd.merge(
-        movements_df,
-        daily_transactions,
-        on='date',
-        how='left'
-    )
-    
-    # Заполнение дней без транзакций пустым списком и удаление строк до первой транзакции
-    result_df['transactions'] = result_df['transactions'].fillna('').apply(lambda x: [] if x == '' else x)
-    first_transaction_idx = result_df[result_df['transactions'].str.len() > 0].index[0]
-    result_df = result_df.iloc[first_transaction_idx:]
-    
-    return result_df
+    if transactions_file is None:
+        # Представления каналов не очищены от общих дубликатов - для нескольких ботов суммировать их нельзя
+        views = DailyViews() if len(bots) == 1 else DailyViews(MERGED_VIEWS_DIR)
+        transaction_days, amounts = views.daily_transactions(bots)
+        transaction_days = transaction_days.astype('datetime64[D]')
+    else:
+        transactions_df = load_transactions(transactions_file, columns=['date', 'btc'])
+        transaction_days = transactions_df['date'].to_numpy().astype('datetime64[D]')
+        amounts = transactions_df['btc'].to_numpy(dtype=np.float64)
+    
+    # Раскладываем транзакции по дням таблицы движений (дни без транзакций - пустые корзины)
+    movement_days = pd.to_datetime(movements_df['date']).to_numpy().astype('datetime64[D]')
+    baskets = DayBaskets.from_transactions(transaction_days, amounts, movement_days)
+    
+    # Удаление строк до первой транзакции
+    first_transaction_idx = baskets.first_nonempty()
+    if first_transaction_idx == len(baskets):
+        raise ValueError("Нет ни одного дня движения цены с транзакциями")
+    baskets = baskets[first_transaction_idx:]
+    result_df = movements_df.iloc[first_transaction_idx:].copy()
+    result_df['transactions_count'] = baskets.lengths()
+    count('days', len(baskets))
+    count('transactions', len(baskets.amounts))
+    
+    return result_df, baskets
 
-def analyze_price_movements(df: pd.DataFrame, forecast_window: int = 3) -> dict:
+@stage('price_movements')
+def analyze_price_movements(df: pd.DataFrame, baskets: DayBaskets = None, forecast_window: int = 3,
+                            min_support: int = 2, max_itemset_len: int = 2, n_jobs=None,
+                            model_file: str = MODEL_FILE, full_model_file: str = None) -> dict:
     """
     Анализирует связь между транзакциями и будущим движением цены используя Random Forest.
-    Анализирует ВСЕ транзакции и их комбинации, отдельно для роста и падения.
+    baskets - корзины дней из create_combined_dataset; без них берется колонка transactions (списки).
+    Анализирует все транзакции и наборы транзакций (пары, тройки и т.д. до max_itemset_len),
+    встречавшиеся вместе хотя бы min_support дней. Оба леса учатся на всех днях:
+    up_model отличает дни роста от остальных, down_model - дни падения.
+    В model_file сохраняется компактный артефакт (только признаки разбиений, memory map);
+    full_model_file - дополнительно сохранить модели sklearn целиком через joblib.
     """
     # Находим колонку с процентами
     price_column = [col for col in df.columns if col.startswith('+')][0]
@@ -60,41 +80,9 @@ def analyze_price_movements(df: pd.DataFrame, forecast_window: int = 3) -> dict:
     df['price_change'] = df[price_column].str.rstrip('%').astype('float')
     df['target'] = (df['price_change'] > 0).astype(int)
     
-    # Подсчет частоты каждой транзакции и создание полного набора
-    transaction_counts = {}
-    all_transactions = set()
-    for trans_list in df['transactions']:
-        for t in trans_list:
-            transaction_counts[t] = transaction_counts.get(t, 0) + 1
-            all_transactions.add(t)
-    
-    print(f"\nВсего уникальных транзакций: {len(all_transactions)}")
-    print("Начинаем полный анализ всех транзакций...")
-    
-    # Создаем базовую матрицу признаков (все одиночные транзакции)
-    X_single = np.zeros((len(df), len(all_transactions)))
-    transaction_map = {t: i for i, t in enumerate(all_transactions)}
-    
-    print("Создаем матрицу одиночных транзакций...")
-    for i, trans_list in enumerate(df['transactions']):
-        for t in trans_list:
-            X_single[i, transaction_map[t]] += 1
-    
-    # Добавляем признаки для всех возможных пар
-    pairs = list(combinations(all_transactions, 2))
-    X_pairs = np.zeros((len(df), len(pairs)))
-    
-    print(f"\nАнализируем {len(pairs)} возможных пар транзакций...")
-    for i, trans_list in enumerate(df['transactions']):
-        for j, (t1, t2) in enumerate(pairs):
-            if t1 in trans_list and t2 in trans_list:
-                X_pairs[i, j] = 1
-    
-    # Объединяем все признаки
-    X = np.hstack([X_single, X_pairs])
     y = df['target'].values
     
-    # Разделяем данные на рост и падение
+    # Дни роста и падения: каждый лес должен видеть оба класса, иначе деревья не делят выборку
     up_indices = y == 1
     down_indices = y == 0
     
@@ -106,11 +94,28 @@ def analyze_price_movements(df: pd.DataFrame, forecast_window: int = 3) -> dict:
     if np.sum(up_indices) < 5 or np.sum(down_indices) < 5:
         raise ValueError("Недостаточно данных для анализа роста или падения (нужно минимум 5 примеров каждого типа)")
     
+    # Обучающие дни одни для обоих лесов (те же, что дал бы train_test_split(X, y)).
+    # Матрица строится только для них и сразу в CSC, с которой работают деревья, - полная матрица
+    # всех дней не нужна и в памяти не держится
+    train_rows, _ = train_test_split(np.arange(len(y)), test_size=0.2, random_state=42)
+    
+    # Разреженные признаки: одиночные суммы + только реально встречающиеся вместе наборы
+    print("\nСоздаем разреженную матрицу признаков...")
+    if baskets is None:
+        baskets = DayBaskets.from_lists(df['transactions'].tolist())
+    X_train, transaction_map, itemsets, transaction_counts = build_sparse_features(
+        baskets, min_support=min_support, max_itemset_len=max_itemset_len, n_jobs=n_jobs, rows=train_rows
+    )
+    
+    print(f"\nВсего уникальных транзакций: {len(transaction_map)}")
+    print(f"Наборов транзакций с поддержкой не меньше {min_support} дней: {len(itemsets)}")
+    print(f"Ненулевых признаков в обучающих днях: {X_train.nnz} из {X_train.shape[0] * X_train.shape[1]}")
+    
     print("\nАнализ дней роста...")
-    up_model, up_importance = analyze_subset(X[up_indices], y[up_indices], transaction_map, pairs, transaction_counts)
+    up_model, up_importance = analyze_subset(X_train, up_indices[train_rows].astype(int), transaction_map, itemsets, transaction_counts)
     
     print("\nАнализ дней падения...")
-    down_model, down_importance = analyze_subset(X[down_indices], y[down_indices], transaction_map, pairs, transaction_counts)
+    down_model, down_importance = analyze_subset(X_train, down_indices[train_rows].astype(int), transaction_map, itemsets, transaction_counts)
     
     # Сохраняем модели и важные данные
     print("\nСохраняем модели и данные...")
@@ -118,15 +123,18 @@ def analyze_price_movements(df: pd.DataFrame, forecast_window: int = 3) -> dict:
         'up_model': up_model,
         'down_model': down_model,
         'transaction_map': transaction_map,
-        'pairs': pairs
+        'itemsets': itemsets
     }
     
-    # Создаем директорию, если её нет
-    if not os.path.exists('models'):
-        os.makedirs('models')
+    arrays, meta = compact_forests(model_data)
+    save_model_artifact(model_file, arrays, meta)
+    print(f"Модели сохранены в {model_file}: {meta['n_features']} признаков разбиений из {meta['source_features']}")
     
-    joblib.dump(model_data, 'models/price_movement_model.joblib')
-    print("Модели сохранены в models/price_movement_model.joblib")
+    if full_model_file:
+        # Создаем директорию, если её нет
+        os.makedirs(os.path.dirname(full_model_file) or '.', exist_ok=True)
+        joblib.dump(model_data, full_model_file)
+        print(f"Модели sklearn сохранены в {full_model_file}")
     
     return {
         'up_patterns': up_importance,
@@ -134,49 +142,56 @@ def analyze_price_movements(df: pd.DataFrame, forecast_window: int = 3) -> dict:
         'transaction_counts': transaction_counts
     }
 
-def analyze_subset(X, y, transaction_map, pairs, transaction_counts):
-    """Анализирует подмножество данных (рост или падение)"""
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    
+@timed()
+def analyze_subset(X, y, transaction_map, itemsets, transaction_counts):
+    """
+    Обучает лес на обучающих днях: y - 1 для дней анализируемого направления (рост или падение), 0 для остальных.
+    X может быть разреженной матрицей (CSC float32 деревья используют без копирования).
+    """
     model = RandomForestClassifier(
         n_estimators=100,
         max_depth=5,
         min_samples_leaf=5,
         random_state=42
     )
-    model.fit(X_train, y_train)
+    model.fit(X, y)
     
     feature_importance = {}
-    
-    # Анализ одиночных транзакций
-    for t, idx in transaction_map.items():
-        if model.feature_importances_[idx] > 0.01:
+    # Важности только признаков разбиений: плотный feature_importances_ на все пары слишком велик
+    amounts_by_column = {idx: t for t, idx in transaction_map.items()}
+    
+    for idx, importance in zip(*split_importances(model)):
+        if importance <= 0.01:
+            continue
+        idx = int(idx)
+        if idx < len(transaction_map):
+            # Одиночная транзакция
+            t = amounts_by_column[idx]
             feature_importance[f"single_{t}"] = {
                 'transactions': [t],
-                'importance': model.feature_importances_[idx],
+                'importance': importance,
                 'frequency': transaction_counts[t]
             }
-    
-    # Анализ пар
-    for i, (t1, t2) in enumerate(pairs):
-        idx = len(transaction_map) + i
-        if model.feature_importances_[idx] > 0.01:
-            feature_importance[f"pair_{t1}_{t2}"] = {
-                'transactions': [t1, t2],
-                'importance': model.feature_importances_[idx],
-                'frequency': min(transaction_counts[t1], transaction_counts[t2])
+        else:
+            # Набор (пара, тройка и т.д.)
+            itemset = itemsets[idx - len(transaction_map)]
+            prefix = 'pair' if len(itemset) == 2 else f'set{len(itemset)}'
+            feature_importance[f"{prefix}_{'_'.join(map(str, itemset))}"] = {
+                'transactions': list(itemset),
+                'importance': importance,
+                'frequency': min(transaction_counts[t] for t in itemset)
             }
     
     return model, feature_importance
 
 if __name__ == "__main__":
-    df = create_combined_dataset(
-        'Global_functions/.csv/btc_big_movements_20250121.csv',
-        'Whale_bots_transactions/.csv/whalebot_transactions.csv'
+    df, baskets = create_combined_dataset(
+        MOVEMENTS_FILE,
+        bots=('whalebot',)
     )
     
     print("Начинаем анализ всех транзакций...")
-    results = analyze_price_movements(df)
+    results = analyze_price_movements(df, baskets)
     
     print("\nПаттерны для роста цены:")
     for pattern, info in sorted(results['up_patterns'].items(), 
@@ -202,4 +217,4 @@ if __name__ == "__main__":
     print(df.tail(10))
     
     print("\nРазмер датафрейма:", df.shape)
-    print("\nКоличество дней с транзакциями:", df['transactions'].apply(len).value_counts()) 
\ No newline at end of file
+    print("\nКоличество дней с транзакциями:", df['transactions_count'].value_counts()) 
\ No newline at end of file
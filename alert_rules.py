@@ -0,0 +1,165 @@
+import json
+from bisect import bisect_right
+from collections import defaultdict, deque
+
+import numpy as np
+import pandas as pd
+
+
+class AlertRule:
+    """
+    Правило отслеживания суммы в каналах channels (None - во всех).
+    По умолчанию (tolerance=None) подходит любая сумма с той же целой частью - [amount, amount + 1),
+    как прежняя проверка f"{int(btc_amount)} BTC"; tolerance=0 - только точная сумма,
+    tolerance > 0 - отрезок amount ± tolerance.
+    При hits > 1 правило срабатывает, когда сумма встретилась hits раз за window_minutes.
+    """
+
+    __slots__ = ('name', 'amount', 'tolerance', 'channels', 'hits', 'window_minutes', 'low', 'high', 'upper')
+
+    def __init__(self, amount: float, tolerance: float = None, channels=None, hits: int = 1,
+                 window_minutes: float = None, name: str = None):
+        if tolerance is not None and tolerance < 0:
+            raise ValueError("Допуск правила не может быть отрицательным")
+        if hits > 1 and not window_minutes:
+            raise ValueError("Для правила из нескольких срабатываний нужно окно window_minutes")
+        self.amount = float(amount)
+        self.tolerance = None if tolerance is None else float(tolerance)
+        self.channels = tuple(channels) if channels else None
+        self.hits = int(hits)
+        self.window_minutes = window_minutes
+        self.name = name or (f'{self.amount:g}±{self.tolerance:g} BTC' if self.tolerance else f'{self.amount:g} BTC')
+        if self.tolerance is None:
+            self.low, self.high = self.amount, self.amount + 1
+            self.upper = self.high
+        else:
+            self.low, self.high = self.amount - self.tolerance, self.amount + self.tolerance
+            # Правая граница отрезка с допуском включается
+            self.upper = np.nextafter(self.high, np.inf)
+
+    def __repr__(self):
+        return f"AlertRule({self.name!r}, channels={self.channels}, hits={self.hits}, window={self.window_minutes})"
+
+
+# Отслеживаемые суммы по умолчанию (общие для live-мониторинга и разбора таблиц)
+WATCHED_RULES = [
+    AlertRule(547),
+    AlertRule(840),
+    AlertRule(960)
+]
+
+
+class _IntervalIndex:
+    """
+    Индекс полуинтервалов [low, upper) для поиска всех, содержащих точку, за O(log n + k):
+    ось разбита границами отрезков на элементарные участки, для каждого участка заранее
+    известен список покрывающих его правил.
+    """
+
+    def __init__(self, rules: list):
+        self.edges = []
+        self.segments = []
+        if not rules:
+            return
+        bounds = [(rule.low, rule.upper, rule) for rule in rules]
+        self.edges = sorted({edge for low, high, _ in bounds for edge in (low, high)})
+        starts, ends = defaultdict(list), defaultdict(list)
+        for low, high, rule in bounds:
+            starts[low].append(rule)
+            ends[high].append(rule)
+
+        active = {}
+        for edge in self.edges:
+            for rule in ends[edge]:
+                active.pop(id(rule), None)
+            for rule in starts[edge]:
+                active[id(rule)] = rule
+            self.segments.append(tuple(active.values()))
+        self.edges_array = np.asarray(self.edges)
+
+    def find(self, amount: float) -> tuple:
+        position = bisect_right(self.edges, amount) - 1
+        return self.segments[position] if position >= 0 else ()
+
+    def mask(self, amounts: np.ndarray) -> np.ndarray:
+        """Маска сумм, попавших хотя бы в один отрезок"""
+        if not self.segments:
+            return np.zeros(len(amounts), dtype=bool)
+        covered = np.array([len(segment) > 0 for segment in self.segments] + [False])
+        return covered[np.searchsorted(self.edges_array, amounts, side='right') - 1]
+
+
+class AlertRuleEngine:
+    """
+    Проверка сумм транзакций по правилам. Точные суммы (tolerance=0) ищутся в хэш-таблице,
+    целые BTC и диапазоны с допуском - в индексе отрезков; индексы строятся отдельно для каждого канала
+    и для правил без ограничения по каналам. Цена проверки - O(log n), а не перебор правил.
+    """
+
+    ALL_CHANNELS = None
+
+    def __init__(self, rules=WATCHED_RULES):
+        self.rules = list(rules)
+        scoped = defaultdict(list)
+        for rule in self.rules:
+            for channel in rule.channels or (self.ALL_CHANNELS,):
+                scoped[channel].append(rule)
+
+        self._exact = {}
+        self._ranges = {}
+        for channel, channel_rules in scoped.items():
+            exact = defaultdict(list)
+            for rule in channel_rules:
+                if rule.tolerance == 0:
+                    exact[rule.amount].append(rule)
+            self._exact[channel] = dict(exact)
+            self._ranges[channel] = _IntervalIndex([rule for rule in channel_rules if rule.tolerance != 0])
+
+        # Времена срабатываний правил с окном: id правила -> очередь отметок времени
+        self._hits = defaultdict(deque)
+
+    @classmethod
+    def from_json(cls, filename: str):
+        """Правила из JSON-файла: список объектов с полями AlertRule"""
+        with open(filename, encoding='utf-8') as f:
+            return cls([AlertRule(**rule) for rule in json.load(f)])
+
+    def match(self, amount: float, channel: str = None) -> list:
+        """Правила, под которые подходит сумма (без учета окон)"""
+        matched = []
+        for scope in {channel, self.ALL_CHANNELS}:
+            matched.extend(self._exact.get(scope, {}).get(float(amount), ()))
+            if scope in self._ranges:
+                matched.extend(self._ranges[scope].find(float(amount)))
+        return matched
+
+    def evaluate(self, amount: float, channel: str = None, timestamp=None) -> list:
+        """
+        Правила, сработавшие на транзакции. Для правил с окном учитывается история срабатываний:
+        правило срабатывает, когда в окне набралось hits совпадений.
+        """
+        fired = []
+        for rule in self.match(amount, channel):
+            if rule.hits <= 1:
+                fired.append(rule)
+                continue
+            now = pd.Timestamp(timestamp) if timestamp is not None else pd.Timestamp.now(tz='UTC')
+            hits = self._hits[id(rule)]
+            hits.append(now)
+            horizon = now - pd.Timedelta(minutes=rule.window_minutes)
+            while hits and hits[0] < horizon:
+                hits.popleft()
+            if len(hits) >= rule.hits:
+                fired.append(rule)
+        return fired
+
+    def matches_mask(self, amounts, channel: str = None) -> np.ndarray:
+        """Векторная проверка столбца сумм: маска транзакций, подходящих хотя бы под одно правило"""
+        amounts = np.asarray(amounts, dtype=np.float64)
+        mask = np.zeros(len(amounts), dtype=bool)
+        for scope in {channel, self.ALL_CHANNELS}:
+            if self._exact.get(scope):
+                mask |= np.isin(amounts, np.fromiter(self._exact[scope], dtype=np.float64))
+            if scope in self._ranges:
+                mask |= self._ranges[scope].mask(amounts)
+        return mask
@@ -1,37 +1,33 @@
-import pandas as pd
-from datetime import datetime, timedelta
 import os
-import pytz
-
-# Добавим отладочную информацию
-print("Текущая директория:", os.getcwd())
-print("Проверяем существование файла:", os.path.exists('/home/aka/Documents/algoTrading/Whale_bots_transactions/.csv/whale_alert_transactions.csv'))
-
-# Проверяем существование файла
-if not os.path.exists('/home/aka/Documents/algoTrading/Whale_bots_transactions/.csv/whale_alert_transactions.csv'):
-    raise FileNotFoundError(f"Файл не найден по пути: /home/aka/Documents/algoTrading/Whale_bots_transactions/cvx/whale_alert_transactions.csv")
-
-# Загружаем CSV файл
-df = pd.read_csv('/home/aka/Documents/algoTrading/Whale_bots_transactions/.csv/whale_alert_transactions.csv')
-
-# Преобразуем даты
-df['date'] = pd.to_datetime(df['date'])
-
-# Получаем дату 30 дней назад
-date_30_days_ago = datetime.now(pytz.UTC) - timedelta(days=30)
-
-# Фильтруем данные по дате и значениям BTC (547, 840, 960)
-filtered_df = df[
-    (df['date'] >= date_30_days_ago) & 
-    (df['btc'].isin([547.0, 840.0, 960.0]))
-]
+import time
+from paths import channel_csv
+from alert_rules import WATCHED_RULES, AlertRule, AlertRuleEngine
+from transaction_index import TransactionIndex
+
+WHALE_ALERT_FILE = channel_csv('whale_alert')
+
+# Индекс по времени поддерживается сборщиком 01; если CSV изменился без него
+# (или индекса еще нет), перестраиваем индекс по CSV
+index = TransactionIndex('whale_alert')
+imported = index.sync_csv(WHALE_ALERT_FILE)
+if imported:
+    print(f"Индекс перестроен по {WHALE_ALERT_FILE}: {imported} записей")
+elif len(index) == 0 and not os.path.exists(WHALE_ALERT_FILE):
+    raise FileNotFoundError(f"Нет ни индекса, ни файла {WHALE_ALERT_FILE}")
+
+# Транзакции за последние 30 дней с отслеживаемыми суммами (те же суммы, что и в live-мониторинге,
+# но, как и раньше в этой таблице, только точные значения, а не вся целая часть)
+exact_rules = AlertRuleEngine([AlertRule(rule.amount, tolerance=0, channels=rule.channels) for rule in WATCHED_RULES])
+start = time.perf_counter()
+filtered_df = index.last(days=30, rules=exact_rules)
+elapsed = time.perf_counter() - start
 
 # Выводим результат
 print("\nОтфильтрованные транзакции:")
 print(filtered_df)
 
 # Статистика
-print("\nКоличество найденных транзакций:", len(filtered_df))
+print(f"\nКоличество найденных транзакций: {len(filtered_df)} (запрос {elapsed * 1000:.1f} мс по {len(index)} записям)")
 print("Общий объем BTC:", filtered_df['btc'].sum())
 
 # Если нужно сохранить результат в новый CSV файл:
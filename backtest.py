@@ -0,0 +1,226 @@
+import importlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from day_baskets import DayBaskets
+from instrumentation import stage
+from model_artifact import MODEL_NAMES, check_forests, feature_itemsets, load_model_artifact
+from movement_features import build_sparse_features
+from paths import BACKTEST_FILE, MODEL_FILE, MOVEMENTS_FILE, PRICES_FILE
+
+# Направления сделок по сигналу: 1 - покупка, -1 - продажа
+LONG, SHORT = 1, -1
+SIGNALS_PER_TASK = 2000
+
+
+def load_prices(filename: str = PRICES_FILE) -> pd.Series:
+    """Дневные цены закрытия из CSV (колонки Date/date и Close/close/price), индекс - день"""
+    prices = pd.read_csv(filename)
+    columns = {col.lower(): col for col in prices.columns}
+    date_column = columns.get('date')
+    price_column = columns.get('close') or columns.get('price')
+    if date_column is None or price_column is None:
+        raise ValueError(f"В {filename} нужны колонки Date и Close, есть: {list(prices.columns)}")
+    days = pd.to_datetime(prices[date_column], utc=True).dt.tz_localize(None).dt.normalize()
+    return pd.Series(prices[price_column].to_numpy(dtype=np.float64), index=days).groupby(level=0).last().sort_index()
+
+
+def price_on(prices: pd.Series, days, offset: int = 0) -> np.ndarray:
+    """Цены закрытия через offset календарных дней после days (NaN, если цены за день нет)"""
+    days = pd.DatetimeIndex(pd.to_datetime(days)).normalize() + pd.Timedelta(days=offset)
+    return prices.reindex(days).to_numpy(dtype=np.float64)
+
+
+def forward_returns(prices: pd.Series, days, horizons, delay: int = 1) -> np.ndarray:
+    """
+    Доходность сделки, открытой по сигналу дня d: вход по закрытию календарного дня d + delay
+    (корзина дня известна только после его окончания), выход через horizon календарных дней
+    после входа. Цены берутся из непрерывного дневного ряда load_prices, а не из строк таблицы
+    движений: в ней только дни крупных движений, и соседние строки могут отстоять на месяцы.
+    Возвращает матрицу дни × горизонты; NaN - нет цены входа или выхода.
+    """
+    entry = price_on(prices, days, delay)
+    returns = np.empty((len(entry), len(horizons)))
+    for j, horizon in enumerate(horizons):
+        returns[:, j] = price_on(prices, days, delay + horizon) / entry - 1
+    return returns
+
+
+def basket_signals(baskets: DayBaskets, min_support: int = 2, max_itemset_len: int = 2):
+    """
+    Сигналы из дневных корзин: каждая сумма и каждый частый набор сумм - отдельный сигнал,
+    срабатывающий в дни, когда встретились все его суммы.
+    Возвращает CSC-матрицу дни × сигналы (bool) и имена сигналов.
+    """
+    X, transaction_map, itemsets, _ = build_sparse_features(baskets, min_support=min_support,
+                                                            max_itemset_len=max_itemset_len)
+    names = [f"single_{amount}" for amount in transaction_map]
+    names += [f"{'pair' if len(itemset) == 2 else f'set{len(itemset)}'}_{'_'.join(map(str, itemset))}"
+              for itemset in itemsets]
+    return (X > 0).tocsc(), names
+
+
+def model_signals(baskets: DayBaskets, model_file: str = MODEL_FILE, top: int = 50):
+    """
+    Сигналы из артефакта модели 04: top признаков по важности up_model (покупка)
+    и down_model (продажа). Признак - сумма или набор сумм, сигнал - день, когда встретились все суммы.
+    Возвращает CSC-матрицу дни × сигналы, имена и направления сигналов.
+    """
+    arrays, meta = load_model_artifact(model_file)
+    check_forests(meta, model_file)
+    features = feature_itemsets(arrays)
+    present = {}
+    columns, names, directions = [], [], []
+    for model_name, direction in zip(MODEL_NAMES, (LONG, SHORT)):
+        importances = arrays['importances'][MODEL_NAMES.index(model_name)]
+        for idx in np.argsort(importances)[::-1][:top]:
+            if importances[idx] <= 0:
+                break
+            feature = features[idx]
+            days = np.ones(len(baskets), dtype=bool)
+            for amount in feature:
+                if amount not in present:
+                    present[amount] = baskets.contains(amount)
+                days &= present[amount]
+            columns.append(days)
+            names.append(('single_' if len(feature) == 1 else 'set_') + '_'.join(map(str, feature)))
+            directions.append(direction)
+    signals = sp.csc_matrix(np.column_stack(columns)) if columns else sp.csc_matrix((len(baskets), 0), dtype=bool)
+    return signals, names, np.asarray(directions, dtype=np.int64)
+
+
+def backtest_signals(signals: sp.csc_matrix, returns: np.ndarray, direction: int, fee: float) -> dict:
+    """
+    Статистика сделок всех сигналов сразу: по каждому дню срабатывания сигнала открывается
+    сделка (пересекающиеся сделки допускаются, вес у всех одинаковый), комиссия - fee на вход и выход.
+    returns - доходности forward_returns (дни × горизонты).
+    Возвращает словарь матриц сигналы × горизонты.
+    """
+    signals = signals.tocsc()
+    signals.sort_indices()
+    n_signals = signals.shape[1]
+    trade_signal = np.repeat(np.arange(n_signals), np.diff(signals.indptr))
+    gross = returns[signals.indices]
+
+    valid = ~np.isnan(gross)
+    net = np.where(valid, direction * gross - 2 * fee, 0.0)
+    # Суммирование по сигналам одной разреженной матрицей сигналы × сделки
+    by_signal = sp.csr_matrix((np.ones(len(trade_signal)), (trade_signal, np.arange(len(trade_signal)))),
+                              shape=(n_signals, len(trade_signal)))
+    trades = by_signal @ valid.astype(np.float64)
+    total = by_signal @ net
+    squares = by_signal @ (net ** 2)
+    hits = by_signal @ (valid & (net > 0)).astype(np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / trades
+        std = np.sqrt(np.maximum(squares / trades - mean ** 2, 0) * trades / (trades - 1))
+        t_stat = mean / std * np.sqrt(trades)
+
+    # Максимальная просадка накопленной доходности сделок (в порядке дней) с нулевой начальной точкой
+    grouped = pd.DataFrame(net).groupby(trade_signal)
+    equity = grouped.cumsum()
+    peak = equity.groupby(trade_signal).cummax().clip(lower=0)
+    drawdown = (peak - equity).groupby(trade_signal).max().reindex(range(n_signals), fill_value=0.0).to_numpy()
+
+    return {
+        'trades': trades, 'total_return': total, 'mean_return': mean, 'std': std,
+        'hit_rate': hits / trades, 't_stat': t_stat, 'max_drawdown': drawdown
+    }
+
+
+def _backtest_task(signals, names, directions, delay_returns, horizons, fees, min_trades) -> list:
+    """
+    Задача для процесса: все комбинации задержки, комиссии и горизонта для блока сигналов.
+    delay_returns - {задержка: доходности forward_returns}.
+    """
+    records = []
+    for delay, returns in delay_returns.items():
+        for fee, direction in product(fees, np.unique(directions)):
+            columns = np.flatnonzero(directions == direction)
+            stats = backtest_signals(signals[:, columns], returns, int(direction), fee)
+            rows, horizon_ids = np.nonzero(stats['trades'] >= min_trades)
+            for row, j in zip(rows, horizon_ids):
+                record = {'signal': names[columns[row]], 'direction': 'long' if direction == LONG else 'short',
+                          'delay': delay, 'horizon': horizons[j], 'fee': fee}
+                record.update({key: float(value[row, j]) for key, value in stats.items()})
+                records.append(record)
+    return records
+
+
+@stage('backtest')
+def run_backtest_grid(df: pd.DataFrame, baskets: DayBaskets, prices: pd.Series, horizons=(1, 3, 7),
+                      delays=(1,), fees=(0.001,), directions=(LONG, SHORT), signals=None,
+                      min_support: int = 2, max_itemset_len: int = 2, min_trades: int = 5, n_jobs=None) -> pd.DataFrame:
+    """
+    Бэктест сигналов по транзакциям с перебором параметров на пуле процессов.
+    df/baskets - результат create_combined_dataset (строка i = корзина i), prices - load_prices.
+    signals - готовые (матрица, имена, направления), например model_signals; по умолчанию
+    сигналами служат все суммы и частые наборы сумм, каждый проверяется в направлениях directions.
+    Сигналы делятся на блоки по SIGNALS_PER_TASK, внутри блока все горизонты считаются одной операцией.
+    Возвращает статистику по каждой комбинации (сигнал, направление, задержка, горизонт, комиссия)
+    с числом сделок не меньше min_trades.
+    """
+    start = time.perf_counter()
+    delay_returns = {delay: forward_returns(prices, df['date'], horizons, delay) for delay in delays}
+    if all(np.isnan(returns).all() for returns in delay_returns.values()):
+        raise ValueError("Нет цен входа и выхода ни для одного дня таблицы движений")
+
+    if signals is None:
+        matrix, names = basket_signals(baskets, min_support, max_itemset_len)
+        n_signals = matrix.shape[1]
+        matrix = sp.hstack([matrix] * len(directions), format='csc')
+        names = names * len(directions)
+        signal_directions = np.repeat(np.asarray(directions, dtype=np.int64), n_signals)
+    else:
+        matrix, names, signal_directions = signals
+        matrix = matrix.tocsc()
+        signal_directions = np.asarray(signal_directions, dtype=np.int64)
+    print(f"Сигналов: {matrix.shape[1]}, комбинаций параметров на сигнал: {len(horizons) * len(delays) * len(fees)}")
+
+    blocks = range(0, matrix.shape[1], SIGNALS_PER_TASK)
+    records = []
+    with ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        futures = [executor.submit(_backtest_task, matrix[:, i:i + SIGNALS_PER_TASK], names[i:i + SIGNALS_PER_TASK],
+                                   signal_directions[i:i + SIGNALS_PER_TASK], delay_returns, tuple(horizons),
+                                   tuple(fees), min_trades)
+                   for i in blocks]
+        for future in futures:
+            records.extend(future.result())
+
+    results = pd.DataFrame(records)
+    if not results.empty:
+        results = results.sort_values('t_stat', ascending=False, na_position='last').reset_index(drop=True)
+    print(f"Бэктест завершен за {time.perf_counter() - start:.1f} с, результатов: {len(results)}")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Бэктест сигналов по транзакциям китов')
+    parser.add_argument('--prices', default=PRICES_FILE)
+    parser.add_argument('--model', action='store_true', help='сигналы из сохраненной модели 04 вместо всех наборов сумм')
+    parser.add_argument('--horizons', type=int, nargs='+', default=[1, 3, 7])
+    parser.add_argument('--delays', type=int, nargs='+', default=[1])
+    parser.add_argument('--fees', type=float, nargs='+', default=[0.001])
+    parser.add_argument('--min-trades', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=None)
+    args = parser.parse_args()
+
+    movements = importlib.import_module('04_compare_bigBtc_movements_and_transactions')
+    df, baskets = movements.create_combined_dataset(MOVEMENTS_FILE, bots=('whalebot',))
+    signals = model_signals(baskets) if args.model else None
+
+    results = run_backtest_grid(df.reset_index(drop=True), baskets, load_prices(args.prices),
+                                horizons=args.horizons, delays=args.delays, fees=args.fees,
+                                signals=signals, min_trades=args.min_trades, n_jobs=args.jobs)
+    results.to_csv(BACKTEST_FILE, index=False)
+    print(f"\nРезультаты сохранены в {BACKTEST_FILE}")
+    print(results.head(20))
@@ -0,0 +1,48 @@
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegramClient
+
+
+def bench_backfill(messages_per_channel: int = 20_000, page_latency: float = 0.01) -> dict:
+    """Прогоняет get_history на офлайн-клиенте во временном каталоге и замеряет пропускную способность"""
+    # Скрипт 01 создает TelegramClient при импорте - для офлайн-прогона достаточно фиктивных ключей
+    os.environ.setdefault('API_ID', '1')
+    os.environ.setdefault('API_HASH', 'offline')
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            tg_channel_parse = importlib.import_module('01_tg_channel_parse')
+            fake_client = FakeTelegramClient(messages_per_channel=messages_per_channel, page_latency=page_latency)
+
+            start = time.perf_counter()
+            stats = asyncio.run(tg_channel_parse.get_history(fake_client))
+            elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+
+    total = sum(stats[name] for name in tg_channel_parse.CHANNELS if name in stats)
+    network_time = fake_client.pages_served * page_latency
+    result = {
+        'messages': total,
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(total / elapsed),
+        'simulated_network_seconds': round(network_time, 3),
+        'max_parse_queue': stats['max_parse_queue']
+    }
+    print(f"\nСообщений: {total}, время: {elapsed:.2f} с ({total / elapsed:,.0f} сообщений/с)")
+    print(f"Суммарная имитация сети: {network_time:.2f} с, максимум очереди разбора: {stats['max_parse_queue']}")
+    return result
+
+
+if __name__ == "__main__":
+    bench_backfill()
@@ -0,0 +1,40 @@
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_parser import parse_messages
+
+FIXTURES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'alert_messages.json')
+
+
+def bench_message_parser(messages_per_channel: int = 100_000, repeats: int = 3) -> dict:
+    """Замеряет пропускную способность пакетного парсера на корпусе сообщений каналов"""
+    with open(FIXTURES_FILE, encoding='utf-8') as f:
+        corpus = json.load(f)
+
+    results = {}
+    for channel_name, texts in corpus.items():
+        batch = (texts * (messages_per_channel // len(texts) + 1))[:messages_per_channel]
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            parsed = parse_messages(batch, channel_name)
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+        results[channel_name] = {
+            'messages': len(batch),
+            'matched': int(parsed['matched'].sum()),
+            'seconds': round(best, 4),
+            'messages_per_sec': round(len(batch) / best)
+        }
+        print(f"{channel_name}: {len(batch)} сообщений за {best:.3f} с "
+              f"({len(batch) / best:,.0f} сообщений/с, найдено BTC: {results[channel_name]['matched']})")
+    return results
+
+
+if __name__ == "__main__":
+    bench_message_parser()
@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_telegram import FakeMessage
+
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baselines', 'pipeline.json')
+
+# Объем 1x - примерно текущая история whalebot (~90 тыс. строк за ~760 дней)
+BASE_ROWS = 90_000
+HISTORY_DAYS = 762
+HISTORY_START = datetime(2023, 1, 1)
+# Доля сообщений whale_alert от whalebot и доля из них, дублирующих whalebot
+WHALE_ALERT_SHARE = 0.3
+CROSS_BOT_DUPLICATES = 0.5
+
+SCALES = (1, 10, 100)
+STAGES = ('ingest', 'merge', 'frequency', 'combined_dataset', 'price_movements')
+
+# Популярные круглые суммы и их веса - как в реальной истории (1, 200, 300, 500 BTC чаще всего)
+ROUND_AMOUNTS = np.array([1, 200, 300, 500, 250, 150, 400, 100, 600, 1000, 2000, 5000], dtype=np.float64)
+ROUND_WEIGHTS = np.array([24, 21, 20, 16, 11, 10, 10, 8, 6, 4, 2, 1], dtype=np.float64)
+ROUND_SHARE = 0.2
+
+WHALEBOT_TEMPLATE = "🐳 {amount} BTC ({usd} USD) transferred from {sender} to {receiver}"
+WHALE_ALERT_TEMPLATE = ("🚨 {amount} #BTC ({usd} USD) transferred from {sender} to {receiver}\n\n"
+                        "Details https://whale-alert.io/transaction/bitcoin/{tx_hash}")
+ENTITIES = ('unknown wallet', 'Binance', 'Coinbase', 'Kraken', 'Bitfinex', 'OKX')
+# Сообщений в одной партии рендеринга для стадии ingest
+RENDER_CHUNK_SIZE = 10_000
+
+
+def generate_amounts(rng: np.random.Generator, n: int) -> np.ndarray:
+    """Целые суммы BTC: логнормальное тело около 230 BTC плюс всплески на круглых суммах"""
+    amounts = np.clip(np.rint(rng.lognormal(np.log(230), 0.6, n)), 1, 20_000)
+    is_round = rng.random(n) < ROUND_SHARE
+    amounts[is_round] = rng.choice(ROUND_AMOUNTS, is_round.sum(), p=ROUND_WEIGHTS / ROUND_WEIGHTS.sum())
+    return amounts
+
+
+def generate_transactions(scale: int = 1, seed: int = 42):
+    """
+    Детерминированные истории транзакций whalebot и whale_alert объемом scale × BASE_ROWS.
+    Период тот же при любом масштабе - растет плотность сообщений;
+    часть сообщений whale_alert дублирует whalebot с задержкой до двух минут.
+    """
+    rng = np.random.default_rng(seed + scale)
+    history_seconds = HISTORY_DAYS * 86_400
+
+    n_whalebot = BASE_ROWS * scale
+    seconds = np.sort(rng.integers(0, history_seconds, n_whalebot))
+    whalebot = pd.DataFrame({
+        'date': pd.Timestamp(HISTORY_START) + pd.to_timedelta(seconds, unit='s'),
+        'btc': generate_amounts(rng, n_whalebot)
+    })
+
+    n_whale_alert = int(n_whalebot * WHALE_ALERT_SHARE)
+    n_duplicates = int(n_whale_alert * CROSS_BOT_DUPLICATES)
+    source = rng.choice(n_whalebot, n_duplicates, replace=False)
+    own_seconds = rng.integers(0, history_seconds, n_whale_alert - n_duplicates)
+    whale_alert = pd.DataFrame({
+        'date': np.concatenate([
+            whalebot['date'].to_numpy()[source] + pd.to_timedelta(rng.integers(0, 120, n_duplicates), unit='s').to_numpy(),
+            (pd.Timestamp(HISTORY_START) + pd.to_timedelta(own_seconds, unit='s')).to_numpy()
+        ]),
+        'btc': np.concatenate([whalebot['btc'].to_numpy()[source], generate_amounts(rng, len(own_seconds))])
+    }).sort_values('date', kind='stable').reset_index(drop=True)
+    return whalebot, whale_alert
+
+
+def generate_movements(seed: int = 42) -> pd.DataFrame:
+    """Таблица движений цены в формате btc_big_movements: Date и изменение за 3 дня в процентах"""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(HISTORY_START, periods=HISTORY_DAYS, freq='D')
+    return pd.DataFrame({
+        'Date': days.strftime('%Y-%m-%d'),
+        '+3d': [f'{change:.1f}%' for change in rng.normal(0.2, 3.0, HISTORY_DAYS)],
+        'Movement': 'synthetic'
+    })
+
+
+def render_message_batches(transactions: pd.DataFrame, channel_name: str, seed: int = 42,
+                           chunk_size: int = RENDER_CHUNK_SIZE):
+    """
+    Сообщения канала для транзакций (суммы и USD с разделителями тысяч, как у ботов) партиями
+    по chunk_size: тексты формируются только для текущей партии, поэтому память не растет с объемом истории
+    """
+    rng = np.random.default_rng(seed)
+    template = WHALEBOT_TEMPLATE if channel_name == 'whalebot' else WHALE_ALERT_TEMPLATE
+    for start in range(0, len(transactions), chunk_size):
+        chunk = transactions.iloc[start:start + chunk_size]
+        entity_ids = rng.integers(0, len(ENTITIES), (len(chunk), 2))
+        prices = rng.uniform(16_000, 105_000, len(chunk))
+        dates = chunk['date'].dt.tz_localize('UTC')
+        messages = []
+        for i, (date, amount) in enumerate(zip(dates, chunk['btc'])):
+            text = template.format(
+                amount=f'{amount:,.0f}', usd=f'{amount * prices[i]:,.0f}',
+                sender=ENTITIES[entity_ids[i, 0]], receiver=ENTITIES[entity_ids[i, 1]], tx_hash=f'{start + i:06x}'
+            )
+            messages.append(FakeMessage(start + i + 1, text, date))
+        yield messages
+
+
+def write_dataset(work_dir: str, scale: int, seed: int = 42) -> dict:
+    """Пишет входные файлы стадий в work_dir и возвращает их размеры"""
+    whalebot, whale_alert = generate_transactions(scale, seed)
+    whalebot.to_csv(os.path.join(work_dir, 'whalebot_transactions.csv'), index=False)
+    whale_alert.to_csv(os.path.join(work_dir, 'whale_alert_transactions.csv'), index=False)
+    generate_movements(seed).to_csv(os.path.join(work_dir, 'movements.csv'), index=False)
+    return {'whalebot': len(whalebot), 'whale_alert': len(whale_alert)}
+
+
+def _stage_ingest(work_dir: str, seed: int):
+    # Отдельный каталог, чтобы хранилище не подхватило сгенерированные CSV как старую историю
+    ingest_dir = os.path.join(work_dir, 'ingest')
+    os.makedirs(ingest_dir, exist_ok=True)
+    os.chdir(ingest_dir)
+    os.environ.setdefault('API_ID', '1')
+    os.environ.setdefault('API_HASH', 'offline')
+    tg_channel_parse = importlib.import_module('01_tg_channel_parse')
+
+    # Сообщения рендерятся партиями во время загрузки: в памяти только текущая партия, а не вся история
+    transactions = {channel_name: pd.read_csv(os.path.join(work_dir, f'{channel_name}_transactions.csv'),
+                                              parse_dates=['date'])
+                    for channel_name in ('whalebot', 'whale_alert')}
+
+    async def ingest():
+        for channel_name, channel_transactions in transactions.items():
+            for messages in render_message_batches(channel_transactions, channel_name, seed):
+                for i in range(0, len(messages), tg_channel_parse.HISTORY_BATCH_SIZE):
+                    await tg_channel_parse.process_batch(messages[i:i + tg_channel_parse.HISTORY_BATCH_SIZE],
+                                                         channel_name)
+
+    return lambda: asyncio.run(ingest()), sum(len(frame) for frame in transactions.values())
+
+
+def _stage_merge(work_dir: str, seed: int):
+    merge = importlib.import_module('02_merge_BTC_transactions')
+    rows = sum(len(pd.read_csv(name, usecols=['btc'])) for name in ('whalebot_transactions.csv', 'whale_alert_transactions.csv'))
+    return lambda: merge.merge_transactions(whalebot_file='whalebot_transactions.csv',
+                                            whale_alert_file='whale_alert_transactions.csv',
+                                            output_file='all_btc_transactions.csv'), rows
+
+
+def _stage_frequency(work_dir: str, seed: int):
+    import matplotlib
+    matplotlib.use('Agg')
+    frequency = importlib.import_module('03_analyze_transactions_frequency')
+    df = pd.read_csv('whalebot_transactions.csv')
+    return lambda: frequency.analyze_btc_transactions_frequency(df, 'btc_frequency_analysis.csv', show_plot=False), len(df)
+
+
+def _stage_combined_dataset(work_dir: str, seed: int):
+    movements = importlib.import_module('04_compare_bigBtc_movements_and_transactions')
+    rows = len(pd.read_csv('whalebot_transactions.csv', usecols=['btc']))
+    return lambda: movements.create_combined_dataset('movements.csv', 'whalebot_transactions.csv'), rows
+
+
+def _stage_price_movements(work_dir: str, seed: int):
+    movements = importlib.import_module('04_compare_bigBtc_movements_and_transactions')
+    df, baskets = movements.create_combined_dataset('movements.csv', 'whalebot_transactions.csv')
+    return lambda: movements.analyze_price_movements(df, baskets, model_file='models/price_movement_model.bin'), len(baskets.amounts)
+
+
+def _run_stage(stage: str, work_dir: str, seed: int) -> dict:
+    """Выполняется в отдельном процессе: пиковый RSS процесса относится только к одной стадии"""
+    os.chdir(work_dir)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        run, rows = globals()[f'_stage_{stage}'](work_dir, seed)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss в Linux - в килобайтах
+    return {
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed),
+        'peak_rss_mb': round(rss_peak / 1024, 1),
+        'stage_rss_mb': round((rss_peak - rss_before) / 1024, 1)
+    }
+
+
+def run_pipeline_benchmarks(scales=SCALES, stages=STAGES, seed: int = 42) -> dict:
+    """Прогоняет стадии 01-04 на синтетических данных каждого масштаба, каждую стадию в новом процессе"""
+    results = {}
+    for scale in scales:
+        work_dir = tempfile.mkdtemp(prefix=f'bench_pipeline_{scale}x_')
+        try:
+            sizes = write_dataset(work_dir, scale, seed)
+            print(f"\n{scale}x: whalebot {sizes['whalebot']:,} строк, whale_alert {sizes['whale_alert']:,} строк")
+            results[f'{scale}x'] = {}
+            for stage in stages:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    result = executor.submit(_run_stage, stage, work_dir, seed).result()
+                results[f'{scale}x'][stage] = result
+                print(f"  {stage}: {result['rows']:,} строк за {result['seconds']:.2f} с "
+                      f"({result['rows_per_sec']:,} строк/с), пиковый RSS {result['peak_rss_mb']} МБ")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def load_baseline(filename: str = BASELINE_FILE) -> dict:
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(results: dict, filename: str = BASELINE_FILE):
+    """Дописывает результаты в файл базовых замеров (по масштабам и стадиям)"""
+    baseline = load_baseline(filename)
+    baseline.setdefault('results', {})
+    for scale, stages in results.items():
+        baseline['results'].setdefault(scale, {}).update(stages)
+    baseline['machine'] = {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+    baseline['updated'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+    print(f"\nБазовые замеры сохранены в {filename}")
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """
+    Сравнивает замеры с базовыми: регрессия - пропускная способность ниже базовой
+    или пиковый RSS выше базового больше чем на tolerance. Возвращает список регрессий.
+    """
+    regressions = []
+    for scale, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get('results', {}).get(scale, {}).get(stage)
+            if base is None:
+                continue
+            speed = result['rows_per_sec'] / base['rows_per_sec']
+            memory = result['peak_rss_mb'] / base['peak_rss_mb']
+            print(f"{scale} {stage}: скорость {speed:.2f}x от базовой, память {memory:.2f}x от базовой")
+            if speed < 1 - tolerance:
+                regressions.append(f"{scale} {stage}: скорость упала до {speed:.2f}x")
+            if memory > 1 + tolerance:
+                regressions.append(f"{scale} {stage}: пиковый RSS вырос до {memory:.2f}x")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Бенчмарк стадий 01-04 на синтетических данных')
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES))
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--save', action='store_true', help='записать результаты как базовые')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run_pipeline_benchmarks(args.scales, args.stages)
+    regressions = compare_with_baseline(results, load_baseline(), args.tolerance)
+    if args.save:
+        save_baseline(results)
+    for regression in regressions:
+        print(f"Регрессия: {regression}")
+    sys.exit(1 if regressions and not args.save else 0)
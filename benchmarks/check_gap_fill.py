@@ -0,0 +1,83 @@
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeMessage
+
+TEMPLATE = "🐳 {amount:,} BTC ({usd:,} USD) transferred from unknown wallet to Binance"
+
+
+class GapTelegramClient:
+    """Офлайн-клиент, отдающий заданные сообщения пропуска по диапазону id"""
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def iter_messages(self, entity, min_id=0, max_id=0, reverse=False, **kwargs):
+        for message in self.messages:
+            if message.id > min_id and (not max_id or message.id < max_id):
+                yield message
+
+
+def check_gap_fill() -> dict:
+    """
+    Проверка заполнения пропуска live-потока: сообщение id 10 в 12:00 открывает пропуск,
+    сообщения 1-9 за 11:51-11:59 догружаются позже. Все 10 транзакций должны попасть
+    в хранилище; пустой пропуск (сообщения удалены) тоже должен сниматься.
+    """
+    os.environ.setdefault('API_ID', '1')
+    os.environ.setdefault('API_HASH', 'offline')
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            tg_channel_parse = importlib.import_module('01_tg_channel_parse')
+            channel_name = 'whalebot'
+            writer = tg_channel_parse.GroupCommitWriter(tg_channel_parse.get_channel_store, max_rows=1000,
+                                                        max_delay=3600)
+            noon = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+            def message(message_id, amount, minutes_before):
+                text = TEMPLATE.format(amount=amount, usd=amount * 40_000)
+                return FakeMessage(message_id, text, noon - timedelta(minutes=minutes_before))
+
+            # Live-сообщение после пропуска: контрольная точка держится перед ним
+            live = message(10, 1000, 0)
+            writer.hold(channel_name, 0)
+            tg_channel_parse.ingest_live_transaction(channel_name, live,
+                                                     tg_channel_parse.parse_message(live.text, channel_name), writer)
+            gap = [message(i, 100 + i, 10 - i) for i in range(1, 10)]
+            asyncio.run(tg_channel_parse.fill_gap(GapTelegramClient(gap), channel_name, 0, 10, writer))
+            writer.flush()
+            store = tg_channel_parse.get_channel_store(channel_name)
+            gap_rows, checkpoint = store.rows, store.last_message_id
+
+            # Пропуск без сообщений снимается, и строки после него записываются
+            writer.hold(channel_name, 10)
+            later = message(20, 2000, -5)
+            tg_channel_parse.ingest_live_transaction(channel_name, later,
+                                                     tg_channel_parse.parse_message(later.text, channel_name), writer)
+            asyncio.run(tg_channel_parse.fill_gap(GapTelegramClient([]), channel_name, 10, 20, writer))
+            writer.flush()
+            empty_gap_rows, empty_gap_checkpoint = store.rows, store.last_message_id
+        finally:
+            os.chdir(cwd)
+
+    result = {'gap_rows': gap_rows, 'checkpoint': checkpoint,
+              'empty_gap_rows': empty_gap_rows, 'empty_gap_checkpoint': empty_gap_checkpoint}
+    print(f"\nПропуск: строк {gap_rows} из 10, контрольная точка {checkpoint}; "
+          f"пустой пропуск: строк {empty_gap_rows} из 11, контрольная точка {empty_gap_checkpoint}")
+    return result
+
+
+if __name__ == "__main__":
+    result = check_gap_fill()
+    expected = {'gap_rows': 10, 'checkpoint': 10, 'empty_gap_rows': 11, 'empty_gap_checkpoint': 20}
+    sys.exit(0 if result == expected else 1)
@@ -0,0 +1,55 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+FIXTURES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'alert_messages.json')
+
+# Соответствие url канала и имени в корпусе фикстур
+CHANNEL_URLS = {
+    'https://t.me/whalebotalerts': 'whalebot',
+    'https://t.me/whale_alert_io': 'whale_alert'
+}
+
+
+class FakeMessage:
+    """Минимальная замена telethon Message: id, text, date"""
+
+    def __init__(self, message_id, text, date):
+        self.id = message_id
+        self.text = text
+        self.date = date
+
+
+class FakeTelegramClient:
+    """
+    Офлайн-замена TelegramClient.iter_messages для проверки пропускной способности и backpressure.
+    Отдает messages_per_channel сообщений из корпуса фикстур с шагом message_interval,
+    а каждые page_size сообщений ждет page_latency секунд, имитируя сетевой запрос страницы.
+    """
+
+    def __init__(self, messages_per_channel=10_000, page_size=100, page_latency=0.01,
+                 message_interval=timedelta(seconds=30)):
+        with open(FIXTURES_FILE, encoding='utf-8') as f:
+            self.corpus = json.load(f)
+        self.messages_per_channel = messages_per_channel
+        self.page_size = page_size
+        self.page_latency = page_latency
+        self.message_interval = message_interval
+        self.pages_served = 0
+
+    async def iter_messages(self, entity, offset_date=None, reverse=False, min_id=0, max_id=0):
+        texts = self.corpus[CHANNEL_URLS.get(entity, entity)]
+        start = offset_date or datetime(2024, 1, 1)
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+
+        for i in range(self.messages_per_channel):
+            if max_id and min_id + i + 1 >= max_id:
+                break
+            if i % self.page_size == 0:
+                self.pages_served += 1
+                await asyncio.sleep(self.page_latency)
+            # Время растет вместе с id, как в настоящем канале: продолжение после min_id идет дальше по времени
+            message_id = min_id + i + 1
+            yield FakeMessage(message_id, texts[i % len(texts)], start + message_id * self.message_interval)
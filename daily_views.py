@@ -0,0 +1,207 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from paths import VIEWS_DIR
+
+
+# Число дельта-файлов, после которого update сворачивает их в базовые файлы
+MAX_DELTAS = 500
+
+
+class DailyViews:
+    """
+    Материализованные дневные представления истории транзакций по ботам:
+    - daily_amounts: гистограмма сумм за день (day, bot, amount, count) - из нее же собирается корзина дня
+    - daily_totals: количество транзакций и сумма BTC за день (day, bot, count, btc_sum)
+    Обновляются инкрементально: агрегируются только строки новее водяного знака бота,
+    и каждое обновление пишет только свои агрегаты отдельным дельта-файлом (deltas/) -
+    базовые файлы при этом не перечитываются и не переписываются.
+    При чтении дельты складываются с базой (merge-on-read); compact сворачивает их в новую базу.
+    Зафиксированы дельты с номерами [delta_start, delta_end) из метаданных.
+    Представления каналов (VIEWS_DIR) обновляет загрузка 01, объединенные без дубликатов
+    между ботами (MERGED_VIEWS_DIR) - 02; в них бот строки - имена ботов транзакции через запятую.
+    """
+
+    def __init__(self, base_dir: str = VIEWS_DIR, max_deltas: int = MAX_DELTAS):
+        self.base_dir = base_dir
+        self.deltas_dir = os.path.join(base_dir, 'deltas')
+        self.meta_path = os.path.join(base_dir, '_meta.json')
+        self.max_deltas = max_deltas
+        self.meta = self._load_meta()
+        self._amounts = None
+        self._totals = None
+
+    def _load_meta(self) -> dict:
+        meta = {'watermarks': {}, 'generation': 0, 'delta_start': 0, 'delta_end': 0}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding='utf-8') as f:
+                meta.update(json.load(f))
+        return meta
+
+    def _base_path(self, name: str, generation: int = None) -> str:
+        generation = self.meta['generation'] if generation is None else generation
+        # Поколение 0 - имена файлов до появления дельт
+        suffix = f'-{generation:06d}' if generation else ''
+        return os.path.join(self.base_dir, f'daily_{name}{suffix}.parquet')
+
+    def _delta_path(self, name: str, number: int) -> str:
+        return os.path.join(self.deltas_dir, f'{name}-{number:08d}.parquet')
+
+    @property
+    def amounts_path(self) -> str:
+        return self._base_path('amounts')
+
+    @property
+    def totals_path(self) -> str:
+        return self._base_path('totals')
+
+    @property
+    def n_deltas(self) -> int:
+        return self.meta['delta_end'] - self.meta['delta_start']
+
+    def watermark(self, bot: str):
+        value = self.meta['watermarks'].get(bot)
+        return pd.Timestamp(value) if value is not None else None
+
+    def _read(self, name: str, empty: dict, keys: list) -> pd.DataFrame:
+        """База плюс зафиксированные дельты"""
+        path = self._base_path(name)
+        base = pd.read_parquet(path) if os.path.exists(path) else pd.DataFrame(
+            {column: pd.Series(dtype=dtype) for column, dtype in empty.items()})
+        deltas = [pd.read_parquet(self._delta_path(name, number))
+                  for number in range(self.meta['delta_start'], self.meta['delta_end'])]
+        if not deltas:
+            return base
+        new = pd.concat(deltas, ignore_index=True).groupby(keys, as_index=False).sum()
+        return self._merge(base, new, keys)
+
+    @property
+    def amounts(self) -> pd.DataFrame:
+        if self._amounts is None:
+            self._amounts = self._read('amounts', {'day': 'datetime64[ns]', 'bot': 'object',
+                                                   'amount': 'float64', 'count': 'int64'},
+                                       ['day', 'bot', 'amount'])
+        return self._amounts
+
+    @property
+    def totals(self) -> pd.DataFrame:
+        if self._totals is None:
+            self._totals = self._read('totals', {'day': 'datetime64[ns]', 'bot': 'object',
+                                                 'count': 'int64', 'btc_sum': 'float64'},
+                                      ['day', 'bot'])
+        return self._totals
+
+    def update(self, bot: str, new_df: pd.DataFrame) -> int:
+        """
+        Добавляет в представления транзакции бота новее его водяного знака.
+        Агрегируются и записываются только новые строки - стоимость не зависит от объема истории
+        (кроме сворачивания дельт раз в max_deltas обновлений). Возвращает количество учтенных транзакций.
+        """
+        if new_df.empty:
+            return 0
+        dates = pd.to_datetime(new_df['date'], utc=True).dt.tz_localize(None).astype('datetime64[ns]')
+        watermark = self.watermark(bot)
+        mask = (dates > watermark).to_numpy() if watermark is not None else np.ones(len(new_df), dtype=bool)
+        if not mask.any():
+            return 0
+
+        new_rows = pd.DataFrame({
+            'day': dates[mask].dt.normalize().to_numpy(),
+            'bot': bot,
+            'amount': new_df['btc'].to_numpy(dtype='float64')[mask]
+        })
+        new_amounts = new_rows.groupby(['day', 'bot', 'amount'], as_index=False).size().rename(columns={'size': 'count'})
+        new_totals = new_rows.groupby(['day', 'bot'], as_index=False).agg(count=('amount', 'size'), btc_sum=('amount', 'sum'))
+
+        # Загруженные в память представления обновляются на месте, незагруженные прочитают дельту
+        if self._amounts is not None:
+            self._amounts = self._merge(self._amounts, new_amounts, ['day', 'bot', 'amount'])
+        if self._totals is not None:
+            self._totals = self._merge(self._totals, new_totals, ['day', 'bot'])
+
+        # Файлы с номером >= delta_end не зафиксированы, пока не сохранены метаданные
+        os.makedirs(self.deltas_dir, exist_ok=True)
+        number = self.meta['delta_end']
+        new_amounts.to_parquet(self._delta_path('amounts', number), index=False)
+        new_totals.to_parquet(self._delta_path('totals', number), index=False)
+        self.meta['delta_end'] = number + 1
+        self.meta['watermarks'][bot] = dates[mask].max().strftime('%Y-%m-%d %H:%M:%S')
+        self._save_meta()
+
+        if self.n_deltas >= self.max_deltas:
+            self.compact()
+        return int(mask.sum())
+
+    @staticmethod
+    def _merge(existing: pd.DataFrame, new: pd.DataFrame, keys: list) -> pd.DataFrame:
+        """
+        Складывает новые агрегаты с существующими, пересчитывая только хвост с первого нового дня.
+        Представления отсортированы по дню, а новые строки всегда новее водяного знака,
+        поэтому хвост - это последние дни, а не вся история.
+        """
+        split = int(existing['day'].searchsorted(new['day'].min()))
+        combined = pd.concat([existing.iloc[split:], new], ignore_index=True).groupby(keys, as_index=False).sum()
+        return pd.concat([existing.iloc[:split], combined], ignore_index=True)
+
+    def compact(self):
+        """
+        Сворачивает дельты в базовые файлы нового поколения. Переключение на новое поколение -
+        одно атомарное сохранение метаданных; старые файлы удаляются после него.
+        """
+        if self.n_deltas == 0:
+            return
+        amounts, totals = self.amounts, self.totals
+        old_generation, old_deltas = self.meta['generation'], range(self.meta['delta_start'], self.meta['delta_end'])
+        generation = old_generation + 1
+        os.makedirs(self.base_dir, exist_ok=True)
+        for frame, name in ((amounts, 'amounts'), (totals, 'totals')):
+            tmp_path = self._base_path(name, generation) + '.tmp'
+            frame.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self._base_path(name, generation))
+
+        self.meta['generation'] = generation
+        self.meta['delta_start'] = self.meta['delta_end']
+        self._save_meta()
+
+        for name in ('amounts', 'totals'):
+            stale = [self._base_path(name, old_generation)] + [self._delta_path(name, number) for number in old_deltas]
+            for path in stale:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _save_meta(self):
+        os.makedirs(self.base_dir, exist_ok=True)
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def _select(self, frame: pd.DataFrame, bots=None) -> pd.DataFrame:
+        """Строки выбранных ботов; объединенная транзакция выбирается, если в ней есть хотя бы один из них"""
+        if bots is None:
+            return frame
+        bots = set(bots)
+        names = [name for name in frame['bot'].unique() if bots & set(name.split(','))]
+        return frame[frame['bot'].isin(names)]
+
+    def amount_frequency(self, bots=None) -> pd.DataFrame:
+        """Частота каждой суммы за всю историю (аналог value_counts('btc'))"""
+        frequency = self._select(self.amounts, bots).groupby('amount')['count'].sum()
+        return frequency.sort_values(ascending=False, kind='stable').rename_axis('btc').reset_index(name='frequency')
+
+    def daily_totals(self, bots=None) -> pd.DataFrame:
+        """Количество транзакций и сумма BTC по дням (по выбранным ботам вместе)"""
+        return self._select(self.totals, bots).groupby('day', as_index=False)[['count', 'btc_sum']].sum()
+
+    def bot_breakdown(self) -> pd.DataFrame:
+        """Количество транзакций по дням в разрезе ботов: строки - дни, колонки - боты"""
+        return self.totals.pivot_table(index='day', columns='bot', values='count', aggfunc='sum', fill_value=0)
+
+    def daily_transactions(self, bots=None):
+        """Транзакции, развернутые из гистограмм: массивы (день, сумма), упорядоченные по дню"""
+        amounts = self._select(self.amounts, bots)
+        counts = amounts['count'].to_numpy()
+        return np.repeat(amounts['day'].to_numpy(), counts), np.repeat(amounts['amount'].to_numpy(), counts)
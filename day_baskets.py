@@ -0,0 +1,108 @@
+from itertools import chain
+
+import numpy as np
+
+
+class DayBaskets:
+    """
+    Корзины транзакций по дням без Python-списков: один плоский массив сумм (float64)
+    и смещения дней (int64, длина n_days + 1) - суммы дня i лежат в amounts[offsets[i]:offsets[i + 1]].
+    Срезы и выборки дней возвращают новые DayBaskets, корзина одного дня - представление массива без копии.
+    """
+
+    __slots__ = ('amounts', 'offsets')
+
+    def __init__(self, amounts, offsets):
+        self.amounts = np.asarray(amounts, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if len(self.offsets) == 0 or self.offsets[0] != 0 or self.offsets[-1] != len(self.amounts):
+            raise ValueError("Смещения дней не соответствуют массиву сумм")
+
+    @classmethod
+    def from_lists(cls, baskets):
+        """Из списка дневных списков сумм (старое представление колонки transactions)"""
+        lengths = np.fromiter((len(basket) for basket in baskets), dtype=np.int64, count=len(baskets))
+        offsets = np.zeros(len(baskets) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        amounts = np.fromiter(chain.from_iterable(baskets), dtype=np.float64, count=int(offsets[-1]))
+        return cls(amounts, offsets)
+
+    @classmethod
+    def from_transactions(cls, transaction_days, amounts, days):
+        """
+        Собирает корзины для дней days из транзакций (день транзакции, сумма).
+        Порядок сумм внутри дня - порядок транзакций во входных массивах;
+        дни без транзакций получают пустую корзину, повторяющиеся дни - одну и ту же корзину.
+        """
+        transaction_days = np.asarray(transaction_days)
+        order = np.argsort(transaction_days, kind='stable')
+        sorted_days = transaction_days[order]
+        unique_days, starts = np.unique(sorted_days, return_index=True)
+        day_offsets = np.append(starts, len(sorted_days)).astype(np.int64)
+
+        days = np.asarray(days, dtype=unique_days.dtype)
+        positions = np.searchsorted(unique_days, days)
+        found = positions < len(unique_days)
+        found[found] = unique_days[positions[found]] == days[found]
+        positions = np.where(found, positions, 0)
+        day_starts = np.where(found, day_offsets[positions], 0)
+        lengths = np.where(found, day_offsets[positions + 1] - day_offsets[positions], 0)
+        return cls._gather(np.asarray(amounts, dtype=np.float64)[order], day_starts, lengths)
+
+    @classmethod
+    def _gather(cls, amounts, starts, lengths):
+        """Новые корзины из отрезков amounts[starts[i]:starts[i] + lengths[i]]"""
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        index = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return cls(amounts[index], offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            day = range(len(self))[key]
+            return self.amounts[self.offsets[day]:self.offsets[day + 1]]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                offsets = self.offsets[start:max(start, stop) + 1]
+                return DayBaskets(self.amounts[offsets[0]:offsets[-1]], offsets - offsets[0])
+            key = np.arange(start, stop, step)
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        return self._gather(self.amounts, self.offsets[:-1][key], self.lengths()[key])
+
+    def lengths(self) -> np.ndarray:
+        """Количество транзакций за каждый день"""
+        return np.diff(self.offsets)
+
+    def day_index(self) -> np.ndarray:
+        """Номер дня для каждой суммы плоского массива"""
+        return np.repeat(np.arange(len(self)), self.lengths())
+
+    def counts(self, amount) -> np.ndarray:
+        """Сколько раз сумма встретилась за каждый день"""
+        return np.bincount(self.day_index()[self.amounts == amount], minlength=len(self))
+
+    def contains(self, amount) -> np.ndarray:
+        """Маска дней, в которые встретилась сумма"""
+        return self.counts(amount) > 0
+
+    def first_nonempty(self) -> int:
+        """Номер первого дня с транзакциями (len(self), если все корзины пустые)"""
+        nonempty = np.flatnonzero(self.lengths())
+        return int(nonempty[0]) if len(nonempty) else len(self)
+
+    def tolist(self) -> list:
+        """Обратно в список дневных списков (для совместимости со старым кодом)"""
+        return [basket.tolist() for basket in np.split(self.amounts, self.offsets[1:-1])]
+
+    @property
+    def nbytes(self) -> int:
+        return self.amounts.nbytes + self.offsets.nbytes
+
+    def __repr__(self):
+        return f"DayBaskets(days={len(self)}, transactions={len(self.amounts)})"
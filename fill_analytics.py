@@ -0,0 +1,272 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, stage
+
+FILLS_FILE = 'binance.csv'
+
+FILL_COLUMNS = {
+    'symbol': 'string',
+    'side': 'string',
+    'time_in_force': 'string',
+    'original_quantity': 'float64',
+    'price': 'float64',
+    'average_price': 'float64',
+    'order_status': 'string',
+    'order_filled_accumulated_quantity': 'float64',
+    'order_trade_time': 'int64'
+}
+
+# Итоговые статусы ордера: в них order_filled_accumulated_quantity - весь исполненный объем.
+# Промежуточные PARTIALLY_FILLED пропускаем, иначе объем посчитается дважды
+TERMINAL_STATUSES = ['FILLED', 'CANCELED', 'EXPIRED', 'EXPIRED_IN_MATCH']
+
+# Комиссия тейкера Binance по умолчанию, доля от объема сделки
+DEFAULT_FEE_RATE = 0.001
+CHUNK_SIZE = 1_000_000
+
+# Объемы переводим в целые единицы 1e-8 (точность Binance), чтобы позиция считалась без ошибки округления
+QTY_SCALE = 10 ** 8
+# Порог масштаба внутри участка позиции (e^600), после которого участок делится пополам
+MAX_LOG_SCALE = 600.0
+
+
+def new_symbol_state() -> dict:
+    """Состояние символа, переносимое между порциями файла"""
+    return {
+        'position': 0, 'cost': 0.0, 'realized_pnl': 0.0, 'fees': 0.0,
+        'orders': 0, 'fills': 0, 'buy_notional': 0.0, 'sell_notional': 0.0,
+        'slippage_notional': 0.0, 'ioc_original': 0.0, 'ioc_filled': 0.0,
+        'first_time': None, 'last_time': None
+    }
+
+
+def position_scan(qty: np.ndarray, prices: np.ndarray, position: int = 0, cost: float = 0.0):
+    """
+    Позиция и средняя цена входа (метод средней стоимости) по последовательности сделок без цикла.
+    qty - знаковый объем в единицах 1e-8 (покупка > 0), position/cost - позиция и стоимость
+    открытой позиции (по модулю) до первой сделки.
+
+    Стоимость позиции подчиняется линейной рекурсии C_i = m_i * C_{i-1} + a_i:
+    добавление к позиции - m = 1, a = объем * цена; частичное закрытие - m = |P_i| / |P_{i-1}|, a = 0;
+    полное закрытие или переворот начинает новый участок с C = остаток * цена.
+    Внутри участка C_i = M_i * (C_start + sum(a_j / M_j)), где M - накопленное произведение m;
+    суммы по участкам считаются groupby-cumsum без вычитания между участками.
+
+    Возвращает позиции после сделок, стоимость позиции до и после каждой сделки,
+    закрытый объем (в единицах 1e-8) и знак позиции до сделки.
+    """
+    n = len(qty)
+    if n == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, np.zeros(0), np.zeros(0), empty, empty
+    positions = position + np.cumsum(qty)
+    previous = np.empty(n, dtype=np.int64)
+    previous[0] = position
+    previous[1:] = positions[:-1]
+
+    abs_qty, abs_previous = np.abs(qty), np.abs(previous)
+    adding = (previous == 0) | (np.sign(qty) == np.sign(previous))
+    closed = np.where(adding, 0, np.minimum(abs_qty, abs_previous))
+    opened = abs_qty - closed
+    # Новый участок: позиция была пустой или закрыта этой сделкой полностью
+    reset = (previous == 0) | (~adding & (abs_qty >= abs_previous))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_m = np.where(reset | adding, 0.0, np.log(np.abs(positions) / np.where(abs_previous == 0, 1, abs_previous)))
+    segments = np.cumsum(reset)
+    log_scale = pd.Series(log_m).groupby(segments).cumsum().to_numpy()
+    if log_scale.min(initial=0.0) < -MAX_LOG_SCALE and n > 1:
+        # Слишком долгое уменьшение позиции без закрытия - делим последовательность, перенося состояние
+        half = n // 2
+        first = position_scan(qty[:half], prices[:half], position, cost)
+        second = position_scan(qty[half:], prices[half:], int(first[0][-1]), float(first[2][-1]))
+        return tuple(np.concatenate([a, b]) for a, b in zip(first, second))
+
+    opened_value = opened / QTY_SCALE * prices
+    terms = np.where(reset, opened_value, np.where(adding, opened_value, 0.0) * np.exp(-log_scale))
+    if segments[0] == 0:
+        terms[0] += cost
+    running = pd.Series(terms).groupby(segments).cumsum().to_numpy()
+    cost_after = np.exp(log_scale) * running
+    cost_after[positions == 0] = 0.0
+
+    cost_before = np.empty(n)
+    cost_before[0] = cost
+    cost_before[1:] = cost_after[:-1]
+    return positions, cost_before, cost_after, closed, np.sign(previous)
+
+
+def analyze_symbol_chunk(symbol: str, fills: dict, state: dict, fee_rate: float = DEFAULT_FEE_RATE):
+    """
+    Обрабатывает порцию ордеров одного символа (в порядке времени) и обновляет его состояние.
+    Возвращает (состояние, таблица показателей по каждому ордеру).
+    """
+    side_sign = np.where(fills['side'] == 'BUY', 1, -1)
+    filled = fills['order_filled_accumulated_quantity']
+    prices = fills['average_price']
+    qty = side_sign * np.rint(filled * QTY_SCALE).astype(np.int64)
+
+    executed = qty != 0
+    positions, cost_before, cost_after, closed, previous_sign = position_scan(
+        qty[executed], prices[executed], state['position'], state['cost']
+    )
+
+    # Реализованный результат закрытой части по средней цене входа до сделки
+    previous_position = np.abs(positions - qty[executed])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        entry_before = np.where(previous_position > 0, cost_before / previous_position * QTY_SCALE, np.nan)
+        entry_after = np.where(positions != 0, cost_after / np.abs(positions) * QTY_SCALE, np.nan)
+    realized = np.where(closed > 0, closed / QTY_SCALE * (prices[executed] - np.nan_to_num(entry_before)) * previous_sign, 0.0)
+
+    notional = filled * prices
+    fees = notional * fee_rate
+    # Проскальзывание относительно лимитной цены: > 0 - исполнено хуже лимита
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slippage_bps = side_sign * (prices - fills['price']) / fills['price'] * 1e4
+        fill_ratio = np.where(fills['original_quantity'] > 0, filled / fills['original_quantity'], np.nan)
+    is_ioc = fills['time_in_force'] == 'IOC'
+
+    result = pd.DataFrame({
+        'symbol': symbol,
+        'order_trade_time': fills['order_trade_time'],
+        'side': fills['side'],
+        'filled_quantity': filled,
+        'average_price': prices,
+        'notional': notional,
+        'fee': fees,
+        'slippage_bps': np.where(executed, slippage_bps, np.nan),
+        'cost_bps': np.where(executed, slippage_bps + fee_rate * 1e4, np.nan),
+        'fill_ratio': fill_ratio,
+        'position': np.nan, 'entry_vwap': np.nan, 'realized_pnl': 0.0
+    })
+    result.loc[executed, 'position'] = positions / QTY_SCALE
+    result.loc[executed, 'entry_vwap'] = entry_after
+    result.loc[executed, 'realized_pnl'] = realized
+
+    if executed.any():
+        state['position'] = int(positions[-1])
+        state['cost'] = float(cost_after[-1])
+    state['realized_pnl'] += float(realized.sum())
+    state['fees'] += float(fees.sum())
+    state['orders'] += len(qty)
+    state['fills'] += int(executed.sum())
+    state['buy_notional'] += float(notional[side_sign > 0].sum())
+    state['sell_notional'] += float(notional[side_sign < 0].sum())
+    state['slippage_notional'] += float(np.nansum(np.where(executed, slippage_bps, 0.0) * notional))
+    state['ioc_original'] += float(fills['original_quantity'][is_ioc].sum())
+    state['ioc_filled'] += float(filled[is_ioc].sum())
+    times = fills['order_trade_time']
+    state['first_time'] = int(times[0]) if state['first_time'] is None else state['first_time']
+    state['last_time'] = int(times[-1])
+    return state, result
+
+
+def _analyze_task(task):
+    return analyze_symbol_chunk(*task)
+
+
+def read_fill_chunks(filename: str = FILLS_FILE, chunk_size: int = CHUNK_SIZE):
+    """Читает выгрузку ордеров порциями: только итоговые статусы, порядок по символу и времени"""
+    for chunk in pd.read_csv(filename, usecols=list(FILL_COLUMNS), dtype=FILL_COLUMNS, chunksize=chunk_size):
+        chunk = chunk[chunk['order_status'].isin(TERMINAL_STATUSES)]
+        yield chunk.sort_values(['symbol', 'order_trade_time'], kind='stable')
+
+
+def split_by_symbol(chunk: pd.DataFrame) -> dict:
+    """Режет отсортированную порцию на столбцы numpy по символам (без копии DataFrame на символ)"""
+    if chunk.empty:
+        return {}
+    symbols = chunk['symbol'].to_numpy(dtype=object)
+    columns = {name: chunk[name].to_numpy(dtype=object if dtype == 'string' else dtype)
+               for name, dtype in FILL_COLUMNS.items() if name not in ('symbol', 'order_status')}
+    bounds = np.flatnonzero(symbols[1:] != symbols[:-1]) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(symbols)]])
+    return {symbols[start]: {name: column[start:end] for name, column in columns.items()}
+            for start, end in zip(starts, ends)}
+
+
+@stage('fill_analytics')
+def analyze_fills(filename: str = FILLS_FILE, fee_rate: float = DEFAULT_FEE_RATE, chunk_size: int = CHUNK_SIZE,
+                  n_jobs: int = None, output_file: str = None) -> pd.DataFrame:
+    """
+    Потоковая аналитика исполнения по выгрузке ордеров Binance: файл читается порциями
+    по chunk_size строк, состояние каждого символа (позиция, стоимость позиции, накопленные суммы)
+    переносится между порциями, поэтому память ограничена размером порции.
+    Символы порции обрабатываются параллельно в пуле процессов (n_jobs, по умолчанию - все ядра).
+    output_file - дописывать показатели по каждому ордеру в CSV.
+    Возвращает сводку по символам.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    states = {}
+    if output_file and os.path.exists(output_file):
+        os.remove(output_file)
+
+    executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else None
+    try:
+        for chunk in read_fill_chunks(filename, chunk_size):
+            groups = split_by_symbol(chunk)
+            count('orders_read', len(chunk))
+            tasks = [(symbol, fills, states.get(symbol) or new_symbol_state(), fee_rate)
+                     for symbol, fills in groups.items()]
+            if executor is not None and len(tasks) > 1:
+                results = list(executor.map(_analyze_task, tasks))
+            else:
+                results = [_analyze_task(task) for task in tasks]
+
+            for (symbol, _, _, _), (state, per_order) in zip(tasks, results):
+                states[symbol] = state
+                if output_file:
+                    per_order.to_csv(output_file, mode='a', header=not os.path.exists(output_file), index=False)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return summarize(states)
+
+
+def summarize(states: dict) -> pd.DataFrame:
+    """Сводка по символам из накопленных состояний"""
+    rows = []
+    for symbol, state in sorted(states.items()):
+        position = state['position'] / QTY_SCALE
+        notional = state['buy_notional'] + state['sell_notional']
+        rows.append({
+            'symbol': symbol,
+            'orders': state['orders'],
+            'fills': state['fills'],
+            'buy_notional': state['buy_notional'],
+            'sell_notional': state['sell_notional'],
+            'position': position,
+            'entry_vwap': state['cost'] / abs(position) if position else np.nan,
+            'realized_pnl': state['realized_pnl'],
+            'fees': state['fees'],
+            'net_pnl': state['realized_pnl'] - state['fees'],
+            # Средневзвешенное по объему сделок проскальзывание и оно же с комиссией
+            'slippage_bps': state['slippage_notional'] / notional if notional else np.nan,
+            'cost_bps': (state['slippage_notional'] + state['fees'] * 1e4) / notional if notional else np.nan,
+            'ioc_fill_ratio': state['ioc_filled'] / state['ioc_original'] if state['ioc_original'] else np.nan,
+            'first_trade': pd.to_datetime(state['first_time'], unit='ms', utc=True),
+            'last_trade': pd.to_datetime(state['last_time'], unit='ms', utc=True)
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Аналитика исполнения ордеров из выгрузки Binance')
+    parser.add_argument('filename', nargs='?', default=FILLS_FILE)
+    parser.add_argument('--fee-rate', type=float, default=DEFAULT_FEE_RATE)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--output', default=None, help='CSV с показателями по каждому ордеру')
+    args = parser.parse_args()
+
+    summary = analyze_fills(args.filename, args.fee_rate, args.chunk_size, args.jobs, args.output)
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(summary)
@@ -0,0 +1,111 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+
+NS_PER_MINUTE = 60 * 10**9
+
+
+def to_ns(timestamp) -> int:
+    """Переводит время в int64 наносекунды (tz-naive UTC)"""
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+    return timestamp.value
+
+
+class DedupeIndex:
+    """
+    Индекс дубликатов транзакций с ключом (минутная корзина, сумма).
+    Дубликат - та же сумма BTC в пределах ±window от уже принятой транзакции.
+    Корзины старше самой новой транзакции минус окно вытесняются,
+    поэтому проверка стоит O(1) независимо от объема загруженной истории.
+    Вытеснение предполагает, что транзакции приходят по времени: более старая считается
+    уже обработанной. Для сообщений не по порядку (заполнение пропуска) нужен индекс
+    с evict=False - чистый поиск по диапазону времени над загруженными строками.
+    """
+
+    def __init__(self, window=pd.Timedelta(minutes=1), evict: bool = True):
+        self.window_ns = pd.Timedelta(window).value
+        self.window_buckets = -(-self.window_ns // NS_PER_MINUTE)
+        self.evict = evict
+        self.buckets = {}
+        self.minutes_heap = []
+        self.newest_minute = None
+
+    def __len__(self):
+        return sum(len(times) for times in self.buckets.values())
+
+    def is_duplicate(self, timestamp_ns: int, amount: float) -> bool:
+        minute = timestamp_ns // NS_PER_MINUTE
+        # Транзакции старше вытесненных корзин уже обработаны ранее
+        if self.evict and self.newest_minute is not None and minute < self.newest_minute - self.window_buckets:
+            return True
+        for bucket in range(minute - self.window_buckets, minute + self.window_buckets + 1):
+            for seen_ns in self.buckets.get((bucket, amount), ()):
+                if abs(seen_ns - timestamp_ns) <= self.window_ns:
+                    return True
+        return False
+
+    def add(self, timestamp_ns: int, amount: float):
+        minute = timestamp_ns // NS_PER_MINUTE
+        key = (minute, amount)
+        if key not in self.buckets:
+            self.buckets[key] = []
+            if self.evict:
+                heapq.heappush(self.minutes_heap, key)
+        self.buckets[key].append(timestamp_ns)
+
+        if self.evict and (self.newest_minute is None or minute > self.newest_minute):
+            self.newest_minute = minute
+            self._evict()
+
+    def check_and_add(self, timestamp_ns: int, amount: float) -> bool:
+        """Добавляет транзакцию, если она не дубликат. Возвращает True для новой транзакции"""
+        if self.is_duplicate(timestamp_ns, amount):
+            return False
+        self.add(timestamp_ns, amount)
+        return True
+
+    def _evict(self):
+        # Корзины, которые уже не могут попасть в окно новых транзакций
+        threshold = self.newest_minute - self.window_buckets
+        while self.minutes_heap and self.minutes_heap[0][0] < threshold:
+            self.buckets.pop(heapq.heappop(self.minutes_heap), None)
+
+    def load(self, df: pd.DataFrame):
+        """Прогревает индекс хвостом уже сохраненной истории (колонки date, btc)"""
+        dates = pd.to_datetime(df['date']).to_numpy(dtype='datetime64[ns]').view('int64')
+        for timestamp_ns, amount in zip(dates.tolist(), df['btc'].astype(float).tolist()):
+            self.add(timestamp_ns, amount)
+
+
+class ColumnBuffer:
+    """Растущий колоночный буфер транзакций (date в int64 нс, btc в float64) с амортизированным O(1) append"""
+
+    def __init__(self, capacity: int = 1024):
+        self.dates = np.empty(capacity, dtype=np.int64)
+        self.btc = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp_ns: int, amount: float):
+        if self.size == len(self.dates):
+            self._grow()
+        self.dates[self.size] = timestamp_ns
+        self.btc[self.size] = amount
+        self.size += 1
+
+    def _grow(self):
+        capacity = max(2 * len(self.dates), 1)
+        self.dates = np.resize(self.dates, capacity)
+        self.btc = np.resize(self.btc, capacity)
+
+    def to_frame(self, start: int = 0) -> pd.DataFrame:
+        """Возвращает строки буфера начиная с позиции start"""
+        return pd.DataFrame({
+            'date': self.dates[start:self.size].astype('datetime64[ns]'),
+            'btc': self.btc[start:self.size].copy()
+        })
@@ -0,0 +1,281 @@
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import resource
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from functools import wraps
+
+# Включение через окружение: PIPELINE_METRICS - путь к журналу .jsonl,
+# PIPELINE_PROFILE - каталог для профилей cProfile (по файлу .prof на стадию)
+METRICS_ENV = 'PIPELINE_METRICS'
+PROFILE_ENV = 'PIPELINE_PROFILE'
+
+# Период опроса RSS во время стадии, секунды
+MEMORY_SAMPLE_INTERVAL = 0.05
+
+_enabled = False
+_log_path = None
+_profile_dir = None
+_profiling = False
+_lock = threading.Lock()
+# Поток, в котором снимается профиль стадии, номер профилируемой стадии
+# и профили других потоков за эту стадию (вызовы timed из asyncio.to_thread и пулов потоков)
+_profile_thread = None
+_profile_generation = 0
+_thread_profiles = []
+_thread_local = threading.local()
+_counters = defaultdict(int)
+# Таймеры функций: имя -> [число вызовов, суммарное время]
+_timers = defaultdict(lambda: [0, 0.0])
+
+
+def configure(log_path: str = None, profile_dir: str = None):
+    """
+    Включает инструментирование с записью в log_path (JSON lines); без log_path - выключает.
+    profile_dir - дополнительно снимать профиль cProfile каждой стадии.
+    """
+    global _enabled, _log_path, _profile_dir
+    _log_path = log_path or None
+    _profile_dir = profile_dir or None
+    _enabled = _log_path is not None
+    if _enabled and os.path.dirname(_log_path):
+        os.makedirs(os.path.dirname(_log_path), exist_ok=True)
+    if _profile_dir:
+        os.makedirs(_profile_dir, exist_ok=True)
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def count(name: str, value: int = 1):
+    """Увеличивает счетчик (сообщения прочитаны, разобраны, отсеяны, записаны и т.д.)"""
+    if _enabled:
+        with _lock:
+            _counters[name] += int(value)
+
+
+def _add_time(name: str, seconds: float):
+    with _lock:
+        timer = _timers[name]
+        timer[0] += 1
+        timer[1] += seconds
+
+
+def _thread_profiler() -> dict:
+    """Профиль текущего потока для профилируемой стадии (создается при первом вызове в потоке)"""
+    state = getattr(_thread_local, 'profile', None)
+    if state is None or state['generation'] != _profile_generation:
+        state = {'generation': _profile_generation, 'profiler': cProfile.Profile(), 'running': False}
+        _thread_local.profile = state
+        with _lock:
+            _thread_profiles.append(state)
+    return state
+
+
+def _call_profiled(func, args, kwargs):
+    """
+    Вызов из другого потока во время профилирования стадии: cProfile видит только поток,
+    в котором включен, поэтому такие вызовы снимаются профилем своего потока
+    и добавляются в профиль стадии при ее завершении
+    """
+    state = _thread_profiler()
+    if state['running']:
+        return func(*args, **kwargs)
+    try:
+        state['profiler'].enable()
+    except ValueError:
+        # Интерпретатор допускает только один активный профилировщик - вызываем без профиля
+        return func(*args, **kwargs)
+    state['running'] = True
+    try:
+        return func(*args, **kwargs)
+    finally:
+        state['profiler'].disable()
+        state['running'] = False
+
+
+def timed(name: str = None):
+    """
+    Декоратор таймера функции (обычной или async). Выключенный - одна проверка флага на вызов.
+    Обычная функция, вызванная в другом потоке во время профилирования стадии, попадает в ее профиль.
+    """
+    def decorator(func):
+        label = name or f'{func.__module__}.{func.__qualname__}'
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _add_time(label, time.perf_counter() - start)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                if _profiling and threading.get_ident() != _profile_thread:
+                    return _call_profiled(func, args, kwargs)
+                return func(*args, **kwargs)
+            finally:
+                _add_time(label, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса; без /proc - пиковый RSS из getrusage"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # ru_maxrss в Linux - в килобайтах
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _MemorySampler(threading.Thread):
+    """Фоновый поток, запоминающий максимальный RSS за время стадии"""
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, rss_bytes())
+        return self.peak
+
+
+def _snapshot():
+    with _lock:
+        return dict(_counters), {name: tuple(timer) for name, timer in _timers.items()}
+
+
+def log_event(event: str, **fields):
+    """Пишет произвольную запись в журнал (если инструментирование включено)"""
+    if not _enabled:
+        return
+    record = {'event': event, 'time': datetime.now().isoformat(timespec='milliseconds'), 'pid': os.getpid(), **fields}
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _lock:
+        with open(_log_path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+class stage:
+    """
+    Стадия конвейера: время, пиковый RSS, приращения счетчиков и таймеров функций за стадию
+    пишутся одной записью журнала. Контекстный менеджер или декоратор (в том числе async-функций).
+    В режиме профилирования стадия снимается cProfile в <PIPELINE_PROFILE>/<name>.prof
+    (вложенные стадии попадают в профиль внешней). Вызовы функций с timed из других потоков
+    (asyncio.to_thread, пулы потоков) снимаются профилями этих потоков и добавляются в профиль стадии.
+    Работа дочерних процессов (ProcessPoolExecutor) в профиль не попадает - в нем видно только
+    ожидание результатов; это отмечается в записи журнала.
+    """
+
+    def __init__(self, name: str, **fields):
+        self.name = name
+        self.fields = fields
+        self._active = False
+
+    def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(self.name, **self.fields):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(self.name, **self.fields):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        global _profiling, _profile_thread, _profile_generation
+        self._active = _enabled
+        if not self._active:
+            return self
+
+        self._counters_before, self._timers_before = _snapshot()
+        self._rss_start = rss_bytes()
+        self._sampler = _MemorySampler()
+        self._sampler.start()
+        self._profiler = None
+        if _profile_dir and not _profiling:
+            self._profiler = cProfile.Profile()
+            with _lock:
+                _thread_profiles.clear()
+                _profile_generation += 1
+            _profile_thread = threading.get_ident()
+            _profiling = True
+            self._profiler.enable()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _profiling
+        if not self._active:
+            return False
+
+        seconds = time.perf_counter() - self._start
+        profile = None
+        if self._profiler is not None:
+            self._profiler.disable()
+            _profiling = False
+            profile = self._dump_profile()
+        peak = self._sampler.stop()
+
+        counters_after, timers_after = _snapshot()
+        counters = {key: value - self._counters_before.get(key, 0) for key, value in counters_after.items()
+                    if value != self._counters_before.get(key, 0)}
+        functions = {}
+        for key, (calls, total) in timers_after.items():
+            calls_before, total_before = self._timers_before.get(key, (0, 0.0))
+            if calls != calls_before:
+                functions[key] = {'calls': calls - calls_before, 'seconds': round(total - total_before, 6)}
+
+        log_event('stage', stage=self.name, status='ok' if exc_type is None else 'error',
+                  seconds=round(seconds, 6), rss_start_mb=round(self._rss_start / 2 ** 20, 1),
+                  peak_rss_mb=round(peak / 2 ** 20, 1), counters=counters, functions=functions,
+                  **({'profile': profile} if profile else {}), **self.fields)
+        return False
+
+    def _dump_profile(self) -> dict:
+        """Пишет профиль стадии вместе с профилями других потоков, возвращает описание для журнала"""
+        stats = pstats.Stats(self._profiler)
+        with _lock:
+            # Поток, еще выполняющий вызов, пропускаем: его профилировщик нельзя остановить отсюда
+            finished = [state['profiler'] for state in _thread_profiles if not state['running']]
+            _thread_profiles.clear()
+        for profiler in finished:
+            profiler.create_stats()
+            if profiler.stats:
+                stats.add(profiler)
+        path = os.path.join(_profile_dir, f'{self.name}.prof')
+        stats.dump_stats(path)
+        return {'file': path, 'threads': 1 + len(finished),
+                'note': 'работа дочерних процессов (ProcessPoolExecutor) в профиль не входит'}
+
+
+configure(os.environ.get(METRICS_ENV), os.environ.get(PROFILE_ENV))
@@ -0,0 +1,112 @@
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation import timed
+
+
+class _FPNode:
+    __slots__ = ('item', 'count', 'parent', 'children')
+
+    def __init__(self, item, parent):
+        self.item = item
+        self.count = 0
+        self.parent = parent
+        self.children = {}
+
+
+def _build_tree(transactions, min_support):
+    """Строит FP-дерево по транзакциям [(items, count)], оставляя только частые элементы"""
+    support = Counter()
+    for items, count in transactions:
+        for item in items:
+            support[item] += count
+    frequent = {item: s for item, s in support.items() if s >= min_support}
+
+    # Порядок элементов в ветке: по убыванию поддержки, затем по значению
+    rank = {item: i for i, item in enumerate(sorted(frequent, key=lambda item: (-frequent[item], item)))}
+    root = _FPNode(None, None)
+    header = defaultdict(list)
+    for items, count in transactions:
+        node = root
+        for item in sorted((item for item in items if item in rank), key=rank.__getitem__):
+            child = node.children.get(item)
+            if child is None:
+                child = _FPNode(item, node)
+                node.children[item] = child
+                header[item].append(child)
+            child.count += count
+            node = child
+    return header, frequent
+
+
+def _conditional_base(header, item):
+    """Условная база шаблонов элемента: пути от корня до его узлов с их счетчиками"""
+    base = []
+    for node in header[item]:
+        path = []
+        parent = node.parent
+        while parent.item is not None:
+            path.append(parent.item)
+            parent = parent.parent
+        if path:
+            base.append((path, node.count))
+    return base
+
+
+def _mine(transactions, min_support, suffix, max_len, out):
+    header, frequent = _build_tree(transactions, min_support)
+    # Начинаем с наименее частых элементов - их условные базы меньше
+    for item in sorted(frequent, key=lambda item: (frequent[item], item)):
+        itemset = suffix + (item,)
+        out.append((tuple(sorted(itemset)), frequent[item]))
+        if max_len is not None and len(itemset) >= max_len:
+            continue
+        base = _conditional_base(header, item)
+        if base:
+            _mine(base, min_support, itemset, max_len, out)
+    return out
+
+
+def _mine_suffix(base, min_support, suffix, max_len):
+    """Задача для процесса: все частые наборы, заканчивающиеся на suffix"""
+    return _mine(base, min_support, suffix, max_len, [])
+
+
+@timed()
+def mine_frequent_itemsets(baskets, min_support: int = 5, max_len=None, n_jobs=None) -> list:
+    """
+    Поиск частых наборов сумм (FP-growth) по дневным корзинам транзакций.
+    Корзина - набор сумм за день (повторы внутри дня учитываются один раз),
+    поддержка - число дней, в которые встретился весь набор.
+    Стоимость зависит от количества частых наборов, а не от C(n, k).
+    Условные базы элементов первого уровня обрабатываются параллельно на n_jobs процессах
+    (None - все ядра, 1 - без пула процессов).
+    Возвращает список (набор, поддержка), отсортированный по длине набора и убыванию поддержки.
+    """
+    # Одинаковые корзины сливаем в одну транзакцию со счетчиком
+    transactions = list(Counter(frozenset(basket) for basket in baskets if len(basket)).items())
+    header, frequent = _build_tree(transactions, min_support)
+
+    itemsets = [((item,), support) for item, support in frequent.items()]
+    tasks = []
+    if max_len is None or max_len > 1:
+        for item in frequent:
+            base = _conditional_base(header, item)
+            if base:
+                tasks.append((base, (item,)))
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1 or len(tasks) < 2:
+        for base, suffix in tasks:
+            _mine(base, min_support, suffix, max_len, itemsets)
+    else:
+        # Крупные условные базы отправляем первыми, чтобы процессы догружались мелкими
+        tasks.sort(key=lambda task: -sum(len(path) for path, _ in task[0]))
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_mine_suffix, base, min_support, suffix, max_len) for base, suffix in tasks]
+            for future in futures:
+                itemsets.extend(future.result())
+
+    itemsets.sort(key=lambda itemset: (len(itemset[0]), -itemset[1], itemset[0]))
+    return itemsets
@@ -0,0 +1,249 @@
+import gzip
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from daily_views import DailyViews
+from ingest_index import DedupeIndex, to_ns
+from instrumentation import count, stage
+from message_parser import parse_messages
+from paths import ARCHIVE_DIR, REPARSE_DIR
+from transaction_index import TransactionIndex
+from transaction_store import TransactionStore
+
+META_FILE = '_meta.json'
+# Сообщений в одном чанке архива - единица параллельного разбора
+CHUNK_MESSAGES = 50_000
+# Колонки разобранной таблицы, которая пишется рядом с хранилищем при повторном разборе
+PARSED_COLUMNS = ['id', 'date', 'btc', 'asset', 'usd', 'sender', 'receiver', 'tx_type']
+
+
+class MessageArchive:
+    """
+    Архив исходных сообщений канала (id, время, текст) для повторного разбора без Telegram.
+    Сообщения лежат в чанках chunk-NNNNNN.jsonl.gz по CHUNK_MESSAGES штук: каждая дозапись -
+    отдельный gzip-член в конце текущего чанка (склеенные члены читаются как один поток).
+    Зафиксированный размер каждого чанка хранится в метаданных: хвост после него - след
+    прерванной записи, он обрезается при следующей дозаписи и не читается.
+    Сообщения одного id могут встречаться повторно (перезапрос пакета после сбоя,
+    заполнение пропуска) - при разборе остается первое.
+    """
+
+    def __init__(self, channel_name: str, base_dir: str = ARCHIVE_DIR, chunk_messages: int = CHUNK_MESSAGES):
+        self.channel_name = channel_name
+        self.path = os.path.join(base_dir, channel_name)
+        self.meta_path = os.path.join(self.path, META_FILE)
+        self.chunk_messages = chunk_messages
+        self.meta = self._load_meta()
+        # Live-сообщения копятся здесь до flush (его вызывает групповая запись хранилища)
+        self.pending = []
+
+    def _load_meta(self) -> dict:
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding='utf-8') as f:
+                return json.load(f)
+        return {'channel': self.channel_name, 'messages': 0, 'last_message_id': None, 'chunks': []}
+
+    def _save_meta(self):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def __len__(self):
+        return self.meta['messages']
+
+    @property
+    def last_message_id(self):
+        return self.meta['last_message_id']
+
+    def append(self, messages) -> int:
+        """Дописывает сообщения Telegram (id, date, text); сообщения без текста пропускаются"""
+        records = [(message.id, to_ns(message.date), message.text) for message in messages if message.text]
+        return self.append_records(records)
+
+    def append_records(self, records) -> int:
+        """Дописывает записи (id, время в нс UTC, текст) и фиксирует их в метаданных"""
+        if not records:
+            return 0
+        os.makedirs(self.path, exist_ok=True)
+        offset = 0
+        while offset < len(records):
+            chunk = self._open_chunk()
+            # Остаток, не поместившийся в текущий чанк, уходит в следующий
+            part = records[offset:offset + self.chunk_messages - chunk['messages']]
+            payload = ''.join(json.dumps({'id': int(message_id), 'date': int(date_ns), 'text': text},
+                                         ensure_ascii=False) + '\n'
+                              for message_id, date_ns, text in part)
+            chunk_path = os.path.join(self.path, chunk['file'])
+            with open(chunk_path, 'r+b' if os.path.exists(chunk_path) else 'wb') as f:
+                # Отбрасываем незафиксированный хвост прерванной записи
+                f.truncate(chunk['bytes'])
+                f.seek(chunk['bytes'])
+                f.write(gzip.compress(payload.encode()))
+                chunk['bytes'] = f.tell()
+            chunk['messages'] += len(part)
+            offset += len(part)
+
+        self.meta['messages'] += len(records)
+        last_id = max(int(message_id) for message_id, _, _ in records)
+        self.meta['last_message_id'] = max(self.meta['last_message_id'] or 0, last_id)
+        self._save_meta()
+        return len(records)
+
+    def _open_chunk(self) -> dict:
+        """Текущий чанк для дозаписи; заполненный закрывается и начинается новый"""
+        chunks = self.meta['chunks']
+        if not chunks or chunks[-1]['messages'] >= self.chunk_messages:
+            chunks.append({'file': f'chunk-{len(chunks):06d}.jsonl.gz', 'messages': 0, 'bytes': 0})
+        return chunks[-1]
+
+    def add(self, message):
+        """Ставит live-сообщение в очередь на запись (без текста - пропускается)"""
+        if message.text:
+            self.pending.append((message.id, to_ns(message.date), message.text))
+
+    def flush(self) -> int:
+        records, self.pending = self.pending, []
+        return self.append_records(records)
+
+    def chunks(self) -> list:
+        """Зафиксированные чанки: (путь, размер в байтах)"""
+        return [(os.path.join(self.path, chunk['file']), chunk['bytes']) for chunk in self.meta['chunks']
+                if chunk['bytes']]
+
+    def read(self) -> pd.DataFrame:
+        """Все сообщения архива (id, date, text) в порядке записи"""
+        frames = [read_chunk(path, size) for path, size in self.chunks()]
+        if not frames:
+            return _empty_messages()
+        return pd.concat(frames, ignore_index=True)
+
+
+def _empty_messages() -> pd.DataFrame:
+    return pd.DataFrame({'id': pd.Series(dtype='int64'), 'date': pd.Series(dtype='datetime64[ns]'),
+                         'text': pd.Series(dtype='object')})
+
+
+def read_chunk(path: str, size: int) -> pd.DataFrame:
+    """Читает зафиксированные size байт чанка в таблицу (id, date, text)"""
+    with open(path, 'rb') as f:
+        data = f.read(size)
+    lines = gzip.decompress(data).decode().splitlines()
+    if not lines:
+        return _empty_messages()
+    records = [json.loads(line) for line in lines]
+    return pd.DataFrame({
+        'id': np.fromiter((record['id'] for record in records), dtype=np.int64, count=len(records)),
+        'date': np.fromiter((record['date'] for record in records), dtype=np.int64,
+                            count=len(records)).view('datetime64[ns]'),
+        'text': [record['text'] for record in records]
+    })
+
+
+def _reparse_chunk(path: str, size: int, channel_name: str, asset: str) -> tuple:
+    """Задача для процесса: разбирает один чанк, возвращает (число сообщений, найденные транзакции)"""
+    messages = read_chunk(path, size)
+    parsed = parse_messages(messages['text'].tolist(), channel_name, asset)
+    matched = parsed['matched']
+    found = pd.DataFrame({
+        'id': messages['id'].to_numpy()[matched],
+        'date': messages['date'].to_numpy()[matched],
+        'btc': parsed['amount'][matched],
+        'asset': parsed['asset'][matched],
+        'usd': parsed['usd'][matched],
+        'sender': parsed['sender'][matched],
+        'receiver': parsed['receiver'][matched],
+        'tx_type': parsed['tx_type'][matched]
+    })
+    return len(messages), found
+
+
+def dedupe_transactions(found: pd.DataFrame, window=pd.Timedelta(minutes=1)) -> pd.DataFrame:
+    """
+    Повторяет отбор при загрузке: сообщения по возрастанию id, повторы одного id убираются,
+    затем та же сумма в пределах окна считается дубликатом (DedupeIndex, как в 01)
+    """
+    found = found.sort_values('id', kind='stable').drop_duplicates('id').reset_index(drop=True)
+    dedupe_index = DedupeIndex(window)
+    keep = np.fromiter((dedupe_index.check_and_add(date_ns, amount)
+                        for date_ns, amount in zip(found['date'].to_numpy().view(np.int64).tolist(),
+                                                   found['btc'].tolist())),
+                       dtype=bool, count=len(found))
+    return found[keep].reset_index(drop=True)
+
+
+@stage('reparse_archive')
+def reparse_archive(channels, archive_dir: str = ARCHIVE_DIR, output_dir: str = REPARSE_DIR, asset: str = 'BTC',
+                    dedupe_window=pd.Timedelta(minutes=1), n_jobs=None) -> dict:
+    """
+    Пересобирает таблицы транзакций из архива сообщений без обращения к Telegram.
+    Чанки всех каналов разбираются текущими грамматиками message_parser на пуле процессов,
+    затем по каждому каналу отсеиваются дубликаты и заново строятся хранилище, дневные
+    представления, индекс по времени и CSV. output_dir повторяет раскладку DATA_DIR
+    (store/, views/, index/, <канал>_transactions.csv), поэтому может заменить ее целиком;
+    рядом пишется <канал>_parsed.parquet со всеми разобранными полями (usd, sender, receiver, tx_type).
+    Возвращает количество транзакций по каналам.
+    """
+    start = time.perf_counter()
+    archives = {channel_name: MessageArchive(channel_name, archive_dir) for channel_name in channels}
+    # Результат собирается заново - прошлые таблицы в output_dir удаляются
+    for subdir in ('store', 'views', 'index'):
+        shutil.rmtree(os.path.join(output_dir, subdir), ignore_errors=True)
+    os.makedirs(output_dir, exist_ok=True)
+
+    results = {channel_name: [] for channel_name in channels}
+    with ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        futures = [(channel_name, executor.submit(_reparse_chunk, path, size, channel_name, asset))
+                   for channel_name, archive in archives.items() for path, size in archive.chunks()]
+        for channel_name, future in futures:
+            n_messages, found = future.result()
+            count('archive_messages', n_messages)
+            results[channel_name].append(found)
+
+    daily_views = DailyViews(os.path.join(output_dir, 'views'))
+    totals = {}
+    for channel_name, archive in archives.items():
+        if not results[channel_name]:
+            print(f"Архив {channel_name} пуст")
+            totals[channel_name] = 0
+            continue
+        transactions = dedupe_transactions(pd.concat(results[channel_name], ignore_index=True), dedupe_window)
+        count('transactions_reparsed', len(transactions))
+
+        store = TransactionStore(channel_name, os.path.join(output_dir, 'store'))
+        store.append(transactions[['date', 'btc']], last_message_id=archive.last_message_id)
+        daily_views.update(channel_name, transactions[['date', 'btc']])
+        index = TransactionIndex(channel_name, os.path.join(output_dir, 'index'))
+        index.append(transactions[['date', 'btc']])
+        csv_path = store.export_csv(os.path.join(output_dir, f'{channel_name}_transactions.csv'))
+        index.mark_synced(csv_path)
+        transactions[PARSED_COLUMNS].to_parquet(os.path.join(output_dir, f'{channel_name}_parsed.parquet'), index=False)
+
+        totals[channel_name] = len(transactions)
+        print(f"{channel_name}: сообщений в архиве {len(archive)}, транзакций {len(transactions)}")
+
+    daily_views.compact()
+    print(f"Повторный разбор занял {time.perf_counter() - start:.1f} с, результат в {output_dir}")
+    return totals
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Повторный разбор архива сообщений без Telegram')
+    parser.add_argument('channels', nargs='*', help='каналы, по умолчанию все каналы в архиве')
+    parser.add_argument('--archive', default=ARCHIVE_DIR)
+    parser.add_argument('--output', default=REPARSE_DIR)
+    parser.add_argument('--asset', default='BTC')
+    parser.add_argument('--jobs', type=int, default=None)
+    args = parser.parse_args()
+
+    channels = args.channels or sorted(name for name in os.listdir(args.archive)
+                                       if os.path.exists(os.path.join(args.archive, name, META_FILE)))
+    reparse_archive(channels, args.archive, args.output, args.asset, n_jobs=args.jobs)
@@ -0,0 +1,137 @@
+import re
+
+import numpy as np
+
+# Сумма с разделителями тысяч ("1,250.5") или без них, за ней тикер актива
+AMOUNT_GROUP = r'(?P<amount>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)'
+USD_PATTERN = re.compile(r'\(\s*\$?\s*(?P<usd>\d[\d,]*(?:\.\d+)?)\s*(?:USD)?\s*\)')
+FROM_TO_PATTERN = re.compile(
+    r'\bfrom\s+(?P<sender>.+?)\s+to\s+(?P<receiver>.+?)\s*(?:$|\n|\(|Details|https?://)',
+    re.IGNORECASE
+)
+SINGLE_ENTITY_PATTERN = re.compile(r'\b(?:at|from|to)\s+(?P<entity>.+?)\s*(?:$|\n|\(|Details|https?://)', re.IGNORECASE)
+TX_TYPE_PATTERN = re.compile(r'\b(transferred|transfer|minted|burned|burnt|locked|unlocked|frozen)\b', re.IGNORECASE)
+
+TX_TYPES = {
+    'transferred': 'transfer',
+    'transfer': 'transfer',
+    'minted': 'mint',
+    'burned': 'burn',
+    'burnt': 'burn',
+    'locked': 'lock',
+    'unlocked': 'unlock',
+    'frozen': 'freeze'
+}
+
+# Грамматики каналов: whale_alert всегда пишет тикер через '#', whalebot - без него
+GRAMMARS = {
+    'whalebot': {
+        'amount': re.compile(AMOUNT_GROUP + r'\s*#?(?P<asset>[A-Z][A-Z0-9]{1,9})\b')
+    },
+    'whale_alert': {
+        'amount': re.compile(AMOUNT_GROUP + r'\s*#(?P<asset>[A-Z][A-Z0-9]{1,9})\b')
+    }
+}
+DEFAULT_GRAMMAR = GRAMMARS['whalebot']
+
+
+def _to_float(value):
+    return float(value.replace(',', '')) if value else np.nan
+
+
+def _clean_entity(value):
+    return value.strip().lstrip('#').strip() if value else None
+
+
+def parse_message(text, channel_name=None, asset='BTC'):
+    """
+    Разбирает одно сообщение алерта.
+    Возвращает dict с полями amount, asset, usd, sender, receiver, tx_type
+    или None, если в сообщении нет суммы нужного актива (asset=None - любой актив).
+    """
+    # Быстрый отсев сообщений без нужного тикера до запуска регулярных выражений
+    if not text or (asset is not None and asset not in text):
+        return None
+    grammar = GRAMMARS.get(channel_name, DEFAULT_GRAMMAR)
+
+    amount_match = None
+    for match in grammar['amount'].finditer(text):
+        if asset is None or match.group('asset') == asset:
+            amount_match = match
+            break
+    if amount_match is None:
+        return None
+
+    usd_match = USD_PATTERN.search(text, amount_match.end())
+    tx_type_match = TX_TYPE_PATTERN.search(text)
+    tx_type = TX_TYPES[tx_type_match.group(1).lower()] if tx_type_match else 'unknown'
+
+    sender = receiver = None
+    from_to_match = FROM_TO_PATTERN.search(text)
+    if from_to_match:
+        sender = _clean_entity(from_to_match.group('sender'))
+        receiver = _clean_entity(from_to_match.group('receiver'))
+    else:
+        # Mint/burn/lock: одна сторона ("burned at Tether Treasury")
+        entity_match = SINGLE_ENTITY_PATTERN.search(text, amount_match.end())
+        if entity_match:
+            entity = _clean_entity(entity_match.group('entity'))
+            if tx_type == 'mint':
+                receiver = entity
+            else:
+                sender = entity
+
+    return {
+        'amount': _to_float(amount_match.group('amount')),
+        'asset': amount_match.group('asset'),
+        'usd': _to_float(usd_match.group('usd')) if usd_match else np.nan,
+        'sender': sender,
+        'receiver': receiver,
+        'tx_type': tx_type
+    }
+
+
+def parse_messages(texts, channel_name=None, asset='BTC'):
+    """
+    Пакетный разбор списка текстов сообщений.
+    Возвращает колоночные массивы одинаковой длины (по строке на каждый текст):
+    amount/usd - float64 (NaN, если не найдено), asset/sender/receiver/tx_type - object,
+    matched - bool маска сообщений, в которых найдена сумма.
+    """
+    n = len(texts)
+    amount = np.full(n, np.nan)
+    usd = np.full(n, np.nan)
+    assets = np.full(n, None, dtype=object)
+    senders = np.full(n, None, dtype=object)
+    receivers = np.full(n, None, dtype=object)
+    tx_types = np.full(n, None, dtype=object)
+    matched = np.zeros(n, dtype=bool)
+
+    for i, text in enumerate(texts):
+        parsed = parse_message(text, channel_name, asset)
+        if parsed is None:
+            continue
+        matched[i] = True
+        amount[i] = parsed['amount']
+        usd[i] = parsed['usd']
+        assets[i] = parsed['asset']
+        senders[i] = parsed['sender']
+        receivers[i] = parsed['receiver']
+        tx_types[i] = parsed['tx_type']
+
+    return {
+        'matched': matched,
+        'amount': amount,
+        'asset': assets,
+        'usd': usd,
+        'sender': senders,
+        'receiver': receivers,
+        'tx_type': tx_types
+    }
+
+
+def format_transaction(parsed, channel_name):
+    """Строка для вывода в консоль: '500.0 BTC Binance → unknown wallet (whalebot)'"""
+    if parsed['sender'] and parsed['receiver']:
+        return f"{parsed['amount']} {parsed['asset']} {parsed['sender']} → {parsed['receiver']} ({channel_name})"
+    return f"{parsed['amount']} {parsed['asset']} ({channel_name})"
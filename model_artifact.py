@@ -0,0 +1,179 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+# Файл модели: MAGIC, длина заголовка (uint64 LE), JSON-заголовок, затем массивы,
+# выровненные по ALIGNMENT байт, - каждый открывается как представление одного memmap
+MAGIC = b'ALGOMDL\0'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+# Модели артефакта 04 и их смысл: вероятность роста и падения цены
+MODEL_NAMES = ('up_model', 'down_model')
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save_model_artifact(path: str, arrays: dict, meta: dict = None):
+    """Записывает массивы и метаданные в один файл (атомарно, через временный файл)"""
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({'format_version': FORMAT_VERSION, 'meta': meta or {}, 'arrays': layout},
+                        ensure_ascii=False).encode()
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def load_model_artifact(path: str):
+    """
+    Открывает файл модели через memory map: массивы - представления только для чтения
+    без копирования, страницы общие для всех процессов, открывших тот же файл.
+    Возвращает (массивы, метаданные).
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(len(MAGIC) + 8)
+        if prefix[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} - не файл модели (неверная сигнатура)")
+        header_length = struct.unpack('<Q', prefix[len(MAGIC):])[0]
+        header = json.loads(f.read(header_length))
+    if header['format_version'] > FORMAT_VERSION:
+        raise ValueError(f"Версия формата модели {header['format_version']} новее поддерживаемой {FORMAT_VERSION}")
+
+    data_start = _aligned(len(MAGIC) + 8 + header_length)
+    mapped = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        start = data_start + spec['offset']
+        size = int(np.prod(spec['shape'], dtype=np.int64)) * dtype.itemsize
+        arrays[name] = mapped[start:start + size].view(dtype).reshape(spec['shape'])
+    return arrays, header['meta']
+
+
+def split_importances(model):
+    """
+    Важности признаков леса sklearn (то же, что feature_importances_) только для признаков разбиений.
+    feature_importances_ строит плотный массив на все признаки для каждого дерева и усредняет их -
+    при сотнях тысяч признаков-пар это гигабайты; здесь суммируется только уменьшение неоднородности
+    в узлах разбиений. Возвращает (отсортированные номера признаков, важности).
+    """
+    features, decreases, n_trees = [], [], 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        if tree.node_count <= 1:
+            continue
+        n_trees += 1
+        internal = np.flatnonzero(tree.children_left >= 0)
+        left, right = tree.children_left[internal], tree.children_right[internal]
+        weighted = tree.weighted_n_node_samples * tree.impurity
+        decrease = (weighted[internal] - weighted[left] - weighted[right]) / tree.weighted_n_node_samples[0]
+        # Важности каждого дерева нормируются до усреднения, как в sklearn
+        total = decrease.sum()
+        features.append(tree.feature[internal])
+        decreases.append(decrease / total if total > 0 else decrease)
+    if not n_trees:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    used, inverse = np.unique(np.concatenate(features), return_inverse=True)
+    importances = np.bincount(inverse.ravel(), weights=np.concatenate(decreases)) / n_trees
+    total = importances.sum()
+    return used, importances / total if total > 0 else importances
+
+
+def compact_forests(model_data: dict):
+    """
+    Переводит модели 04 (up_model, down_model, transaction_map, itemsets) в плоские массивы:
+    узлы всех деревьев подряд (потомки, признак, порог, вероятность класса 1 в узле)
+    и только признаки, на которых деревья делят выборку (суммы признака - CSR по feature_offsets;
+    одна сумма - счетчик суммы за день, несколько - наличие набора).
+    Лист ссылается сам на себя, признак листа - заглушка n_features, порог - +inf.
+    Возвращает (массивы, метаданные) для save_model_artifact.
+    """
+    for name in MODEL_NAMES:
+        classes = model_data[name].classes_
+        if len(classes) < 2:
+            raise ValueError(f"Модель {name} обучена на одном классе {classes.tolist()} - её оценка постоянна; "
+                             f"лес нужно обучать на днях обоих классов")
+    transaction_map = model_data['transaction_map']
+    itemsets = model_data['itemsets']
+    n_single = len(transaction_map)
+    trees = [(estimator.tree_, model_data[name].classes_)
+             for name in MODEL_NAMES for estimator in model_data[name].estimators_]
+
+    used = np.unique(np.concatenate([tree.feature[tree.feature >= 0] for tree, _ in trees]))
+    n_features = len(used)
+    check_forests({'n_features': n_features})
+    amounts_by_column = {column: amount for amount, column in transaction_map.items()}
+    feature_items = [(amounts_by_column[feature],) if feature < n_single else tuple(itemsets[feature - n_single])
+                     for feature in used.tolist()]
+
+    left, right, features, thresholds, leaf_probs, roots = [], [], [], [], [], []
+    offset = 0
+    for tree, classes in trees:
+        is_leaf = tree.feature < 0
+        nodes = np.arange(tree.node_count) + offset
+        roots.append(offset)
+        left.append(np.where(is_leaf, nodes, tree.children_left + offset))
+        right.append(np.where(is_leaf, nodes, tree.children_right + offset))
+        features.append(np.where(is_leaf, n_features, np.searchsorted(used, np.where(is_leaf, 0, tree.feature))))
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+        values = tree.value[:, 0, :]
+        positive = np.flatnonzero(classes == 1)
+        leaf_probs.append(values[:, positive[0]] / values.sum(axis=1) if len(positive) else np.zeros(tree.node_count))
+        offset += tree.node_count
+
+    arrays = {
+        'left': np.concatenate(left).astype(np.int32),
+        'right': np.concatenate(right).astype(np.int32),
+        'feature': np.concatenate(features).astype(np.int32),
+        'threshold': np.concatenate(thresholds),
+        'leaf_prob': np.concatenate(leaf_probs),
+        'roots': np.asarray(roots, dtype=np.int32),
+        'feature_amounts': np.asarray([amount for items in feature_items for amount in items], dtype=np.float64),
+        'feature_offsets': np.concatenate([[0], np.cumsum([len(items) for items in feature_items])]).astype(np.int64),
+        'importances': np.stack([_importances_of(model_data[name], used) for name in MODEL_NAMES])
+    }
+    tree_counts = np.cumsum([0] + [len(model_data[name].estimators_) for name in MODEL_NAMES]).tolist()
+    meta = {
+        'models': {name: [tree_counts[i], tree_counts[i + 1]] for i, name in enumerate(MODEL_NAMES)},
+        'n_features': n_features,
+        'max_depth': max(tree.max_depth for tree, _ in trees),
+        'source_features': n_single + len(itemsets)
+    }
+    return arrays, meta
+
+
+def _importances_of(model, used: np.ndarray) -> np.ndarray:
+    """Важности модели для признаков used (0 - признак делит только деревья другой модели)"""
+    features, importances = split_importances(model)
+    values = np.zeros(len(used))
+    values[np.searchsorted(used, features)] = importances
+    return values
+
+
+def check_forests(meta: dict, source: str = 'Модель'):
+    """Деревья без единого разбиения дают постоянную оценку - такой артефакт не используется"""
+    if meta['n_features'] == 0:
+        raise ValueError(f"{source}: деревья не делят выборку ни по одному признаку, оценка постоянна - "
+                         f"переобучите модель 04")
+
+
+def feature_itemsets(arrays: dict) -> list:
+    """Суммы каждого признака артефакта кортежами"""
+    amounts, offsets = arrays['feature_amounts'].tolist(), arrays['feature_offsets'].tolist()
+    return [tuple(amounts[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
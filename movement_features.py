@@ -0,0 +1,190 @@
+import numpy as np
+import scipy.sparse as sp
+
+from day_baskets import DayBaskets
+from instrumentation import timed
+from itemset_mining import mine_frequent_itemsets
+
+
+def baskets_to_arrays(baskets):
+    """Плоский массив сумм и смещения дней; DayBaskets отдаются как есть, без копирования"""
+    if not isinstance(baskets, DayBaskets):
+        baskets = DayBaskets.from_lists(baskets)
+    return baskets.amounts, baskets.offsets
+
+
+@timed()
+def build_single_matrix(amounts, offsets):
+    """
+    CSR-матрица дни × уникальные суммы: сколько раз сумма встретилась за день.
+    Возвращает матрицу и отсортированный массив уникальных сумм (номер колонки = позиция суммы).
+    """
+    n_days = len(offsets) - 1
+    unique_amounts, codes = np.unique(amounts, return_inverse=True)
+    rows = np.repeat(np.arange(n_days), np.diff(offsets))
+    X_single = sp.csr_matrix(
+        (np.ones(len(amounts)), (rows, codes.ravel())),
+        shape=(n_days, len(unique_amounts))
+    )
+    X_single.sum_duplicates()
+    return X_single, unique_amounts
+
+
+def _day_columns(day: int, presence, pair_keys, X_prefix=None):
+    """
+    Колонки дня по возрастанию: колонки X_prefix, затем частые пары присутствующих сумм
+    (номер пары сдвинут на число колонок X_prefix). Возвращает колонки и значения X_prefix для первых из них.
+    """
+    n_amounts = presence.shape[1]
+    columns, values, n_prefix = [], None, 0
+    if X_prefix is not None:
+        start, end = X_prefix.indptr[day], X_prefix.indptr[day + 1]
+        columns.append(X_prefix.indices[start:end])
+        values = X_prefix.data[start:end]
+        n_prefix = X_prefix.shape[1]
+    present = presence.indices[presence.indptr[day]:presence.indptr[day + 1]]
+    if len(present) >= 2 and len(pair_keys):
+        # Перебираем только пары присутствующих сумм и ищем их среди частых; ключи дня возрастают
+        first, second = np.triu_indices(len(present), 1)
+        keys = present[first].astype(np.int64) * n_amounts + present[second]
+        positions = np.searchsorted(pair_keys, keys)
+        found = positions < len(pair_keys)
+        found[found] = pair_keys[positions[found]] == keys[found]
+        columns.append(positions[found] + n_prefix)
+    return (np.concatenate(columns) if columns else np.zeros(0, dtype=np.int64)), values
+
+
+@timed()
+def build_pair_matrix(X_single, min_support: int = 2, X_prefix=None, rows=None):
+    """
+    Бинарные признаки пар сумм, которые реально встречаются вместе.
+    Кандидаты берутся из матрицы совместной встречаемости Bᵀ·B (B - присутствие суммы за день),
+    пары с числом общих дней меньше min_support отбрасываются.
+    Пар на порядки больше, чем транзакций, и память стадии определяется ими, поэтому матрица
+    собирается сразу в CSC (формат, с которым работают деревья; значения float32) за два прохода
+    по дням - подсчет непустых ячеек колонок, затем заполнение - без промежуточных COO-массивов.
+    X_prefix - матрица тех же дней, колонки которой ставятся перед парами (без копии в hstack);
+    rows - дни, которые становятся строками матрицы, в нужном порядке (None - все дни);
+    поддержка пар при этом считается по всем дням.
+    Возвращает CSC-матрицу строки × [X_prefix, пары], массивы индексов колонок пар (i < j) и их поддержку.
+    """
+    presence = (X_single > 0).astype(np.int32).tocsr()
+    presence.sort_indices()
+    n_days, n_amounts = presence.shape
+
+    co_occurrence = (presence.T @ presence).tocoo()
+    mask = (co_occurrence.row < co_occurrence.col) & (co_occurrence.data >= min_support)
+    pair_keys = co_occurrence.row[mask].astype(np.int64) * n_amounts + co_occurrence.col[mask]
+    order = np.argsort(pair_keys)
+    pair_keys = pair_keys[order]
+    support = co_occurrence.data[mask][order]
+    del co_occurrence, mask, order
+
+    if X_prefix is not None:
+        X_prefix = X_prefix.tocsr()
+        X_prefix.sort_indices()
+    n_columns = (0 if X_prefix is None else X_prefix.shape[1]) + len(pair_keys)
+    rows = np.arange(n_days) if rows is None else np.asarray(rows)
+
+    # Первый проход: число непустых ячеек каждой колонки
+    indptr = np.zeros(n_columns + 1, dtype=np.int64)
+    for day in rows.tolist():
+        columns, _ = _day_columns(day, presence, pair_keys, X_prefix)
+        indptr[columns + 1] += 1
+    np.cumsum(indptr, out=indptr)
+    index_dtype = np.int32 if indptr[-1] < np.iinfo(np.int32).max else np.int64
+    indptr = indptr.astype(index_dtype)
+
+    # Второй проход: строки дописываются по порядку, поэтому строки в каждой колонке отсортированы
+    indices = np.empty(indptr[-1], dtype=index_dtype)
+    data = np.ones(indptr[-1], dtype=np.float32)
+    next_free = indptr[:-1].copy()
+    for row, day in enumerate(rows.tolist()):
+        columns, values = _day_columns(day, presence, pair_keys, X_prefix)
+        positions = next_free[columns]
+        indices[positions] = row
+        if values is not None:
+            data[positions[:len(values)]] = values
+        next_free[columns] += 1
+
+    X_pairs = sp.csc_matrix((data, indices, indptr), shape=(len(rows), n_columns))
+    return X_pairs, pair_keys // n_amounts, pair_keys % n_amounts, support
+
+
+@timed()
+def build_itemset_matrix(X_single, itemsets):
+    """
+    Бинарные признаки наборов сумм: 1, если за день встретились все суммы набора.
+    itemsets - наборы индексов колонок X_single; дни набора - пересечение дней его элементов.
+    """
+    presence = (X_single > 0).tocsc()
+    presence.sort_indices()
+    rows, cols = [], []
+    for col, itemset in enumerate(itemsets):
+        days = presence.indices[presence.indptr[itemset[0]]:presence.indptr[itemset[0] + 1]]
+        for item in itemset[1:]:
+            days = np.intersect1d(days, presence.indices[presence.indptr[item]:presence.indptr[item + 1]],
+                                  assume_unique=True)
+        rows.append(days)
+        cols.append(np.full(len(days), col))
+
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+    return sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(X_single.shape[0], len(itemsets)))
+
+
+def build_sparse_features(baskets, min_support: int = 2, max_itemset_len: int = 2, n_jobs=None, rows=None):
+    """
+    Разреженная матрица признаков по дневным корзинам транзакций (DayBaskets или список списков):
+    количество каждой суммы за день + наличие частых наборов сумм (пар, троек и т.д.).
+    При max_itemset_len=2 пары берутся из матрицы совместной встречаемости,
+    при большей длине наборы ищутся FP-growth (None - без ограничения длины).
+    rows - дни, которые становятся строками матрицы (например, обучающие), None - все дни;
+    признаки и их частота определяются по всем дням.
+    Возвращает X (CSC, float32), transaction_map {сумма: колонка}, itemsets [(сумма1, сумма2, ...)]
+    и transaction_counts {сумма: число транзакций}.
+    """
+    amounts, offsets = baskets_to_arrays(baskets)
+    X_single, unique_amounts = build_single_matrix(amounts, offsets)
+
+    if max_itemset_len == 2:
+        X, pair_first, pair_second, _ = build_pair_matrix(X_single, min_support, X_prefix=X_single, rows=rows)
+        itemsets = list(zip(unique_amounts[pair_first].tolist(), unique_amounts[pair_second].tolist()))
+    else:
+        # Майним по номерам колонок, чтобы не зависеть от представления сумм
+        presence = (X_single > 0).tocsr()
+        day_columns = [presence.indices[presence.indptr[day]:presence.indptr[day + 1]].tolist()
+                       for day in range(presence.shape[0])]
+        itemset_columns = [itemset for itemset, _ in
+                           mine_frequent_itemsets(day_columns, min_support, max_itemset_len, n_jobs)
+                           if len(itemset) > 1]
+        itemsets = [tuple(unique_amounts[list(itemset)].tolist()) for itemset in itemset_columns]
+        X = sp.hstack([X_single, build_itemset_matrix(X_single, itemset_columns)], format='csc', dtype=np.float32)
+        if rows is not None:
+            X = X[np.asarray(rows)]
+
+    transaction_map = {amount: i for i, amount in enumerate(unique_amounts.tolist())}
+    counts = np.asarray(X_single.sum(axis=0)).ravel().astype(np.int64)
+    transaction_counts = dict(zip(unique_amounts.tolist(), counts.tolist()))
+    return X, transaction_map, itemsets, transaction_counts
+
+
+def transform_features(baskets, transaction_map: dict, itemsets: list):
+    """
+    Матрица признаков для корзин по уже выбранным колонкам build_sparse_features
+    (transaction_map и itemsets, например, найденным только на обучающих днях).
+    Суммы, которых нет в transaction_map, не дают признаков.
+    """
+    amounts, offsets = baskets_to_arrays(baskets)
+    n_days = len(offsets) - 1
+    known_amounts = np.fromiter(transaction_map.keys(), dtype=np.float64, count=len(transaction_map))
+    positions = np.searchsorted(known_amounts, amounts)
+    known = positions < len(known_amounts)
+    known[known] = known_amounts[positions[known]] == amounts[known]
+    rows = np.repeat(np.arange(n_days), np.diff(offsets))[known]
+    X_single = sp.csr_matrix((np.ones(len(rows)), (rows, positions[known])), shape=(n_days, len(known_amounts)))
+    X_single.sum_duplicates()
+
+    itemset_columns = [tuple(transaction_map[amount] for amount in itemset) for itemset in itemsets]
+    X_itemsets = build_itemset_matrix(X_single, itemset_columns)
+    return sp.hstack([X_single, X_itemsets], format='csr')
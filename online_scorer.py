@@ -0,0 +1,107 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from model_artifact import check_forests, compact_forests, feature_itemsets, load_model_artifact
+from paths import MODEL_FILE
+
+
+def utc_day(timestamp):
+    """День транзакции по UTC, как у корзин create_combined_dataset"""
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert('UTC')
+    return timestamp.date()
+
+
+class OnlineMovementScorer:
+    """
+    Онлайн-оценка модели движения цены (04) по транзакциям текущего дня.
+    Деревья лесов - плоские массивы компактного артефакта (model_artifact), только по признакам,
+    на которых деревья реально делят выборку. Вектор признаков дня поддерживается
+    инкрементально: новая сумма меняет свой счетчик и проверяет только наборы,
+    в которые она входит, - полная матрица признаков не строится.
+    Оценка - проход всех деревьев сразу векторными операциями, глубина - число шагов.
+    """
+
+    def __init__(self, arrays: dict, meta: dict):
+        check_forests(meta)
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.leaf_prob = arrays['leaf_prob']
+        self.roots = arrays['roots']
+        self.n_features = meta['n_features']
+        self.max_depth = meta['max_depth']
+        # Деревья моделей идут подряд: оценка модели - среднее по ее срезу
+        self.model_trees = {name: slice(start, stop) for name, (start, stop) in meta['models'].items()}
+
+        self.single_features = {}
+        self.itemsets_by_amount = {}
+        for fid, itemset in enumerate(feature_itemsets(arrays)):
+            if len(itemset) == 1:
+                self.single_features[itemset[0]] = fid
+            else:
+                for amount in itemset:
+                    self.itemsets_by_amount.setdefault(amount, []).append((fid, itemset))
+
+        self.day = None
+        self.counts = {}
+        # Последний слот - заглушка для листьев (0 <= +inf, лист остается на месте)
+        self.x = np.zeros(self.n_features + 1)
+
+    @classmethod
+    def from_model_data(cls, model_data: dict):
+        """Из моделей sklearn в памяти (словарь, как в analyze_price_movements)"""
+        return cls(*compact_forests(model_data))
+
+    @classmethod
+    def load(cls, model_file: str = MODEL_FILE):
+        return cls(*load_model_artifact(model_file))
+
+    def reset(self, day=None):
+        """Новый день - пустая корзина"""
+        self.day = day
+        self.counts.clear()
+        self.x[:] = 0
+
+    def add(self, amount: float, timestamp) -> dict:
+        """Добавляет транзакцию в корзину ее дня (UTC) и возвращает новую оценку"""
+        day = utc_day(timestamp)
+        if day != self.day:
+            self.reset(day)
+        self._add_amount(float(amount))
+        return self.score()
+
+    def _add_amount(self, amount: float):
+        self.counts[amount] = self.counts.get(amount, 0) + 1
+        fid = self.single_features.get(amount)
+        if fid is not None:
+            self.x[fid] = self.counts[amount]
+        for fid, itemset in self.itemsets_by_amount.get(amount, ()):
+            if not self.x[fid] and all(item in self.counts for item in itemset):
+                self.x[fid] = 1
+
+    def bootstrap(self, amounts, timestamps):
+        """Заполняет корзину текущего дня уже полученными сегодня транзакциями"""
+        for amount, timestamp in zip(amounts, timestamps):
+            day = utc_day(timestamp)
+            if day != self.day:
+                self.reset(day)
+            self._add_amount(float(amount))
+
+    def score(self) -> dict:
+        """Вероятность класса 1 для каждой модели - среднее по листьям ее деревьев"""
+        node = self.roots
+        for _ in range(self.max_depth):
+            node = np.where(self.x[self.feature[node]] <= self.threshold[node], self.left[node], self.right[node])
+        probs = self.leaf_prob[node]
+        return {name: float(probs[trees].mean()) for name, trees in self.model_trees.items()}
+
+    def timed_add(self, amount: float, timestamp):
+        """add с замером времени оценки в микросекундах"""
+        start = time.perf_counter()
+        scores = self.add(amount, timestamp)
+        return scores, (time.perf_counter() - start) * 1e6
@@ -0,0 +1,187 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, stage
+from paths import PAIRS_FILE, PRICE_MATRIX_FILE
+
+# Критические значения теста Энгла-Грейнджера для двух рядов с константой (MacKinnon, 2010):
+# crit = b0 + b1 / T + b2 / T^2
+EG_CRITICAL = {
+    '1%': (-3.89644, -10.9519, -22.527),
+    '5%': (-3.33613, -6.1101, -6.823),
+    '10%': (-3.04445, -4.2412, -2.720)
+}
+PAIRS_PER_TASK = 2000
+
+# Лог-цены, подключенные в процессе-исполнителе
+_worker_prices = None
+
+
+def load_price_matrix(filename: str = PRICE_MATRIX_FILE, max_missing: float = 0.05) -> pd.DataFrame:
+    """
+    Матрица цен закрытия дата × символ. CSV - широкий (date и колонка на символ)
+    или длинный (date, symbol, close). Символы, у которых пропущено больше max_missing
+    дат, отбрасываются; остальные пропуски заполняются последней ценой.
+    """
+    prices = pd.read_csv(filename)
+    columns = {col.lower(): col for col in prices.columns}
+    date_column = columns.get('date') or columns.get('time')
+    if date_column is None:
+        raise ValueError(f"В {filename} нет колонки date")
+    if 'symbol' in columns:
+        price_column = columns.get('close') or columns.get('price')
+        prices = prices.pivot_table(index=date_column, columns=columns['symbol'], values=price_column, aggfunc='last')
+    else:
+        prices = prices.set_index(date_column)
+    prices.index = pd.to_datetime(prices.index, utc=True)
+    prices = prices.sort_index().astype(np.float64)
+
+    prices = prices.loc[:, prices.isna().mean() <= max_missing].ffill().dropna()
+    return prices[prices.columns[(prices > 0).all()]]
+
+
+def correlation_candidates(log_prices: np.ndarray, min_correlation: float = 0.8):
+    """Предварительный отбор: пары (i < j) с |корреляцией лог-цен| не ниже порога"""
+    correlation = np.corrcoef(log_prices, rowvar=False)
+    first, second = np.triu_indices(correlation.shape[0], 1)
+    keep = np.abs(correlation[first, second]) >= min_correlation
+    return first[keep], second[keep], correlation[first[keep], second[keep]]
+
+
+def hedge_regressions(log_prices: np.ndarray, y_index: np.ndarray, x_index: np.ndarray):
+    """МНК y = a + b * x сразу для пачки пар; возвращает (b, a, остатки T × пары)"""
+    y, x = log_prices[:, y_index], log_prices[:, x_index]
+    x_mean, y_mean = x.mean(axis=0), y.mean(axis=0)
+    x_centered = x - x_mean
+    beta = np.einsum('tp,tp->p', x_centered, y - y_mean) / np.einsum('tp,tp->p', x_centered, x_centered)
+    alpha = y_mean - beta * x_mean
+    return beta, alpha, y - alpha - beta * x
+
+
+def adf_statistic(residuals: np.ndarray, lags: int = 1) -> np.ndarray:
+    """
+    t-статистика ADF для столбцов остатков (без константы, как в тесте Энгла-Грейнджера):
+    Δe_t = γ e_{t-1} + Σ φ_l Δe_{t-l}. Нормальные уравнения решаются пачкой для всех пар.
+    """
+    diffs = np.diff(residuals, axis=0)
+    n_obs = len(diffs) - lags
+    regressors = [residuals[lags:-1]] + [diffs[lags - lag:len(diffs) - lag] for lag in range(1, lags + 1)]
+    design = np.stack(regressors, axis=-1).transpose(1, 0, 2)
+    target = diffs[lags:].T
+
+    gram = np.einsum('ptk,ptl->pkl', design, design)
+    moments = np.einsum('ptk,pt->pk', design, target)
+    inverse = np.linalg.inv(gram)
+    coefficients = np.einsum('pkl,pl->pk', inverse, moments)
+    rss = np.einsum('pt,pt->p', target, target) - np.einsum('pk,pk->p', coefficients, moments)
+    sigma2 = np.maximum(rss, 0) / (n_obs - design.shape[-1])
+    return coefficients[:, 0] / np.sqrt(sigma2 * inverse[:, 0, 0])
+
+
+def half_life(spread: np.ndarray) -> np.ndarray:
+    """Период полураспада отклонения спреда: Δs_t = c + λ s_{t-1}, half-life = -ln 2 / λ"""
+    lagged = spread[:-1] - spread[:-1].mean(axis=0)
+    diffs = np.diff(spread, axis=0)
+    speed = np.einsum('tp,tp->p', lagged, diffs - diffs.mean(axis=0)) / np.einsum('tp,tp->p', lagged, lagged)
+    with np.errstate(divide='ignore'):
+        return np.where(speed < 0, -np.log(2) / speed, np.inf)
+
+
+def critical_values(n_obs: int) -> dict:
+    return {level: b0 + b1 / n_obs + b2 / n_obs ** 2 for level, (b0, b1, b2) in EG_CRITICAL.items()}
+
+
+def _init_worker(log_prices):
+    global _worker_prices
+    _worker_prices = log_prices
+
+
+def _screen_task(first: np.ndarray, second: np.ndarray, lags: int) -> dict:
+    """
+    Задача для процесса: тест Энгла-Грейнджера для пачки пар в обе стороны
+    (y по x и x по y), остается направление с меньшей статистикой ADF.
+    """
+    log_prices = _worker_prices
+    y_index = np.concatenate([first, second])
+    x_index = np.concatenate([second, first])
+    beta, alpha, residuals = hedge_regressions(log_prices, y_index, x_index)
+    stats = adf_statistic(residuals, lags)
+
+    n_pairs = len(first)
+    best = np.where(stats[:n_pairs] <= stats[n_pairs:], np.arange(n_pairs), np.arange(n_pairs) + n_pairs)
+    return {
+        'y': y_index[best], 'x': x_index[best], 'hedge_ratio': beta[best], 'intercept': alpha[best],
+        'adf_stat': stats[best], 'half_life': half_life(residuals[:, best]),
+        'spread_std': residuals[:, best].std(axis=0)
+    }
+
+
+@stage('pairs_screening')
+def screen_pairs(prices: pd.DataFrame, min_correlation: float = 0.8, lags: int = 1, significance: str = '5%',
+                 max_half_life: float = None, n_jobs=None) -> pd.DataFrame:
+    """
+    Поиск коинтегрированных пар по матрице цен дата × символ (load_price_matrix).
+    Пары сначала отбираются по корреляции лог-цен, затем кандидаты проходят тест
+    Энгла-Грейнджера (регрессия лог-цен + ADF остатков) пачками по PAIRS_PER_TASK на пуле процессов.
+    Возвращает пары, прошедшие тест на уровне significance (и с half-life не больше max_half_life),
+    по возрастанию статистики ADF: y, x, hedge_ratio (log y = a + b log x), half_life в шагах ряда.
+    """
+    start = time.perf_counter()
+    symbols = np.asarray(prices.columns)
+    log_prices = np.log(prices.to_numpy(dtype=np.float64))
+    if len(log_prices) <= lags + 10:
+        raise ValueError(f"Слишком короткий ряд цен для теста: {len(log_prices)} точек")
+
+    first, second, correlation = correlation_candidates(log_prices, min_correlation)
+    total_pairs = len(symbols) * (len(symbols) - 1) // 2
+    count('pairs_total', total_pairs)
+    count('pairs_tested', len(first))
+    print(f"Символов: {len(symbols)}, пар: {total_pairs}, после фильтра корреляции: {len(first)}")
+
+    chunks = []
+    with ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count(),
+                             initializer=_init_worker, initargs=(log_prices,)) as executor:
+        futures = [executor.submit(_screen_task, first[i:i + PAIRS_PER_TASK], second[i:i + PAIRS_PER_TASK], lags)
+                   for i in range(0, len(first), PAIRS_PER_TASK)]
+        for future in futures:
+            chunks.append(future.result())
+
+    columns = ['y', 'x', 'correlation', 'hedge_ratio', 'intercept', 'adf_stat', 'critical_value', 'half_life', 'spread_std']
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    results = pd.DataFrame({key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]})
+    results['correlation'] = correlation
+    results['y'] = symbols[results['y']]
+    results['x'] = symbols[results['x']]
+    results['critical_value'] = critical_values(len(log_prices))[significance]
+
+    selected = results['adf_stat'] < results['critical_value']
+    if max_half_life is not None:
+        selected &= results['half_life'] <= max_half_life
+    results = results[selected].sort_values('adf_stat').reset_index(drop=True)[columns]
+    count('pairs_cointegrated', len(results))
+    print(f"Коинтегрированных пар: {len(results)}, поиск занял {time.perf_counter() - start:.1f} с")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Поиск коинтегрированных пар для парного трейдинга')
+    parser.add_argument('prices', nargs='?', default=PRICE_MATRIX_FILE)
+    parser.add_argument('--min-correlation', type=float, default=0.8)
+    parser.add_argument('--lags', type=int, default=1)
+    parser.add_argument('--significance', choices=list(EG_CRITICAL), default='5%')
+    parser.add_argument('--max-half-life', type=float, default=None)
+    parser.add_argument('--jobs', type=int, default=None)
+    args = parser.parse_args()
+
+    pairs = screen_pairs(load_price_matrix(args.prices), args.min_correlation, args.lags,
+                         args.significance, args.max_half_life, args.jobs)
+    pairs.to_csv(PAIRS_FILE, index=False)
+    print(f"\nПары сохранены в {PAIRS_FILE}")
+    print(pairs.head(20))
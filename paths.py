@@ -0,0 +1,42 @@
+import os
+
+# Единое расположение данных конвейера 01-04; каталог можно переопределить через окружение
+DATA_DIR = os.environ.get('ALGO_TRADE_DATA_DIR', './.csv')
+STORE_DIR = os.path.join(DATA_DIR, 'store')
+VIEWS_DIR = os.path.join(DATA_DIR, 'views')
+# Представления объединенной истории 02 (без дубликатов между ботами) - отдельный набор в views/merged
+MERGED_VIEWS_DIR = os.path.join(VIEWS_DIR, 'merged')
+# Метаданные представлений меняются при каждом их обновлении - по ним конвейер видит новые данные
+VIEWS_META_FILE = os.path.join(VIEWS_DIR, '_meta.json')
+MERGED_VIEWS_META_FILE = os.path.join(MERGED_VIEWS_DIR, '_meta.json')
+INDEX_DIR = os.path.join(DATA_DIR, 'index')
+SNAPSHOT_DIR = os.path.join(DATA_DIR, 'snapshots')
+# Архив исходных сообщений каналов и результат их повторного разбора (раскладка как у DATA_DIR)
+ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive')
+REPARSE_DIR = os.path.join(DATA_DIR, 'reparsed')
+
+MERGED_FILE = os.path.join(DATA_DIR, 'all_btc_transactions.csv')
+FREQUENCY_FILE = os.path.join(DATA_DIR, 'btc_frequency_analysis.csv')
+WALK_FORWARD_FILE = os.path.join(DATA_DIR, 'walk_forward_results.csv')
+PIPELINE_CACHE_FILE = os.path.join(DATA_DIR, '.pipeline_cache.json')
+
+# Таблица крупных движений цены BTC (готовится вне этого репозитория)
+MOVEMENTS_FILE = os.environ.get('BTC_MOVEMENTS_FILE', 'Global_functions/.csv/btc_big_movements_20250121.csv')
+# Дневные цены закрытия BTC для бэктеста (Date, Close)
+PRICES_FILE = os.environ.get('BTC_PRICES_FILE', 'Global_functions/.csv/btc_daily_prices.csv')
+BACKTEST_FILE = os.path.join(DATA_DIR, 'backtest_results.csv')
+# Цены закрытия инструментов для парного трейдинга (дата × символ или date, symbol, close)
+PRICE_MATRIX_FILE = os.environ.get('PAIRS_PRICES_FILE', os.path.join(DATA_DIR, 'price_matrix.csv'))
+PAIRS_FILE = os.path.join(DATA_DIR, 'cointegrated_pairs.csv')
+# Записанный поток тиков (time, symbol, price) для воспроизведения сигналов пар
+TICKS_FILE = os.environ.get('PAIRS_TICKS_FILE', os.path.join(DATA_DIR, 'ticks.csv'))
+PAIR_EVENTS_FILE = os.path.join(DATA_DIR, 'pair_events.csv')
+
+MODELS_DIR = os.environ.get('ALGO_TRADE_MODELS_DIR', './models')
+# Компактный артефакт модели 04 (model_artifact), открывается через memory map
+MODEL_FILE = os.path.join(MODELS_DIR, 'price_movement_model.bin')
+
+
+def channel_csv(channel_name: str) -> str:
+    """Плоский CSV транзакций канала - выгрузка хранилища для скриптов 02-04"""
+    return os.path.join(DATA_DIR, f'{channel_name}_transactions.csv')
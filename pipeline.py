@@ -0,0 +1,276 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from paths import (FREQUENCY_FILE, MERGED_FILE, MERGED_VIEWS_META_FILE, MODEL_FILE, MOVEMENTS_FILE,
+                   PIPELINE_CACHE_FILE, VIEWS_META_FILE, WALK_FORWARD_FILE, channel_csv)
+
+CHANNEL_FILES = [channel_csv('whalebot'), channel_csv('whale_alert')]
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def _run_ingest():
+    tg_channel_parse = importlib.import_module('01_tg_channel_parse')
+    with tg_channel_parse.client:
+        tg_channel_parse.client.loop.run_until_complete(tg_channel_parse.get_history())
+
+
+def _run_merge():
+    importlib.import_module('02_merge_BTC_transactions').merge_transactions()
+
+
+def _run_frequency():
+    import matplotlib
+    matplotlib.use('Agg')
+    frequency = importlib.import_module('03_analyze_transactions_frequency')
+    frequency.analyze_btc_transactions_frequency(show_plot=False)
+
+
+def _run_price_model():
+    movements = importlib.import_module('04_compare_bigBtc_movements_and_transactions')
+    df, baskets = movements.create_combined_dataset(MOVEMENTS_FILE)
+    movements.analyze_price_movements(df, baskets)
+
+
+def _run_walk_forward():
+    movements = importlib.import_module('04_compare_bigBtc_movements_and_transactions')
+    walk_forward = importlib.import_module('walk_forward')
+    df, baskets = movements.create_combined_dataset(MOVEMENTS_FILE)
+    results = walk_forward.run_parameter_sweep(df.reset_index(drop=True), baskets)
+    results.to_csv(WALK_FORWARD_FILE, index=False)
+
+
+# Стадии конвейера: входы, выходы и код, от которых зависит результат.
+# В code - все модули репозитория, которые стадия импортирует (в том числе через другие модули).
+# Зависимости между стадиями выводятся из того, кто производит входные файлы.
+# 03 и 04 читают дневные представления; их входы - метаданные представлений,
+# которые меняются при каждом обновлении.
+STAGES = {
+    'ingest': {
+        'run': _run_ingest,
+        'inputs': [],
+        'outputs': CHANNEL_FILES + [VIEWS_META_FILE],
+        'code': ['01_tg_channel_parse.py', 'message_parser.py', 'transaction_store.py', 'ingest_index.py',
+                 'message_archive.py', 'transaction_index.py', 'transaction_loader.py', 'daily_views.py',
+                 'alert_rules.py', 'online_scorer.py', 'model_artifact.py', 'paths.py', 'instrumentation.py'],
+        # Источник - Telegram, по содержимому входов пропустить нельзя
+        'always_run': True
+    },
+    'merge': {
+        'run': _run_merge,
+        'inputs': CHANNEL_FILES,
+        'outputs': [MERGED_FILE, MERGED_VIEWS_META_FILE],
+        'code': ['02_merge_BTC_transactions.py', 'transaction_loader.py', 'daily_views.py', 'paths.py',
+                 'instrumentation.py']
+    },
+    'frequency': {
+        'run': _run_frequency,
+        'inputs': [MERGED_VIEWS_META_FILE],
+        'outputs': [FREQUENCY_FILE],
+        'code': ['03_analyze_transactions_frequency.py', 'daily_views.py', 'paths.py', 'instrumentation.py']
+    },
+    'price_model': {
+        'run': _run_price_model,
+        'inputs': [MOVEMENTS_FILE, VIEWS_META_FILE],
+        'outputs': [MODEL_FILE],
+        'code': ['04_compare_bigBtc_movements_and_transactions.py', 'movement_features.py',
+                 'itemset_mining.py', 'day_baskets.py', 'model_artifact.py', 'transaction_loader.py',
+                 'daily_views.py', 'paths.py', 'instrumentation.py']
+    },
+    'walk_forward': {
+        'run': _run_walk_forward,
+        'inputs': [MOVEMENTS_FILE, VIEWS_META_FILE],
+        'outputs': [WALK_FORWARD_FILE],
+        'code': ['walk_forward.py', '04_compare_bigBtc_movements_and_transactions.py', 'movement_features.py',
+                 'itemset_mining.py', 'day_baskets.py', 'model_artifact.py', 'transaction_loader.py',
+                 'daily_views.py', 'paths.py', 'instrumentation.py']
+    }
+}
+
+# Ежедневное обновление по умолчанию: без чтения Telegram и без долгого перебора параметров
+DEFAULT_TARGETS = ('frequency', 'price_model')
+
+
+def stage_dependencies(stages: dict = STAGES) -> dict:
+    """Для каждой стадии - стадии, производящие ее входы"""
+    producers = {output: name for name, spec in stages.items() for output in spec['outputs']}
+    return {name: sorted({producers[path] for path in spec['inputs'] if path in producers} - {name})
+            for name, spec in stages.items()}
+
+
+def select_stages(targets, include_ingest: bool = False, stages: dict = STAGES) -> list:
+    """Целевые стадии вместе со всеми предшественниками, в топологическом порядке"""
+    dependencies = stage_dependencies(stages)
+    order, visiting = [], set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"Цикл в графе стадий через {name}")
+        visiting.add(name)
+        for dependency in dependencies[name]:
+            if dependency != 'ingest' or include_ingest:
+                visit(dependency)
+        visiting.discard(name)
+        order.append(name)
+
+    for target in targets:
+        if target not in stages:
+            raise ValueError(f"Неизвестная стадия {target}. Доступны: {list(stages)}")
+        visit(target)
+    return order
+
+
+class PipelineCache:
+    """
+    Кэш конвейера: ключ каждой успешно выполненной стадии и хэши ее выходов.
+    Хэши файлов запоминаются по (размер, mtime), чтобы не перечитывать неизмененные файлы.
+    """
+
+    def __init__(self, filename: str = PIPELINE_CACHE_FILE):
+        self.filename = filename
+        self.data = {'stages': {}, 'files': {}}
+        if os.path.exists(filename):
+            with open(filename, encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    def file_digest(self, path: str):
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        cached = self.data['files'].get(path)
+        if cached and cached['signature'] == signature:
+            return cached['sha256']
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        self.data['files'][path] = {'signature': signature, 'sha256': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def stage_key(self, name: str, spec: dict) -> str:
+        """Ключ стадии: хэши содержимого входов и файлов кода стадии"""
+        root = os.path.dirname(os.path.abspath(__file__))
+        parts = {
+            'stage': name,
+            'inputs': {path: self.file_digest(path) for path in spec['inputs']},
+            'code': {path: self.file_digest(os.path.join(root, path)) for path in spec.get('code', [])}
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def is_fresh(self, name: str, key: str, spec: dict) -> bool:
+        entry = self.data['stages'].get(name)
+        if entry is None or entry['key'] != key:
+            return False
+        return all(self.file_digest(path) == digest for path, digest in entry['outputs'].items())
+
+    def record(self, name: str, key: str, spec: dict):
+        self.data['stages'][name] = {
+            'key': key,
+            'outputs': {path: self.file_digest(path) for path in spec['outputs']},
+            'finished': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        tmp_path = self.filename + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.filename)
+
+
+def _timed_run(name: str) -> float:
+    """Задача для процесса: выполняет стадию и возвращает время выполнения"""
+    start = time.perf_counter()
+    STAGES[name]['run']()
+    return time.perf_counter() - start
+
+
+def run_pipeline(targets=DEFAULT_TARGETS, include_ingest: bool = False, force=(), n_jobs=None,
+                 dry_run: bool = False, stages: dict = STAGES) -> dict:
+    """
+    Выполняет целевые стадии и их предшественников. Стадия пропускается, если хэши ее входов
+    и кода совпадают с прошлым успешным запуском, а выходы не изменены. Стадии без взаимных
+    зависимостей выполняются параллельно на пуле процессов. Возвращает статус каждой стадии.
+    """
+    order = select_stages(targets, include_ingest, stages)
+    dependencies = stage_dependencies(stages)
+    cache = PipelineCache()
+    status = {}
+    keys = {}
+    pending = list(order)
+    running = {}
+
+    with ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count()) as executor:
+        while pending or running:
+            for name in list(pending):
+                upstream = [dependency for dependency in dependencies[name] if dependency in order]
+                if any(status.get(dependency) in ('failed', 'blocked') for dependency in upstream):
+                    status[name] = 'blocked'
+                    pending.remove(name)
+                    print(f"[{name}] пропущена: не выполнена предыдущая стадия")
+                    continue
+                if not all(dependency in status for dependency in upstream):
+                    continue
+                pending.remove(name)
+                if any(status[dependency] == 'would_run' for dependency in upstream):
+                    # Входы изменит предыдущая стадия - в пробном запуске считаем, что выполнится и эта
+                    status[name] = 'would_run'
+                    print(f"[{name}] будет выполнена")
+                    continue
+
+                spec = stages[name]
+                missing = [path for path in spec['inputs'] if not os.path.exists(path)]
+                if missing:
+                    status[name] = 'failed'
+                    print(f"[{name}] нет входных файлов: {missing}")
+                    continue
+                keys[name] = cache.stage_key(name, spec)
+                if not spec.get('always_run') and name not in force and cache.is_fresh(name, keys[name], spec):
+                    status[name] = 'cached'
+                    print(f"[{name}] входы не изменились, стадия пропущена")
+                    continue
+                if dry_run:
+                    status[name] = 'would_run'
+                    print(f"[{name}] будет выполнена")
+                    continue
+                print(f"[{name}] запуск")
+                running[executor.submit(_timed_run, name)] = name
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    status[name] = 'failed'
+                    print(f"[{name}] ошибка: {e}")
+                    continue
+                status[name] = 'done'
+                cache.record(name, keys[name], stages[name])
+                print(f"[{name}] выполнена за {seconds:.1f} с")
+
+    cache.save()
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Запуск конвейера 01-04 с пропуском неизмененных стадий')
+    parser.add_argument('targets', nargs='*', help=f'стадии: {list(STAGES)}, по умолчанию {list(DEFAULT_TARGETS)}')
+    parser.add_argument('--ingest', action='store_true', help='сначала догрузить историю из Telegram')
+    parser.add_argument('--force', nargs='+', default=[], choices=list(STAGES), help='выполнить стадии без проверки кэша')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--dry-run', action='store_true', help='только показать, какие стадии будут выполнены')
+    args = parser.parse_args()
+
+    result = run_pipeline(args.targets or DEFAULT_TARGETS, args.ingest, args.force, args.jobs, args.dry_run)
+    print("\nИтог:", ', '.join(f'{name}: {state}' for name, state in result.items()))
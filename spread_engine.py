@@ -0,0 +1,188 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, stage
+from paths import PAIRS_FILE, PAIR_EVENTS_FILE, TICKS_FILE
+
+# Состояние пары: 0 - без позиции, 1 - спред куплен (z ниже -entry), -1 - спред продан
+FLAT, LONG_SPREAD, SHORT_SPREAD = 0, 1, -1
+EVENT_NAMES = {LONG_SPREAD: 'enter_long', SHORT_SPREAD: 'enter_short', FLAT: 'exit'}
+
+
+class RollingSpreadEngine:
+    """
+    Потоковый расчет спреда, скользящего среднего, дисперсии и z-score для множества пар.
+    Спред пары: log y - hedge_ratio * log x - intercept (как в pairs_screening).
+    Последние window значений спреда каждой пары лежат в кольцевом буфере (окно × пары),
+    среднее и M2 обновляются по Уэлфорду со скользящим окном (добавление нового и удаление
+    вытесненного значения) - на тик O(1) на каждую затронутую пару, без пересчета окна.
+    Когда буфер пары проходит полный круг, статистика пересчитывается по буферу,
+    чтобы не накапливалась ошибка округления (в среднем O(1) на обновление).
+    """
+
+    def __init__(self, symbols, y_index, x_index, hedge_ratio, intercept=None, window: int = 100,
+                 entry_z: float = 2.0, exit_z: float = 0.5):
+        self.symbols = list(symbols)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.y_index = np.asarray(y_index, dtype=np.int64)
+        self.x_index = np.asarray(x_index, dtype=np.int64)
+        self.hedge_ratio = np.asarray(hedge_ratio, dtype=np.float64)
+        n_pairs = len(self.y_index)
+        self.intercept = np.zeros(n_pairs) if intercept is None else np.asarray(intercept, dtype=np.float64)
+        self.window = window
+        self.entry_z = entry_z
+        self.exit_z = exit_z
+
+        self.log_prices = np.full(len(self.symbols), np.nan)
+        self.buffer = np.zeros((window, n_pairs))
+        self.position = np.zeros(n_pairs, dtype=np.int64)
+        self.counts = np.zeros(n_pairs, dtype=np.int64)
+        self.mean = np.zeros(n_pairs)
+        self.m2 = np.zeros(n_pairs)
+        self.spread = np.full(n_pairs, np.nan)
+        self.zscore = np.full(n_pairs, np.nan)
+        self.state = np.zeros(n_pairs, dtype=np.int8)
+
+        # Пары каждого символа (CSR): тик символа обновляет только их
+        legs = np.concatenate([self.y_index, self.x_index])
+        pair_ids = np.concatenate([np.arange(n_pairs), np.arange(n_pairs)])
+        order = np.argsort(legs, kind='stable')
+        self._symbol_pairs = pair_ids[order]
+        self._symbol_offsets = np.concatenate([[0], np.cumsum(np.bincount(legs, minlength=len(self.symbols)))])
+
+    @classmethod
+    def from_pairs(cls, pairs: pd.DataFrame, **kwargs):
+        """Движок по таблице пар screen_pairs (колонки y, x, hedge_ratio, intercept)"""
+        symbols = pd.unique(pd.concat([pairs['y'], pairs['x']], ignore_index=True))
+        index = {symbol: i for i, symbol in enumerate(symbols)}
+        return cls(symbols, pairs['y'].map(index), pairs['x'].map(index), pairs['hedge_ratio'],
+                   pairs['intercept'] if 'intercept' in pairs else None, **kwargs)
+
+    def pairs_of(self, symbol_ids) -> np.ndarray:
+        """Номера пар, в которые входят символы symbol_ids"""
+        symbol_ids = np.atleast_1d(symbol_ids)
+        if len(symbol_ids) == 1:
+            symbol = symbol_ids[0]
+            return self._symbol_pairs[self._symbol_offsets[symbol]:self._symbol_offsets[symbol + 1]]
+        return np.unique(np.concatenate([self._symbol_pairs[self._symbol_offsets[s]:self._symbol_offsets[s + 1]]
+                                         for s in symbol_ids]))
+
+    def on_prices(self, symbol_ids, prices, timestamp=None) -> list:
+        """
+        Обновляет цены символов (номера symbol_ids) и статистику затронутых пар.
+        Возвращает события входа/выхода: (timestamp, номер пары, событие, z, спред).
+        """
+        symbol_ids = np.atleast_1d(symbol_ids)
+        self.log_prices[symbol_ids] = np.log(prices)
+        pairs = self.pairs_of(symbol_ids)
+        spread = self.log_prices[self.y_index[pairs]] - self.hedge_ratio[pairs] * self.log_prices[self.x_index[pairs]] - self.intercept[pairs]
+        ready = ~np.isnan(spread)
+        if not ready.all():
+            pairs, spread = pairs[ready], spread[ready]
+        if len(pairs) == 0:
+            return []
+        self._update(pairs, spread)
+        return self._signals(pairs, timestamp)
+
+    def on_tick(self, symbol, price: float, timestamp=None) -> list:
+        return self.on_prices(self.symbol_index[symbol], price, timestamp)
+
+    def _update(self, pairs: np.ndarray, values: np.ndarray):
+        slot = self.position[pairs]
+        old = self.buffer[slot, pairs]
+        self.buffer[slot, pairs] = values
+        self.spread[pairs] = values
+
+        full = self.counts[pairs] >= self.window
+        counts = np.where(full, self.window, self.counts[pairs] + 1)
+        mean = self.mean[pairs]
+        # Окно еще заполняется: обычный шаг Уэлфорда; окно полное: замена старого значения новым
+        new_mean = np.where(full, mean + (values - old) / self.window, mean + (values - mean) / counts)
+        self.m2[pairs] += np.where(full, (values - old) * (values - new_mean + old - mean), (values - mean) * (values - new_mean))
+        self.mean[pairs] = new_mean
+        self.counts[pairs] = counts
+        self.position[pairs] = (slot + 1) % self.window
+
+        wrapped = pairs[(slot + 1 == self.window)]
+        if len(wrapped):
+            window_values = self.buffer[:, wrapped]
+            self.mean[wrapped] = window_values.mean(axis=0)
+            self.m2[wrapped] = ((window_values - self.mean[wrapped]) ** 2).sum(axis=0)
+
+    def _signals(self, pairs: np.ndarray, timestamp) -> list:
+        ready = self.counts[pairs] >= self.window
+        std = np.sqrt(np.maximum(self.m2[pairs], 0) / (self.window - 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            zscore = np.where(ready & (std > 0), (self.spread[pairs] - self.mean[pairs]) / std, np.nan)
+        self.zscore[pairs] = zscore
+
+        state = self.state[pairs]
+        new_state = state.copy()
+        new_state[(state == FLAT) & (zscore >= self.entry_z)] = SHORT_SPREAD
+        new_state[(state == FLAT) & (zscore <= -self.entry_z)] = LONG_SPREAD
+        new_state[(state == SHORT_SPREAD) & (zscore <= self.exit_z)] = FLAT
+        new_state[(state == LONG_SPREAD) & (zscore >= -self.exit_z)] = FLAT
+        changed = np.flatnonzero(new_state != state)
+        if len(changed) == 0:
+            return []
+
+        self.state[pairs[changed]] = new_state[changed]
+        return [(timestamp, int(pairs[i]), EVENT_NAMES[int(new_state[i])], float(zscore[i]), float(self.spread[pairs[i]]))
+                for i in changed]
+
+    def pair_name(self, pair: int) -> str:
+        return f"{self.symbols[self.y_index[pair]]}/{self.symbols[self.x_index[pair]]}"
+
+
+def read_ticks(filename: str = TICKS_FILE, chunk_size: int = 1_000_000):
+    """Тики из CSV (time, symbol, price) порциями в порядке файла"""
+    for chunk in pd.read_csv(filename, chunksize=chunk_size, dtype={'symbol': 'string', 'price': 'float64'}):
+        yield chunk
+
+
+@stage('spread_replay')
+def replay_ticks(engine: RollingSpreadEngine, filename: str = TICKS_FILE, chunk_size: int = 1_000_000) -> pd.DataFrame:
+    """
+    Прогоняет файл тиков через движок (по одному тику, как в живом потоке).
+    Тики символов вне пар пропускаются. Возвращает события и печатает задержку обработки тика.
+    """
+    events, latencies = [], []
+    for chunk in read_ticks(filename, chunk_size):
+        symbol_ids = chunk['symbol'].map(engine.symbol_index).to_numpy(dtype=np.float64, na_value=np.nan)
+        known = ~np.isnan(symbol_ids)
+        count('ticks', len(chunk))
+        for symbol, price, timestamp in zip(symbol_ids[known].astype(np.int64), chunk['price'].to_numpy()[known],
+                                            chunk['time'].to_numpy()[known]):
+            start = time.perf_counter()
+            events.extend(engine.on_prices(symbol, price, timestamp))
+            latencies.append(time.perf_counter() - start)
+
+    if latencies:
+        latencies = np.asarray(latencies) * 1e6
+        print(f"Тиков: {len(latencies)}, задержка мкс: медиана {np.median(latencies):.1f}, "
+              f"p99 {np.percentile(latencies, 99):.1f}, макс {latencies.max():.1f}")
+    count('pair_events', len(events))
+    result = pd.DataFrame(events, columns=['time', 'pair', 'event', 'zscore', 'spread'])
+    result.insert(2, 'pair_name', [engine.pair_name(pair) for pair in result['pair']])
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Z-score спредов пар по файлу тиков')
+    parser.add_argument('ticks', nargs='?', default=TICKS_FILE)
+    parser.add_argument('--pairs', default=PAIRS_FILE)
+    parser.add_argument('--window', type=int, default=100)
+    parser.add_argument('--entry-z', type=float, default=2.0)
+    parser.add_argument('--exit-z', type=float, default=0.5)
+    args = parser.parse_args()
+
+    engine = RollingSpreadEngine.from_pairs(pd.read_csv(args.pairs), window=args.window,
+                                            entry_z=args.entry_z, exit_z=args.exit_z)
+    events = replay_ticks(engine, args.ticks)
+    events.to_csv(PAIR_EVENTS_FILE, index=False)
+    print(f"События сохранены в {PAIR_EVENTS_FILE}")
+    print(events.tail(20))
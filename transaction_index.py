@@ -0,0 +1,151 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from ingest_index import to_ns
+from paths import INDEX_DIR
+from transaction_loader import load_transactions
+
+EPOCHS_FILE = 'epoch_ns.i64'
+AMOUNTS_FILE = 'btc.f64'
+META_FILE = '_meta.json'
+
+
+class TransactionIndex:
+    """
+    Колоночный индекс истории канала для запросов по времени: отсортированный столбец
+    времени (int64 наносекунды, tz-naive UTC) и столбец сумм (float64) в плоских файлах,
+    открываемых через memmap. Диапазон времени находится двоичным поиском,
+    фильтры по суммам применяются только к найденному срезу - история целиком не читается.
+    Дописывается только в конец; количество строк в метаданных - точка фиксации.
+    В метаданных также запоминается размер и mtime CSV канала, с которым индекс сверен:
+    sync_csv перестраивает индекс, если CSV с тех пор изменился.
+    """
+
+    def __init__(self, channel_name: str, base_dir: str = INDEX_DIR):
+        self.channel_name = channel_name
+        self.path = os.path.join(base_dir, channel_name)
+        self.epochs_path = os.path.join(self.path, EPOCHS_FILE)
+        self.amounts_path = os.path.join(self.path, AMOUNTS_FILE)
+        self.meta_path = os.path.join(self.path, META_FILE)
+        self.meta = self._load_meta()
+        self._columns = None
+
+    def _load_meta(self) -> dict:
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding='utf-8') as f:
+                return json.load(f)
+        return {'channel': self.channel_name, 'rows': 0, 'last_ns': None}
+
+    def _save_meta(self):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def __len__(self):
+        return self.meta['rows']
+
+    @property
+    def columns(self):
+        """(время, суммы) как memmap-массивы только для чтения; страницы подгружаются по обращению"""
+        if self._columns is None:
+            rows = self.meta['rows']
+            if rows == 0:
+                self._columns = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+            else:
+                self._columns = (np.memmap(self.epochs_path, dtype=np.int64, mode='r', shape=(rows,)),
+                                 np.memmap(self.amounts_path, dtype=np.float64, mode='r', shape=(rows,)))
+        return self._columns
+
+    def append(self, new_df: pd.DataFrame) -> int:
+        """Дописывает транзакции новее последней записи индекса; возвращает количество добавленных"""
+        if new_df.empty:
+            return 0
+        epochs = pd.to_datetime(new_df['date'], utc=True).dt.tz_localize(None).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        amounts = new_df['btc'].to_numpy(dtype=np.float64)
+        order = np.argsort(epochs, kind='stable')
+        epochs, amounts = epochs[order], amounts[order]
+        if self.meta['last_ns'] is not None:
+            start = np.searchsorted(epochs, self.meta['last_ns'], side='right')
+            epochs, amounts = epochs[start:], amounts[start:]
+        if len(epochs) == 0:
+            return 0
+
+        os.makedirs(self.path, exist_ok=True)
+        committed = self.meta['rows']
+        for filename, column in ((self.epochs_path, epochs), (self.amounts_path, amounts)):
+            with open(filename, 'ab') as f:
+                # Хвост незафиксированной прошлой записи отбрасываем
+                f.truncate(committed * column.itemsize)
+                f.write(np.ascontiguousarray(column).tobytes())
+
+        self._columns = None
+        self.meta['rows'] = committed + len(epochs)
+        self.meta['last_ns'] = int(epochs[-1])
+        self._save_meta()
+        return len(epochs)
+
+    def _source(self, filename: str) -> dict:
+        stat = os.stat(filename)
+        return {'path': os.path.abspath(filename), 'signature': [stat.st_size, stat.st_mtime_ns]}
+
+    def sync_csv(self, filename: str) -> int:
+        """
+        Перестраивает индекс по плоскому CSV канала, если CSV изменился (размер или mtime)
+        с последней синхронизации - например, был перезаписан, пока 01 не работал.
+        Возвращает количество загруженных строк (0 - индекс уже соответствует CSV или CSV нет).
+        """
+        if not os.path.exists(filename):
+            return 0
+        source = self._source(filename)
+        if self.meta.get('source') == source:
+            return 0
+        df = load_transactions(filename, columns=['date', 'btc'])
+        # Сначала фиксируем пустой индекс: старые столбцы отбросит append
+        self.meta.update(rows=0, last_ns=None, source=None)
+        self._columns = None
+        os.makedirs(self.path, exist_ok=True)
+        self._save_meta()
+        added = self.append(df)
+        self.meta['source'] = source
+        self._save_meta()
+        return added
+
+    def mark_synced(self, filename: str):
+        """Запоминает CSV, только что выгруженный из того же хранилища, как соответствующий индексу"""
+        if os.path.exists(filename):
+            self.meta['source'] = self._source(filename)
+            os.makedirs(self.path, exist_ok=True)
+            self._save_meta()
+
+    def time_slice(self, start=None, end=None) -> slice:
+        """Позиции строк с временем в [start, end) - двоичный поиск по memmap-столбцу"""
+        epochs, _ = self.columns
+        low = np.searchsorted(epochs, to_ns(start), side='left') if start is not None else 0
+        high = np.searchsorted(epochs, to_ns(end), side='left') if end is not None else len(epochs)
+        return slice(int(low), int(high))
+
+    def query(self, start=None, end=None, amounts=None, rules=None) -> pd.DataFrame:
+        """
+        Транзакции за [start, end), при необходимости только с суммами из amounts
+        или подходящие под правила rules (AlertRuleEngine, с учетом каналов правил).
+        """
+        epochs, btc = self.columns
+        rows = self.time_slice(start, end)
+        slice_epochs, slice_btc = epochs[rows], btc[rows]
+        mask = np.ones(len(slice_btc), dtype=bool)
+        if amounts is not None:
+            mask &= np.isin(slice_btc, np.asarray(list(amounts), dtype=np.float64))
+        if rules is not None:
+            mask &= rules.matches_mask(slice_btc, self.channel_name)
+        return pd.DataFrame({
+            'date': pd.to_datetime(np.asarray(slice_epochs[mask])).tz_localize('UTC'),
+            'btc': np.asarray(slice_btc[mask])
+        })
+
+    def last(self, days: float = 30, **filters) -> pd.DataFrame:
+        """Транзакции за последние days дней (от текущего момента)"""
+        return self.query(start=pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=days), **filters)
@@ -0,0 +1,75 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from paths import SNAPSHOT_DIR
+
+# Ключи метаданных снимка: по ним снимок сверяется с исходным CSV
+SOURCE_SIZE_KEY = b'source_size'
+SOURCE_MTIME_KEY = b'source_mtime_ns'
+
+
+def parse_dates(values) -> np.ndarray:
+    """
+    Разбирает даты в смешанных форматах старых CSV ('...+00:00', без зоны, только дата)
+    в datetime64[ns] tz-naive UTC. Все варианты - ISO 8601, поэтому хватает одного прохода
+    без format='mixed' (он разбирает каждую строку отдельно).
+    """
+    try:
+        dates = pd.to_datetime(values, utc=True, format='ISO8601')
+    except ValueError:
+        dates = pd.to_datetime(values, utc=True, format='mixed')
+    return pd.DatetimeIndex(dates).tz_localize(None).to_numpy(dtype='datetime64[ns]')
+
+
+def snapshot_path(filename: str, snapshot_dir: str = SNAPSHOT_DIR) -> str:
+    """Снимок лежит в общем каталоге; в имени - короткий хэш полного пути исходника"""
+    source = os.path.abspath(filename)
+    digest = hashlib.sha1(source.encode()).hexdigest()[:12]
+    return os.path.join(snapshot_dir, f'{os.path.splitext(os.path.basename(source))[0]}-{digest}.arrow')
+
+
+def _snapshot_is_fresh(path: str, stat: os.stat_result) -> bool:
+    if not os.path.exists(path):
+        return False
+    try:
+        with pa.memory_map(path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+    return (metadata.get(SOURCE_SIZE_KEY) == str(stat.st_size).encode()
+            and metadata.get(SOURCE_MTIME_KEY) == str(stat.st_mtime_ns).encode())
+
+
+def load_transactions(filename: str, columns=None, snapshot_dir: str = SNAPSHOT_DIR) -> pd.DataFrame:
+    """
+    Загружает CSV транзакций с типизированными колонками: date - datetime64[ns] tz-naive UTC
+    (int64 наносекунды), числовые колонки - как есть. Результат разбора сохраняется в бинарный
+    снимок Arrow рядом с данными; пока размер и mtime исходника не изменились, повторная
+    загрузка читает снимок через memory map без разбора CSV и дат.
+    columns - загрузить только эти колонки.
+    """
+    stat = os.stat(filename)
+    path = snapshot_path(filename, snapshot_dir)
+
+    if _snapshot_is_fresh(path, stat):
+        table = feather.read_table(path, columns=list(columns) if columns else None, memory_map=True)
+        return table.to_pandas()
+
+    df = pd.read_csv(filename)
+    if 'date' in df.columns:
+        df['date'] = parse_dates(df['date'])
+
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata({
+        SOURCE_SIZE_KEY: str(stat.st_size).encode(),
+        SOURCE_MTIME_KEY: str(stat.st_mtime_ns).encode()
+    })
+    os.makedirs(snapshot_dir, exist_ok=True)
+    tmp_path = path + '.tmp'
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+    return df[list(columns)] if columns else df
@@ -0,0 +1,334 @@
+import asyncio
+import json
+import os
+import re
+import time
+
+import pandas as pd
+
+from paths import STORE_DIR
+
+META_FILE = '_meta.json'
+PART_PATTERN = re.compile(r'part-(\d+)\.parquet$')
+# Число part-файлов дня, после которого append сворачивает их в один
+MAX_DAY_PARTS = 32
+
+
+class TransactionStore:
+    """
+    Append-only хранилище транзакций одного канала:
+    - данные разбиты по дням (каталог day=YYYY-MM-DD)
+    - каждый сброс пакета пишет новые part-файлы только для затронутых дней
+    - водяной знак (последний сохраненный timestamp) хранится в метаданных
+    - там же контрольная точка - id последнего обработанного сообщения канала;
+      она фиксируется тем же сохранением метаданных, что и записанные строки
+    - compact сворачивает part-файлы дня в один; номер свернутого файла (база дня) хранится
+      в метаданных, part-файлы дня с меньшим номером после этого не читаются
+    """
+
+    def __init__(self, channel_name: str, base_dir: str = STORE_DIR):
+        self.channel_name = channel_name
+        self.path = os.path.join(base_dir, channel_name)
+        self.meta_path = os.path.join(self.path, META_FILE)
+        self.meta = self._load_meta()
+
+    def _load_meta(self) -> dict:
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding='utf-8') as f:
+                return json.load(f)
+        return {'channel': self.channel_name, 'watermark': None, 'rows': 0, 'parts': 0, 'last_message_id': None,
+                'day_bases': {}}
+
+    def _save_meta(self):
+        """Атомарно сохраняет метаданные - именно это фиксирует записанные part-файлы"""
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    @property
+    def watermark(self):
+        """Время последней сохраненной транзакции (tz-naive UTC) или None"""
+        if self.meta['watermark'] is None:
+            return None
+        return pd.Timestamp(self.meta['watermark'])
+
+    @property
+    def last_message_id(self):
+        """id последнего обработанного сообщения Telegram или None (хранилище без контрольной точки)"""
+        return self.meta.get('last_message_id')
+
+    def _advance_checkpoint(self, message_id) -> bool:
+        if message_id is None or (self.last_message_id is not None and message_id <= self.last_message_id):
+            return False
+        self.meta['last_message_id'] = int(message_id)
+        return True
+
+    def commit_checkpoint(self, message_id) -> bool:
+        """Сдвигает контрольную точку без новых строк (например, пакет без BTC-транзакций)"""
+        if not self._advance_checkpoint(message_id):
+            return False
+        self._save_meta()
+        return True
+
+    @property
+    def rows(self) -> int:
+        return self.meta['rows']
+
+    def is_empty(self) -> bool:
+        return self.meta['rows'] == 0
+
+    def append(self, new_df: pd.DataFrame, last_message_id: int = None) -> int:
+        """
+        Дописывает в хранилище записи новее водяного знака.
+        Стоимость пропорциональна количеству новых строк, а не размеру истории.
+        last_message_id - id последнего сообщения, учтенного в new_df: контрольная точка
+        сдвигается атомарно вместе с записанными строками (или одна, если новых строк нет).
+        Возвращает количество добавленных записей.
+        """
+        if new_df.empty:
+            self.commit_checkpoint(last_message_id)
+            return 0
+
+        new_df = new_df.copy()
+        # Время храним в tz-naive UTC; tz-aware даты приводим к UTC
+        new_df['date'] = pd.to_datetime(new_df['date'], utc=True).dt.tz_localize(None).astype('datetime64[ns]')
+
+        # Фильтруем только новые записи
+        watermark = self.watermark
+        if watermark is not None:
+            new_df = new_df[new_df['date'] > watermark]
+        if new_df.empty:
+            self.commit_checkpoint(last_message_id)
+            return 0
+
+        new_df = new_df.sort_values('date', kind='stable').reset_index(drop=True)
+        days = new_df['date'].dt.strftime('%Y-%m-%d')
+
+        # Пишем по одному part-файлу на каждый затронутый день.
+        # Файлы с номером >= meta['parts'] считаются незафиксированными,
+        # поэтому сбой до сохранения метаданных не приводит к дубликатам
+        parts = self.meta['parts']
+        touched = []
+        for day, day_df in new_df.groupby(days, sort=True):
+            day_dir = os.path.join(self.path, f'day={day}')
+            os.makedirs(day_dir, exist_ok=True)
+            day_df.to_parquet(os.path.join(day_dir, f'part-{parts:08d}.parquet'), index=False)
+            touched.append(day)
+            parts += 1
+
+        self.meta['parts'] = parts
+        self.meta['rows'] += len(new_df)
+        self.meta['watermark'] = new_df['date'].max().strftime('%Y-%m-%d %H:%M:%S')
+        self._advance_checkpoint(last_message_id)
+        self._save_meta()
+
+        # Live-запись добавляет файл на каждый сброс - день, набравший их слишком много, сворачивается
+        crowded = [day for day in touched if len(self._day_files(day)) > MAX_DAY_PARTS]
+        if crowded:
+            self.compact(crowded)
+        return len(new_df)
+
+    def _days(self) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        return [name[len('day='):] for name in sorted(os.listdir(self.path)) if name.startswith('day=')]
+
+    def _day_files(self, day: str) -> list:
+        """Зафиксированные part-файлы дня: номер меньше счетчика parts и не меньше базы дня"""
+        day_dir = os.path.join(self.path, f'day={day}')
+        if not os.path.isdir(day_dir):
+            return []
+        base = self.meta.get('day_bases', {}).get(day, 0)
+        files = []
+        for name in sorted(os.listdir(day_dir)):
+            match = PART_PATTERN.match(name)
+            if match and base <= int(match.group(1)) < self.meta['parts']:
+                files.append(os.path.join(day_dir, name))
+        return files
+
+    def _part_files(self, start_day=None, end_day=None) -> list:
+        """Список зафиксированных part-файлов с отсечением дней вне диапазона"""
+        files = []
+        for day in self._days():
+            if (start_day is not None and day < start_day) or (end_day is not None and day > end_day):
+                continue
+            files.extend(self._day_files(day))
+        return files
+
+    def compact(self, days=None) -> int:
+        """
+        Сворачивает part-файлы каждого дня (или только days) в один файл с новым номером.
+        Переключение - одно атомарное сохранение метаданных: новые файлы фиксируются счетчиком
+        parts, а база дня отсекает прежние; прежние файлы удаляются после него.
+        Возвращает количество свернутых дней.
+        """
+        parts = self.meta['parts']
+        bases = {}
+        for day in (self._days() if days is None else days):
+            files = self._day_files(day)
+            if len(files) < 2:
+                continue
+            day_df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+            day_df = day_df.sort_values('date', kind='stable').reset_index(drop=True)
+            day_df.to_parquet(os.path.join(self.path, f'day={day}', f'part-{parts:08d}.parquet'), index=False)
+            bases[day] = parts
+            parts += 1
+        if not bases:
+            return 0
+
+        self.meta['parts'] = parts
+        self.meta.setdefault('day_bases', {}).update(bases)
+        self._save_meta()
+
+        for day, base in bases.items():
+            day_dir = os.path.join(self.path, f'day={day}')
+            for name in os.listdir(day_dir):
+                match = PART_PATTERN.match(name)
+                if match and int(match.group(1)) < base:
+                    os.remove(os.path.join(day_dir, name))
+        return len(bases)
+
+    def read(self, start=None, end=None) -> pd.DataFrame:
+        """Читает транзакции канала (опционально только за диапазон дат [start, end])"""
+        start_day = pd.Timestamp(start).strftime('%Y-%m-%d') if start is not None else None
+        end_day = pd.Timestamp(end).strftime('%Y-%m-%d') if end is not None else None
+        files = self._part_files(start_day, end_day)
+        if not files:
+            return pd.DataFrame({'date': pd.Series(dtype='datetime64[ns]'), 'btc': pd.Series(dtype='float64')})
+
+        df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+        df = df.sort_values('date', kind='stable').reset_index(drop=True)
+        if start is not None:
+            df = df[df['date'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['date'] <= pd.Timestamp(end)]
+        return df.reset_index(drop=True)
+
+    def retire_legacy_csv(self, filename: str):
+        """
+        Старый CSV канала (date, btc, last_timestamp) в хранилище не переносится: его суммы
+        разобраны прежним регулярным выражением, которое брало только последние три цифры
+        ('1,500 BTC' -> 500, '2,000 BTC' -> 0), и смешались бы с полными суммами message_parser.
+        Для пустого хранилища файл переименовывается в <имя>.legacy.csv, а история канала
+        загружается заново текущим парсером. Возвращает новое имя файла или None.
+        """
+        if not self.is_empty() or not os.path.exists(filename):
+            return None
+        legacy_filename = os.path.splitext(filename)[0] + '.legacy.csv'
+        os.replace(filename, legacy_filename)
+        return legacy_filename
+
+    def export_csv(self, filename: str) -> str:
+        """Выгружает хранилище в CSV для скриптов, которые читают плоские файлы"""
+        df = self.read()
+        df['date'] = df['date'].dt.strftime('%Y-%m-%d %H:%M:%S')
+        df.to_csv(filename, index=False)
+        return filename
+
+
+class GroupCommitWriter:
+    """
+    Групповая запись live-транзакций в хранилища каналов.
+    Строки копятся в памяти и сбрасываются одним append на канал,
+    как только набралось max_rows строк или прошло max_delay секунд с первой несохраненной.
+    Вместе со строками фиксируется контрольная точка канала - наибольший id увиденного сообщения,
+    но не дальше начала незаполненного пропуска (hold), чтобы после сбоя пропуск догрузился заново.
+    Строки сообщений после начала пропуска тоже ждут в памяти, пока пропуск не заполнен:
+    иначе водяной знак ушел бы дальше времени пропущенных сообщений и append отбросил бы их.
+    После записи вызывается on_commit(channel_name, rows_df), если он задан;
+    on_flush() - перед записью, чтобы связанные данные фиксировались не позже контрольной точки.
+    """
+
+    def __init__(self, get_store, max_rows: int = 50, max_delay: float = 5.0, on_commit=None, on_flush=None):
+        self.get_store = get_store
+        self.on_commit = on_commit
+        self.on_flush = on_flush
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.pending = {}
+        self.pending_rows = 0
+        self.first_pending_at = None
+        self.message_ids = {}
+        self.holds = {}
+
+    def add(self, channel_name: str, date, btc: float, message_id: int = None):
+        self.pending.setdefault(channel_name, []).append((pd.Timestamp(date), btc, message_id))
+        self.pending_rows += 1
+        self.mark(channel_name, message_id)
+        if self.pending_rows >= self.max_rows:
+            self.flush()
+
+    def rows(self, channel_name: str) -> pd.DataFrame:
+        """Несохраненные строки канала (date, btc), в том числе ждущие заполнения пропуска"""
+        return pd.DataFrame({'date': pd.to_datetime([row[0] for row in self.pending.get(channel_name, [])]),
+                             'btc': [float(row[1]) for row in self.pending.get(channel_name, [])]})
+
+    def mark(self, channel_name: str, message_id: int = None):
+        """Учитывает обработанное сообщение (в том числе без транзакции) для контрольной точки"""
+        if message_id is not None and message_id > self.message_ids.get(channel_name, 0):
+            self.message_ids[channel_name] = message_id
+        if self.first_pending_at is None:
+            self.first_pending_at = time.monotonic()
+
+    def hold(self, channel_name: str, message_id: int):
+        """Не фиксировать контрольную точку дальше message_id, пока пропуск после него не заполнен"""
+        self.holds.setdefault(channel_name, set()).add(message_id)
+
+    def release(self, channel_name: str, message_id: int):
+        self.holds.get(channel_name, set()).discard(message_id)
+        if (channel_name in self.message_ids or self.pending.get(channel_name)) and self.first_pending_at is None:
+            self.first_pending_at = time.monotonic()
+
+    def checkpoint(self, channel_name: str):
+        """id, который можно зафиксировать для канала, или None"""
+        message_id = self.message_ids.get(channel_name)
+        holds = self.holds.get(channel_name)
+        if message_id is not None and holds:
+            message_id = min(message_id, min(holds))
+        return message_id
+
+    def due(self) -> bool:
+        return self.first_pending_at is not None and time.monotonic() - self.first_pending_at >= self.max_delay
+
+    def flush(self) -> int:
+        """Сбрасывает накопленные строки; водяной знак и контрольная точка сдвигаются вместе с записью"""
+        added = 0
+        # Например, запись архива исходных сообщений
+        if self.on_flush is not None:
+            self.on_flush()
+        held = {}
+        for channel_name in set(self.pending) | set(self.message_ids):
+            rows = self.pending.get(channel_name, [])
+            holds = self.holds.get(channel_name)
+            if holds:
+                # Пишем только строки до начала пропуска, остальные ждут его заполнения
+                hold_id = min(holds)
+                held_rows = [row for row in rows if row[2] is not None and row[2] > hold_id]
+                if held_rows:
+                    held[channel_name] = held_rows
+                    rows = [row for row in rows if row[2] is None or row[2] <= hold_id]
+            store = self.get_store(channel_name)
+            if rows:
+                rows_df = pd.DataFrame([row[:2] for row in rows], columns=['date', 'btc'])
+                added += store.append(rows_df, last_message_id=self.checkpoint(channel_name))
+                # Например, обновление дневных представлений
+                if self.on_commit is not None:
+                    self.on_commit(channel_name, rows_df)
+            else:
+                store.commit_checkpoint(self.checkpoint(channel_name))
+            if not self.holds.get(channel_name):
+                self.message_ids.pop(channel_name, None)
+        self.pending = held
+        self.pending_rows = sum(len(rows) for rows in held.values())
+        # Отложенные строки сбросятся после release
+        self.first_pending_at = None
+        return added
+
+    async def run(self, poll_interval: float = 1.0):
+        """Фоновая задача: сбрасывает строки по таймеру, даже если новых сообщений нет"""
+        while True:
+            await asyncio.sleep(poll_interval)
+            if self.due():
+                self.flush()
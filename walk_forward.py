@@ -0,0 +1,202 @@
+import importlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+
+from day_baskets import DayBaskets
+from instrumentation import stage
+from paths import MOVEMENTS_FILE, WALK_FORWARD_FILE
+from movement_features import build_sparse_features, transform_features
+
+# Матрицы признаков, подключенные в процессе-исполнителе: {(min_support, окно, фолд): (csr, [SharedMemory])}
+_worker_matrices = {}
+
+
+def make_target(df: pd.DataFrame, forecast_window: int) -> np.ndarray:
+    """Целевая переменная: 1, если цена через forecast_window дней выросла (колонка '+Nd')"""
+    column = f'+{forecast_window}d'
+    if column not in df.columns:
+        available = [col for col in df.columns if col.startswith('+')]
+        raise ValueError(f"Нет колонки {column} для окна прогноза {forecast_window}. Доступны: {available}")
+    price_change = df[column].astype(str).str.rstrip('%').astype(float).to_numpy()
+    target = (price_change > 0).astype(float)
+    target[np.isnan(price_change)] = np.nan
+    return target
+
+
+def fold_features(baskets: DayBaskets, fit_end: int, test_end: int, min_support: int, max_itemset_len: int):
+    """
+    Признаки фолда без заглядывания вперед: суммы и частые наборы выбираются только по дням
+    [0, fit_end), затем по этим колонкам строятся строки [0, test_end)
+    """
+    _, transaction_map, itemsets, _ = build_sparse_features(baskets[:fit_end], min_support=min_support,
+                                                            max_itemset_len=max_itemset_len)
+    return transform_features(baskets[:test_end], transaction_map, itemsets)
+
+
+def walk_forward_splits(n_samples: int, n_folds: int = 5, min_train: int = 60) -> list:
+    """Расширяющееся окно: обучение на [0, train_end), проверка на [train_end, test_end)"""
+    if n_samples <= min_train:
+        raise ValueError(f"Недостаточно данных для walk-forward: {n_samples} строк при min_train={min_train}")
+    fold_size = (n_samples - min_train) // n_folds
+    if fold_size == 0:
+        raise ValueError("Слишком много фолдов для такого объема данных")
+    return [(min_train + i * fold_size, min_train + (i + 1) * fold_size if i < n_folds - 1 else n_samples)
+            for i in range(n_folds)]
+
+
+def _share_array(array: np.ndarray):
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _share_matrix(X: sp.csr_matrix):
+    """Кладет массивы CSR-матрицы в разделяемую память; возвращает блоки и их описание"""
+    blocks, specs = [], []
+    for array in (X.data, X.indices, X.indptr):
+        shm, spec = _share_array(array)
+        blocks.append(shm)
+        specs.append(spec)
+    return blocks, (specs, X.shape)
+
+
+def _attach_matrix(matrix_spec):
+    array_specs, shape = matrix_spec
+    blocks, arrays = [], []
+    for name, array_shape, dtype in array_specs:
+        shm = shared_memory.SharedMemory(name=name)
+        blocks.append(shm)
+        arrays.append(np.ndarray(array_shape, dtype=np.dtype(dtype), buffer=shm.buf))
+    # CSR-матрица поверх разделяемых буферов, без копирования
+    return sp.csr_matrix(tuple(arrays), shape=shape, copy=False), blocks
+
+
+def _init_worker(matrix_specs):
+    for key, matrix_spec in matrix_specs.items():
+        _worker_matrices[key] = _attach_matrix(matrix_spec)
+
+
+def _evaluate(params: dict, target: np.ndarray, splits: list) -> list:
+    """
+    Задача для процесса: обучает и проверяет модель на всех фолдах для одного набора параметров.
+    Последние forecast_window обучающих строк перед train_end отбрасываются: их метки
+    смотрят в период проверки.
+    """
+    records = []
+    for fold, (train_end, test_end) in enumerate(splits):
+        X, _ = _worker_matrices[(params['min_support'], params['forecast_window'], fold)]
+        fit_end = max(train_end - params['forecast_window'], 0)
+        train_rows = np.flatnonzero(~np.isnan(target[:fit_end]))
+        test_rows = train_end + np.flatnonzero(~np.isnan(target[train_end:test_end]))
+        record = dict(params, fold=fold, train_size=len(train_rows), test_size=len(test_rows))
+
+        start = time.perf_counter()
+        model = RandomForestClassifier(
+            n_estimators=params['n_estimators'],
+            max_depth=params['max_depth'],
+            min_samples_leaf=params['min_samples_leaf'],
+            random_state=42,
+            n_jobs=1
+        )
+        model.fit(X[train_rows], target[train_rows])
+        predicted = model.predict(X[test_rows])
+        actual = target[test_rows]
+
+        record.update({
+            'accuracy': accuracy_score(actual, predicted),
+            'precision': precision_score(actual, predicted, zero_division=0),
+            'recall': recall_score(actual, predicted, zero_division=0),
+            'f1': f1_score(actual, predicted, zero_division=0),
+            'up_share': float(actual.mean()) if len(actual) else np.nan,
+            'seconds': time.perf_counter() - start
+        })
+        records.append(record)
+    return records
+
+
+@stage('walk_forward')
+def run_parameter_sweep(df: pd.DataFrame, baskets: DayBaskets = None, forecast_windows=(3,), max_depths=(5,), min_samples_leafs=(5,),
+                        min_supports=(2,), max_itemset_len: int = 2, n_estimators: int = 100,
+                        n_folds: int = 5, min_train: int = 60, n_jobs=None) -> pd.DataFrame:
+    """
+    Walk-forward оценка модели движения цены с перебором параметров на пуле процессов.
+    Признаки строятся по каждому фолду (порог поддержки × окно прогноза) только по обучающим дням
+    без последних forecast_window строк и передаются исполнителям через разделяемую память, а не pickle.
+    Возвращает метрики по каждому фолду и время обучения.
+    baskets - корзины дней из create_combined_dataset; без них берется колонка transactions (списки).
+    """
+    sweep_start = time.perf_counter()
+    if baskets is None:
+        baskets = DayBaskets.from_lists(df['transactions'].tolist())
+    splits = walk_forward_splits(len(df), n_folds, min_train)
+
+    blocks, matrix_specs = [], {}
+    try:
+        for min_support, window in product(min_supports, forecast_windows):
+            for fold, (train_end, test_end) in enumerate(splits):
+                X = fold_features(baskets, max(train_end - window, 0), test_end, min_support, max_itemset_len)
+                matrix_blocks, matrix_specs[(min_support, window, fold)] = _share_matrix(X.astype(np.float32))
+                blocks.extend(matrix_blocks)
+            print(f"Порог поддержки {min_support}, окно {window}: {X.shape[1]} признаков в последнем фолде")
+
+        targets = {window: make_target(df, window) for window in forecast_windows}
+        grid = [
+            {'forecast_window': window, 'max_depth': depth, 'min_samples_leaf': leaf,
+             'min_support': min_support, 'n_estimators': n_estimators}
+            for window, depth, leaf, min_support in product(forecast_windows, max_depths, min_samples_leafs, min_supports)
+        ]
+        print(f"Комбинаций параметров: {len(grid)}, фолдов: {len(splits)}")
+
+        records = []
+        with ProcessPoolExecutor(max_workers=n_jobs or os.cpu_count(),
+                                 initializer=_init_worker, initargs=(matrix_specs,)) as executor:
+            futures = [executor.submit(_evaluate, params, targets[params['forecast_window']], splits)
+                       for params in grid]
+            for future in futures:
+                records.extend(future.result())
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    results = pd.DataFrame(records)
+    print(f"\nПеребор завершен за {time.perf_counter() - sweep_start:.1f} с")
+    return results
+
+
+def summarize_sweep(results: pd.DataFrame) -> pd.DataFrame:
+    """Средние метрики по фолдам для каждой комбинации параметров, лучшие сверху"""
+    params = ['forecast_window', 'max_depth', 'min_samples_leaf', 'min_support']
+    return (results.groupby(params)[['accuracy', 'precision', 'recall', 'f1', 'seconds']]
+            .mean()
+            .sort_values('f1', ascending=False)
+            .reset_index())
+
+
+if __name__ == "__main__":
+    movements = importlib.import_module('04_compare_bigBtc_movements_and_transactions')
+    df, baskets = movements.create_combined_dataset(
+        MOVEMENTS_FILE,
+        bots=('whalebot',)
+    )
+
+    results = run_parameter_sweep(
+        df.reset_index(drop=True),
+        baskets,
+        forecast_windows=(3,),
+        max_depths=(3, 5, 8),
+        min_samples_leafs=(2, 5, 10),
+        min_supports=(2, 5, 20)
+    )
+    results.to_csv(WALK_FORWARD_FILE, index=False)
+    print(f"\nРезультаты по фолдам сохранены в {WALK_FORWARD_FILE}")
+    print(summarize_sweep(results).head(10))